@@ -8,8 +8,9 @@ from .ai_dm import AIDungeonMaster
 adm=AIDungeonMaster()
 
 class AdventureHandler:
-    def __init__(self, sio, connected_clients):
+    def __init__(self, sio, connected_clients, delivery):
         self.sio = sio
+        self.delivery = delivery  # emits go through the per-connection outbound queues
         self.connected_clients = connected_clients
         self.adventure_rooms = {}
         self.room_counter = 1
@@ -27,13 +28,13 @@ class AdventureHandler:
         # Notify all players whose turn it is
         current_player = ai_dm.players.get(current_player_sid)
         if current_player:
-            await self.sio.emit("turn_notification", {
+            await self.delivery.emit("turn_notification", {
                 "player_name": current_player.name,
                 "message": f"It's {current_player.name}'s turn!"
             }, room=room_id)
 
         # suggested_actions = ai_dm._generate_potential_actions()
-#         await self.sio.emit("suggested_actions", {"actions": suggested_actions.split("\n")}, to=current_player_sid)
+#         await self.delivery.emit("suggested_actions", {"actions": suggested_actions.split("\n")}, to=current_player_sid)
 
     async def start_encounter(self, sid, data):
         room_id = data.get("room_id")
@@ -42,7 +43,7 @@ class AdventureHandler:
         if ai_dm:
             ai_dm.start_encounter(enemies)
             summary = ai_dm.generate_turn_summary()
-            await self.sio.emit("encounter_started", {"enemies": enemies, "turn_summary": summary}, room=room_id)
+            await self.delivery.emit("encounter_started", {"enemies": enemies, "turn_summary": summary}, room=room_id)
 
     async def start_adventure(self, sid, data):
 
@@ -59,7 +60,7 @@ class AdventureHandler:
         if not story:
             story= await adm.generate_story(theme,tonality)
         if not users_to_add:
-            await self.sio.emit("server_message", {"text from server": "Please specify users to invite to the adventure!"}, to=sid)
+            await self.delivery.emit("server_message", {"text from server": "Please specify users to invite to the adventure!"}, to=sid)
             return
 
         self.adventure_rooms[room_id] = {
@@ -70,7 +71,7 @@ class AdventureHandler:
         }
 
         await self.sio.enter_room(sid, room_id)
-        await self.sio.emit("server_message", {
+        await self.delivery.emit("server_message", {
             "text from server": f"Adventure room '{room_id}' created! Story: {story}. Invited users: {', '.join(users_to_add)}"
         }, to=sid)
         await self._notify_invited_users(room_id, users_to_add, sid)
@@ -79,18 +80,18 @@ class AdventureHandler:
         room_id = data.get("room_id", "").strip()
         player_role = data.get("role", "").strip()
         if not room_id or not player_role:
-            await self.sio.emit("server_message", {"text from server": "Usage: /joinadventure <room_id> <player_role>"}, to=sid)
+            await self.delivery.emit("server_message", {"text from server": "Usage: /joinadventure <room_id> <player_role>"}, to=sid)
             return
         if room_id not in self.adventure_rooms:
-            await self.sio.emit("server_message", {"text from server": f"Adventure room '{room_id}' not found!"}, to=sid)
+            await self.delivery.emit("server_message", {"text from server": f"Adventure room '{room_id}' not found!"}, to=sid)
             return
         adventure = self.adventure_rooms[room_id]
         username = self.connected_clients[sid]
         if username not in adventure["invited_users"]:
-            await self.sio.emit("server_message", {"text from server": f"You are not invited to adventure '{room_id}'!"}, to=sid)
+            await self.delivery.emit("server_message", {"text from server": f"You are not invited to adventure '{room_id}'!"}, to=sid)
             return
         if sid in adventure["players"]:
-            await self.sio.emit("server_message", {"text from server": f"You are already in adventure '{room_id}' as {adventure['players'][sid]}!"}, to=sid)
+            await self.delivery.emit("server_message", {"text from server": f"You are already in adventure '{room_id}' as {adventure['players'][sid]}!"}, to=sid)
             return
         await self.sio.enter_room(sid, room_id)
         
@@ -100,10 +101,10 @@ class AdventureHandler:
         adventure["players"][sid] = player
         self.ai_dms[room_id].add_player(player)
         
-        await self.sio.emit("server_message", {
+        await self.delivery.emit("server_message", {
             "text from server": f"You joined adventure '{room_id}' as {player_role}!"
         }, to=sid)
-        await self.sio.emit("adventure_message", {
+        await self.delivery.emit("adventure_message", {
             "room_id": room_id,
             "message": f"{username} joined the adventure as {player_role}!",
             "timestamp": data.get("timestamp", ""),
@@ -114,27 +115,27 @@ class AdventureHandler:
         room_id = data.get("room_id", "").strip()
         message = data.get("message", "")
         if not room_id or not message:
-            await self.sio.emit("server_message", {"text from server": "Room ID and message are required!"}, to=sid)
+            await self.delivery.emit("server_message", {"text from server": "Room ID and message are required!"}, to=sid)
             return
         if room_id not in self.adventure_rooms:
-            await self.sio.emit("server_message", {"text from server": f"Adventure room '{room_id}' not found!"}, to=sid)
+            await self.delivery.emit("server_message", {"text from server": f"Adventure room '{room_id}' not found!"}, to=sid)
             return
         adventure = self.adventure_rooms[room_id]
         user_rooms = self.sio.rooms(sid)
         if room_id not in user_rooms:
-            await self.sio.emit("server_message", {"text from server": f"You are not in adventure '{room_id}'!"}, to=sid)
+            await self.delivery.emit("server_message", {"text from server": f"You are not in adventure '{room_id}'!"}, to=sid)
             return
         
         # Get AI DM for this room
         ai_dm = self.ai_dms.get(room_id)
         if not ai_dm:
-            await self.sio.emit("server_message", {"text from server": "AI DM not found for this room!"}, to=sid)
+            await self.delivery.emit("server_message", {"text from server": "AI DM not found for this room!"}, to=sid)
             return
         
         # Check if player can act (not dead/fainted)
         player = ai_dm.players.get(sid)
         if player and not player.can_act():
-            await self.sio.emit("server_message", {"text from server": "You cannot act while incapacitated!"}, to=sid)
+            await self.delivery.emit("server_message", {"text from server": "You cannot act while incapacitated!"}, to=sid)
             return
         
         # Parse player intent and process action
@@ -146,7 +147,7 @@ class AdventureHandler:
             narration = await ai_dm.narrate("Player action", intent, action_result)
             
             # Send action result and narration
-            await self.sio.emit("adventure_message", {
+            await self.delivery.emit("adventure_message", {
                 "room_id": room_id,
                 "sender_name": self.connected_clients[sid],
                 "sender_role": player.role,
@@ -160,12 +161,12 @@ class AdventureHandler:
             await self.handle_next_turn(room_id)
             # Send turn summary
             turn_summary = ai_dm.generate_turn_summary()
-            await self.sio.emit("turn_summary", turn_summary, room=room_id)
+            await self.delivery.emit("turn_summary", turn_summary, room=room_id)
           
         else:
             # DM message - no action processing
             sender_role = "DM" if sid == adventure["dm"] else "Unknown"
-            await self.sio.emit("adventure_message", {
+            await self.delivery.emit("adventure_message", {
                 "room_id": room_id,
                 "sender_name": self.connected_clients[sid],
                 "sender_role": sender_role,
@@ -178,15 +179,15 @@ class AdventureHandler:
         room_id = data.get("room_id", "").strip()
         ai_dm = self.ai_dms.get(room_id)
         if not room_id:
-            await self.sio.emit("server_message", {"text from server": "Room ID is required!"}, to=sid)
+            await self.delivery.emit("server_message", {"text from server": "Room ID is required!"}, to=sid)
             return
         if room_id not in self.adventure_rooms:
-            await self.sio.emit("server_message", {"text from server": f"Adventure room '{room_id}' not found!"}, to=sid)
+            await self.delivery.emit("server_message", {"text from server": f"Adventure room '{room_id}' not found!"}, to=sid)
             return
         adventure = self.adventure_rooms[room_id]
         user_rooms = self.sio.rooms(sid)
         if room_id not in user_rooms:
-            await self.sio.emit("server_message", {"text from server": f"You are not in adventure '{room_id}'!"}, to=sidadventure_5)
+            await self.delivery.emit("server_message", {"text from server": f"You are not in adventure '{room_id}'!"}, to=sidadventure_5)
             return
         players_info = []
         for player_sid, player in adventure["players"].items():
@@ -194,7 +195,7 @@ class AdventureHandler:
             players_info.append(f"{player_name} ({player.role})")
 
         dm_name = self.connected_clients.get(adventure["dm"], "Unknown")
-        await self.sio.emit("adventure_info", {
+        await self.delivery.emit("adventure_info", {
             "room_id": room_id,
             "story": ai_dm.current_story() or adventure["story"],
             "dm": dm_name,
@@ -205,7 +206,7 @@ class AdventureHandler:
     async def cleanup_on_disconnect(self, sid):
         for room_id, adventure in list(self.adventure_rooms.items()):
             if adventure["dm"] == sid:
-                await self.sio.emit("adventure_message", {
+                await self.delivery.emit("adventure_message", {
                     "room_id": room_id,
                     "message": f"DM {self.connected_clients[sid]} has disconnected. Adventure ended.",
                     "timestamp": "",
@@ -221,7 +222,7 @@ class AdventureHandler:
                 if room_id in self.ai_dms:
                     self.ai_dms[room_id].remove_player(sid)
                 del adventure["players"][sid]
-                await self.sio.emit("adventure_message", {
+                await self.delivery.emit("adventure_message", {
                     "room_id": room_id,
                     "message": f"{self.connected_clients[sid]} ({player.role if hasattr(player, 'role') else 'Unknown'}) has disconnected.",
                     "timestamp": "",
@@ -238,7 +239,7 @@ class AdventureHandler:
                     target_sid = user_sid
                     break
             if target_sid:
-                await self.sio.emit("adventure_invitation", {
+                await self.delivery.emit("adventure_invitation", {
                     "room_id": room_id,
                     "story": ai_dm.current_story(),
                     "dm": self.connected_clients[dm_sid],
@@ -261,23 +262,23 @@ class AdventureHandler:
         action = data.get("action")
         
         if not room_id or room_id not in self.adventure_rooms:
-            await self.sio.emit("server_message", {"text from server": "Invalid room!"}, to=sid)
+            await self.delivery.emit("server_message", {"text from server": "Invalid room!"}, to=sid)
             return
             
         ai_dm = self.ai_dms.get(room_id)
         if not ai_dm:
-            await self.sio.emit("server_message", {"text from server": "AI DM not found!"}, to=sid)
+            await self.delivery.emit("server_message", {"text from server": "AI DM not found!"}, to=sid)
             return
             
         player = ai_dm.players.get(sid)
         if not player or not player.can_act():
-            await self.sio.emit("server_message", {"text from server": "Cannot perform action!"}, to=sid)
+            await self.delivery.emit("server_message", {"text from server": "Cannot perform action!"}, to=sid)
             return
             
         action_result = ai_dm.process_action(player, data)
         narration = ai_dm.narrate("Explicit action", data, action_result)
         
-        await self.sio.emit("adventure_message", {
+        await self.delivery.emit("adventure_message", {
             "room_id": room_id,
             "sender_name": self.connected_clients[sid],
             "sender_role": player.role,
@@ -300,7 +301,7 @@ class AdventureHandler:
         room_id = data.get("room_id")
         if room_id and room_id in self.adventure_rooms:
             # Send to room if in adventure
-            await self.sio.emit("adventure_message", {
+            await self.delivery.emit("adventure_message", {
                 "room_id": room_id,
                 "sender_name": self.connected_clients[sid],
                 "message": f"🎲 Rolled {result} (d{sides}{'+' if modifier >= 0 else ''}{modifier if modifier != 0 else ''})",
@@ -309,7 +310,7 @@ class AdventureHandler:
             }, room=room_id)
         else:
             # Send to individual if not in room
-            await self.sio.emit("dice_result", {"result": result, "sides": sides, "modifier": modifier}, to=sid)
+            await self.delivery.emit("dice_result", {"result": result, "sides": sides, "modifier": modifier}, to=sid)
 
     async def handle_stats(self, sid, room_id):
         """Send player stats to the user"""
@@ -325,15 +326,15 @@ class AdventureHandler:
             ai_dm = self.ai_dms[room_id]
             player = ai_dm.players.get(sid)
             if player:
-                await self.sio.emit("player_stats", player.stats.to_dict(), to=sid)
+                await self.delivery.emit("player_stats", player.stats.to_dict(), to=sid)
                 return
 
         # Fallback for non-adventure rooms
         player = self.get_player(sid)
         if player:
-            await self.sio.emit("player_stats", player.stats.to_dict(), to=sid)
+            await self.delivery.emit("player_stats", player.stats.to_dict(), to=sid)
         else:
-            await self.sio.emit("server_message", {"text from server": "Player not found."}, to=sid)
+            await self.delivery.emit("server_message", {"text from server": "Player not found."}, to=sid)
 
     async def handle_inventory(self, sid, data):
         """Send player inventory to the user"""
@@ -343,15 +344,15 @@ class AdventureHandler:
             ai_dm = self.ai_dms[room_id]
             player = ai_dm.players.get(sid)
             if player:
-                await self.sio.emit("player_inventory", {"inventory": player.inventory}, to=sid)
+                await self.delivery.emit("player_inventory", {"inventory": player.inventory}, to=sid)
                 return
         
         # Fallback for non-adventure rooms
         player = self.get_player(sid)
         if player:
-            await self.sio.emit("player_inventory", {"inventory": player.inventory}, to=sid)
+            await self.delivery.emit("player_inventory", {"inventory": player.inventory}, to=sid)
         else:
-            await self.sio.emit("server_message", {"text from server": "Player not found."}, to=sid)
+            await self.delivery.emit("server_message", {"text from server": "Player not found."}, to=sid)
 
     def parse_story_file(self, story_file_path: str):
         pass
@@ -1,26 +1,105 @@
 """
 Authentication module for the chat application
 """
+import asyncio
 from aiohttp import web
-from aiohttp_session import setup as setup_session, get_session, new_session
-from aiohttp_session.cookie_storage import EncryptedCookieStorage
+from aiohttp_session import setup as setup_session, get_session, new_session, AbstractStorage, Session
 import base64
+import hashlib
+import hmac
 import os
+import secrets
 from pathlib import Path
-from persistence.authdb import get_user_by_email, get_user_by_username, create_user, verify_password, init_auth_db
+from persistence.passwords import password_hasher, needs_rehash, PasswordBusyError
+from persistence.authdb import get_cached_session
+from persistence.async_authdb import get_user_by_email, get_user_by_username, create_user, update_password_hash
+from persistence.async_authdb import (
+    load_session as load_session_db,
+    save_session as save_session_db,
+    delete_session as delete_session_db,
+)
 import functools
 
 # Get the static directory path
 STATIC_DIR = Path(__file__).parent / "static"
 
+# Registered usernames allowed to use the /admin endpoints (comma-separated)
+ADMIN_USERNAMES = {name.strip() for name in os.getenv('CHAT_ADMIN_USERS', '').split(',') if name.strip()}
+
+# Seconds a client is told to wait when every password worker is busy
+PASSWORD_RETRY_AFTER = os.getenv('PASSWORD_RETRY_AFTER', '2')
+
+# Background rehash tasks, referenced so they aren't garbage collected mid-run
+_rehash_tasks = set()
+
+SESSION_MAX_AGE = int(os.getenv('SESSION_MAX_AGE_SECONDS', str(30 * 24 * 3600)))
+# Key that signs session cookies; created on first boot and kept so restarts don't log everyone out
+SESSION_SECRET_FILE = os.getenv('SESSION_SECRET_FILE', str(Path(__file__).parent / "session_secret.key"))
+
+
+def load_secret_key(path=SESSION_SECRET_FILE):
+    """Read the session signing key, creating it (mode 0600) if it doesn't exist yet"""
+    try:
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    except FileExistsError:
+        with open(path, 'rb') as f:
+            return f.read()
+    key = os.urandom(32)
+    with os.fdopen(fd, 'wb') as f:
+        f.write(key)
+    return key
+
+
+class ServerSessionStorage(AbstractStorage):
+    """
+    Sessions kept in the auth database behind an in-memory LRU. The cookie
+    holds only "<session id>.<HMAC>", so a request resolves its session with
+    one signature check and a dict lookup.
+    """
+
+    def __init__(self, secret_key, max_age=SESSION_MAX_AGE):
+        super().__init__(max_age=max_age, httponly=True, samesite='Lax')
+        self._secret_key = secret_key
+
+    def _signature(self, session_id):
+        return hmac.new(self._secret_key, session_id.encode(), hashlib.sha256).hexdigest()
+
+    def session_id_from_cookie(self, cookie):
+        """Session id from a cookie value, or None if the signature doesn't match"""
+        session_id, _, signature = (cookie or '').rpartition('.')
+        if session_id and hmac.compare_digest(signature, self._signature(session_id)):
+            return session_id
+        return None
+
+    async def load_session(self, request):
+        session_id = self.session_id_from_cookie(self.load_cookie(request))
+        data = None
+        if session_id:
+            data = get_cached_session(session_id)
+            if data is None:
+                data = await load_session_db(session_id)
+        if data is None:
+            return Session(None, data=None, new=True, max_age=self.max_age)
+        return Session(session_id, data=data, new=False, max_age=self.max_age)
+
+    async def save_session(self, request, response, session):
+        session_id = session.identity
+        if session.empty:
+            if session_id:
+                await delete_session_db(session_id)
+            self.save_cookie(response, '', max_age=session.max_age)
+            return
+        if session_id is None:
+            session_id = secrets.token_urlsafe(32)
+            session.set_new_identity(session_id)
+        await save_session_db(session_id, self._get_session_data(session), session.max_age or self.max_age)
+        self.save_cookie(response, f'{session_id}.{self._signature(session_id)}', max_age=session.max_age)
+
 
 def setup_auth(app):
     """Setup authentication for the application"""
-    # Generate a secret key for cookie encryption (32 bytes)
-    secret_key = os.urandom(32)
-    
-    # Setup session with encrypted cookies
-    setup_session(app, EncryptedCookieStorage(secret_key))
+    # Server-side sessions; the cookie only carries the signed session id
+    setup_session(app, ServerSessionStorage(load_secret_key()))
     
     return app
 
@@ -41,8 +120,11 @@ async def get_current_user(request):
 
 
 async def login_user(request, user_data):
-    """Log in a user by setting session data"""
-    session = await get_session(request)
+    """Log in a user in a fresh session, so a session id issued before login can't be reused"""
+    previous = await get_session(request)
+    if previous.identity:
+        await delete_session_db(previous.identity)
+    session = await new_session(request)
     session['user_id'] = user_data['id']
     session['username'] = user_data['useruid']
     session['email'] = user_data.get('email')
@@ -67,6 +149,35 @@ def require_auth(handler):
     return wrapper
 
 
+def require_admin(handler):
+    """Decorator to restrict a handler to registered users listed in CHAT_ADMIN_USERS"""
+    @functools.wraps(handler)
+    async def wrapper(request):
+        user = await get_current_user(request)
+        if not user['is_authenticated']:
+            return web.json_response({'error': 'Authentication required'}, status=401)
+        if user['is_anonymous'] or user['username'] not in ADMIN_USERNAMES:
+            return web.json_response({'error': 'Forbidden'}, status=403)
+        request['user'] = user
+        return await handler(request)
+    return wrapper
+
+
+def password_busy_response():
+    return web.json_response({'error': 'Server busy, please try again'}, status=503,
+                             headers={'Retry-After': PASSWORD_RETRY_AFTER})
+
+
+async def rehash_password(user_id, password):
+    """Re-hash a password at the current BCRYPT_ROUNDS after a successful login"""
+    try:
+        await update_password_hash(user_id, await password_hasher.hash(password))
+    except PasswordBusyError:
+        pass  # try again on the next login
+    except Exception as e:
+        print(f"Error rehashing password for user {user_id}: {e}")
+
+
 # Login and registration handlers
 async def login_handler(request):
     """Handle login form submission"""
@@ -82,10 +193,10 @@ async def login_handler(request):
             return web.json_response({'error': 'Password is required'}, status=400)
         
         # First try by email
-        user_data = get_user_by_email(username)
+        user_data = await get_user_by_email(username)
         if not user_data:
             # Then try by username
-            user_data = get_user_by_username(username)
+            user_data = await get_user_by_username(username)
         
         if not user_data:
             return web.json_response({'error': 'Invalid credentials'}, status=401)
@@ -97,7 +208,15 @@ async def login_handler(request):
         if not user_data['password_hash']:
             return web.json_response({'error': 'Invalid credentials'}, status=401)
         
-        if verify_password(password, user_data['password_hash']):
+        try:
+            valid = await password_hasher.verify(password, user_data['password_hash'])
+        except PasswordBusyError:
+            return password_busy_response()
+        if valid:
+            if needs_rehash(user_data['password_hash']):
+                task = asyncio.create_task(rehash_password(user_data['id'], password))
+                _rehash_tasks.add(task)
+                task.add_done_callback(_rehash_tasks.discard)
             await login_user(request, user_data)
             return web.json_response({'success': True, 'username': user_data['useruid']})
         else:
@@ -132,15 +251,20 @@ async def register_handler(request):
             return web.json_response({'error': 'Password must be at least 6 characters'}, status=400)
         
         # Check if user already exists
-        if get_user_by_username(username):
+        if await get_user_by_username(username):
             return web.json_response({'error': 'Username already exists'}, status=400)
         
-        if get_user_by_email(email):
+        if await get_user_by_email(email):
             return web.json_response({'error': 'Email already registered'}, status=400)
         
+        try:
+            password_hash = await password_hasher.hash(password)
+        except PasswordBusyError:
+            return password_busy_response()
+
         # Create new user
         try:
-            user_id = create_user(username, email, password, is_anonymous=False)
+            user_id = await create_user(username, email, is_anonymous=False, password_hash=password_hash)
             user_data = {
                 'id': user_id,
                 'useruid': username,
@@ -165,7 +289,7 @@ async def anonymous_login_handler(request):
         return web.json_response({'error': 'Username is required'}, status=400)
     
     # Check if username is already taken by a registered user
-    existing_user = get_user_by_username(username)
+    existing_user = await get_user_by_username(username)
     if existing_user and not existing_user['is_anonymous']:
         return web.json_response({'error': 'Username is already taken by a registered user'}, status=400)
     
@@ -174,7 +298,7 @@ async def anonymous_login_handler(request):
         if existing_user and existing_user['is_anonymous']:
             user_id = existing_user['id']
         else:
-            user_id = create_user(username, is_anonymous=True)
+            user_id = await create_user(username, is_anonymous=True)
         
         user_data = {
             'id': user_id,
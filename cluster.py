@@ -0,0 +1,331 @@
+"""
+Multi-process mode for the chat server.
+
+With CHAT_WORKERS=N (N > 1), `python server.py` becomes a supervisor: it
+runs a pub/sub broker on a Unix domain socket (CHAT_BROKER_SOCKET) and
+keeps N worker processes running, all listening on the same port with
+SO_REUSEPORT.
+
+Each worker's Socket.IO server uses LocalBrokerManager, so room, sid and
+broadcast emits reach clients on every worker. connected_clients becomes a
+SharedPresence: every worker's sid -> username mapping, mirrored locally
+and kept current by the broker, which numbers every presence change; those
+numbers are the versions presence.py publishes. Set CHAT_PUBSUB_URL=redis://...
+to fan Socket.IO traffic out through Redis (or a Redis-compatible server) with
+AsyncRedisManager instead; presence still goes through the local broker.
+
+Workers accept only the websocket transport, because long-polling needs
+sticky sessions that a shared port can't provide. Adventure state, topic
+cooldowns and rate-limit buckets stay per worker. The membership, session
+and recent-history caches are turned off in workers (persistence.cache.
+WORKER_PROCESS), since nothing would tell them about another worker's writes.
+"""
+import asyncio
+import os
+import pickle
+import signal
+import struct
+import subprocess
+import sys
+from pathlib import Path
+from typing import Any, Optional
+from bidict import bidict
+import socketio
+
+WORKERS = int(os.getenv('CHAT_WORKERS', '1'))
+WORKER_INDEX = os.getenv('CHAT_WORKER_INDEX')  # set by the supervisor in each worker
+IS_WORKER = WORKER_INDEX is not None
+# Worker that runs the once-per-deployment background jobs (retention, maintenance)
+IS_PRIMARY = WORKER_INDEX in (None, '0')
+BROKER_SOCKET = os.getenv('CHAT_BROKER_SOCKET', str(Path(__file__).with_name('chat-broker.sock')))
+PUBSUB_URL = os.getenv('CHAT_PUBSUB_URL', '')
+RESTART_DELAY = 1.0
+
+# Frames are a 4-byte length followed by a pickled tuple; the socket is owner-only
+_HEADER = struct.Struct('!I')
+
+
+async def read_frame(reader: asyncio.StreamReader) -> tuple:
+    size, = _HEADER.unpack(await reader.readexactly(_HEADER.size))
+    return pickle.loads(await reader.readexactly(size))
+
+
+def write_frame(writer: asyncio.StreamWriter, frame: tuple):
+    payload = pickle.dumps(frame)
+    writer.write(_HEADER.pack(len(payload)) + payload)
+
+
+class Broker:
+    """Fans published messages out to every worker and owns the presence table"""
+
+    def __init__(self, path: str = BROKER_SOCKET):
+        self.path = path
+        self.writers = set()
+        self.presence = {}  # sid -> (username, writer of the worker holding the connection)
+        self.version = 0  # presence change sequence number, sent as the last element of presence frames
+        self._server = None
+
+    async def start(self):
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        self._server = await asyncio.start_unix_server(self._serve, path=self.path)
+        os.chmod(self.path, 0o600)
+
+    def _broadcast(self, frame: tuple):
+        for writer in list(self.writers):
+            if not writer.is_closing():
+                write_frame(writer, frame)
+
+    def _broadcast_presence(self, *frame):
+        self.version += 1
+        self._broadcast(frame + (self.version,))
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.writers.add(writer)
+        write_frame(writer, ('presence_snapshot', {sid: name for sid, (name, _) in self.presence.items()},
+                             self.version))
+        try:
+            while True:
+                frame = await read_frame(reader)
+                if frame[0] == 'publish':
+                    self._broadcast(('message',) + frame[1:])
+                elif frame[0] == 'presence_set':
+                    _, sid, username = frame
+                    self.presence[sid] = (username, writer)
+                    self._broadcast_presence('presence_set', sid, username)
+                elif frame[0] == 'presence_del':
+                    if self.presence.pop(frame[1], None) is not None:
+                        self._broadcast_presence('presence_del', frame[1])
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self.writers.discard(writer)
+            # A worker that went away takes its connections with it
+            for sid in [sid for sid, (_, owner) in self.presence.items() if owner is writer]:
+                del self.presence[sid]
+                self._broadcast_presence('presence_del', sid)
+            writer.close()
+
+    async def close(self):
+        if self._server is not None:
+            self._server.close()
+            for writer in list(self.writers):
+                writer.close()
+            await self._server.wait_closed()
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+
+class SharedPresence:
+    """
+    sid <-> username across all workers, with the bidict interface server.py
+    uses for connected_clients. Writes apply locally at once and reach the
+    other workers through the broker.
+    """
+
+    def __init__(self, client: 'BrokerClient'):
+        self._client = client
+        self._map = bidict()
+        self._local = {}  # sid -> username for connections held by this worker
+
+    @property
+    def inverse(self):
+        return self._map.inverse
+
+    def get(self, sid: str, default: Any = None) -> Any:
+        return self._map.get(sid, default)
+
+    def __getitem__(self, sid: str) -> str:
+        return self._map[sid]
+
+    def __contains__(self, sid: str) -> bool:
+        return sid in self._map
+
+    def __iter__(self):
+        return iter(self._map)
+
+    def __len__(self) -> int:
+        return len(self._map)
+
+    def keys(self):
+        return self._map.keys()
+
+    def values(self):
+        return self._map.values()
+
+    def items(self):
+        return self._map.items()
+
+    def __setitem__(self, sid: str, username: str):
+        self._map.forceput(sid, username)
+        self._local[sid] = username
+        self._client.send(('presence_set', sid, username))
+
+    def pop(self, sid: str, *default: Any) -> Any:
+        self._local.pop(sid, None)
+        if sid in self._map:
+            self._client.send(('presence_del', sid))
+        return self._map.pop(sid, *default)
+
+    def local_items(self):
+        return list(self._local.items())
+
+    def apply(self, frame: tuple):
+        """Apply a presence frame from the broker"""
+        if frame[0] == 'presence_snapshot':
+            self._map = bidict()
+            for sid, username in frame[1].items():
+                self._map.forceput(sid, username)
+            for sid, username in self._local.items():
+                self._map.forceput(sid, username)
+        elif frame[0] == 'presence_set':
+            self._map.forceput(frame[1], frame[2])
+        elif frame[0] == 'presence_del':
+            self._map.pop(frame[1], None)
+
+
+class BrokerClient:
+    """A worker's connection to the broker; reconnects and re-announces its connections if the link drops"""
+
+    def __init__(self, path: str = BROKER_SOCKET):
+        self.path = path
+        self.presence = SharedPresence(self)
+        self._queues = {}  # channel -> asyncio.Queue of published messages
+        self._writer = None
+        self._connected = None
+        self._task = None
+        self.on_presence = None  # called with each presence frame after the mirror applies it
+        self.dropped = 0  # frames sent while disconnected
+
+    async def start(self):
+        self._connected = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+        await self._connected.wait()
+
+    async def _run(self):
+        while True:
+            try:
+                reader, writer = await asyncio.open_unix_connection(self.path)
+            except OSError as e:
+                print(f"[Cluster] Broker unavailable at {self.path}: {e}")
+                await asyncio.sleep(RESTART_DELAY)
+                continue
+            self._writer = writer
+            for sid, username in self.presence.local_items():
+                write_frame(writer, ('presence_set', sid, username))
+            self._connected.set()
+            try:
+                while True:
+                    frame = await read_frame(reader)
+                    if frame[0] == 'message':
+                        queue = self._queues.get(frame[1])
+                        if queue is not None:
+                            queue.put_nowait(frame[2])
+                    else:
+                        self.presence.apply(frame)
+                        if self.on_presence is not None:
+                            self.on_presence(frame)
+            except (asyncio.IncompleteReadError, ConnectionError):
+                print("[Cluster] Lost the broker connection; reconnecting")
+            self._writer = None
+            writer.close()
+
+    def send(self, frame: tuple):
+        if self._writer is None or self._writer.is_closing():
+            self.dropped += 1
+            return
+        write_frame(self._writer, frame)
+
+    def publish(self, channel: str, data: Any):
+        self.send(('publish', channel, data))
+
+    def subscribe(self, channel: str) -> asyncio.Queue:
+        return self._queues.setdefault(channel, asyncio.Queue())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+        if self._writer is not None:
+            self._writer.close()
+
+
+class LocalBrokerManager(socketio.AsyncPubSubManager):
+    """Socket.IO client manager that fans emits out through the local broker"""
+    name = 'localbroker'
+
+    def __init__(self, client: BrokerClient, channel: str = 'socketio', write_only: bool = False, logger=None):
+        super().__init__(channel=channel, write_only=write_only, logger=logger)
+        self.client = client
+
+    async def _publish(self, data):
+        self.client.publish(self.channel, data)
+
+    async def _listen(self):
+        queue = self.client.subscribe(self.channel)
+        while True:
+            yield await queue.get()
+
+
+def client_manager(client: BrokerClient) -> socketio.AsyncManager:
+    """Socket.IO client manager for a worker: Redis when CHAT_PUBSUB_URL is set, otherwise the local broker"""
+    if PUBSUB_URL:
+        return socketio.AsyncRedisManager(PUBSUB_URL)
+    return LocalBrokerManager(client)
+
+
+class Supervisor:
+    """Runs the broker and keeps the worker processes alive until exit/quit, SIGINT or SIGTERM"""
+
+    def __init__(self, workers: int, script: str):
+        self.workers = workers
+        self.script = script
+        self.processes = {}  # worker index -> asyncio subprocess
+        self.stopping = False
+
+    async def _keep_running(self, index: int):
+        while not self.stopping:
+            env = dict(os.environ, CHAT_WORKER_INDEX=str(index))
+            process = await asyncio.create_subprocess_exec(sys.executable, self.script, env=env,
+                                                           stdin=subprocess.DEVNULL)
+            self.processes[index] = process
+            code = await process.wait()
+            if not self.stopping:
+                print(f"[Cluster] Worker {index} exited with code {code}; restarting")
+                await asyncio.sleep(RESTART_DELAY)
+
+    async def run(self):
+        broker = Broker()
+        await broker.start()
+        loop = asyncio.get_running_loop()
+        stop = asyncio.Event()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(signum, stop.set)
+
+        def on_input():
+            line = sys.stdin.readline()
+            if not line:
+                loop.remove_reader(sys.stdin)
+            elif line.strip().lower() in {'exit', 'quit'}:
+                stop.set()
+            else:
+                print("[Cluster] Only exit/quit are handled in worker mode")
+        loop.add_reader(sys.stdin, on_input)
+
+        tasks = [asyncio.create_task(self._keep_running(index)) for index in range(self.workers)]
+        print(f"[Cluster] Started {self.workers} workers; broker at {broker.path}")
+        await stop.wait()
+        print("Server Exiting...")
+        self.stopping = True
+        loop.remove_reader(sys.stdin)
+        for process in self.processes.values():
+            if process.returncode is None:
+                try:
+                    process.terminate()
+                except ProcessLookupError:
+                    pass
+        await asyncio.gather(*tasks)
+        await broker.close()
+
+
+def run_supervisor(workers: int = WORKERS, script: Optional[str] = None):
+    asyncio.run(Supervisor(workers, script or sys.argv[0]).run())
@@ -0,0 +1,209 @@
+"""
+Outbound delivery: a bounded queue and a writer task per connection.
+
+Handlers call delivery.emit() instead of sio.emit(). It only enqueues onto
+each recipient's queue, so a client on a bad link can't slow down the
+handler that broadcasts to it. The writer sends one event at a time. When
+the client's engine.io send queue is above OUTBOUND_ENGINE_HIGH_WATER
+packets, it waits for that queue to drain.
+
+When a connection's queue is full (OUTBOUND_QUEUE_SIZE), the event's policy
+decides what happens:
+  drop_oldest - discard the oldest queued event (presence, system messages)
+  disconnect  - the client can't keep up with chat; drop the connection
+Chat events (OUTBOUND_DISCONNECT_EVENTS) use disconnect; all others drop_oldest.
+
+In worker mode, emits for connections on other workers travel through the
+cluster broker and are queued by the worker that holds the connection.
+
+An emit can carry a receipt, (name, args), naming a handler registered with
+register_receipt(). The writer runs handler(*args) once the event has been
+handed to the client's socket. Events dropped from a queue, or discarded when
+a slow client is disconnected, never run their receipt. Receipt args may be
+concurrent futures (e.g. a journal write's id); the handler gets their results,
+so an emit never has to wait for them. Receipts with futures for a connection
+on another worker are relayed back and run by the emitting worker, which holds
+the futures; all other receipts are plain data and run where the event is sent.
+"""
+import asyncio
+import concurrent.futures
+import os
+import uuid
+from collections import OrderedDict, deque
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+QUEUE_SIZE = int(os.getenv('OUTBOUND_QUEUE_SIZE', '256'))
+ENGINE_HIGH_WATER = int(os.getenv('OUTBOUND_ENGINE_HIGH_WATER', '16'))
+DISCONNECT_EVENTS = set(os.getenv('OUTBOUND_DISCONNECT_EVENTS', 'chat_message,room_message,private_message').split(','))
+DRAIN_POLL_SECONDS = 0.05
+CHANNEL = 'outbound'
+RECEIPT_CHANNEL = 'outbound_receipts'
+RELAY = '_relay'  # receipt that sends its token back to the worker holding the real receipt
+# Receipts waiting on another worker's send; the oldest are forgotten (their events were likely dropped)
+MAX_RELAYED_RECEIPTS = int(os.getenv('OUTBOUND_MAX_RELAYED_RECEIPTS', '10000'))
+NAMESPACE = '/'
+
+
+class Connection:
+    """Outbound state of one local connection"""
+
+    def __init__(self):
+        self.queue = deque()
+        self.ready = asyncio.Event()
+        self.writer = None
+        self.dropped = 0
+
+
+class OutboundDelivery:
+    """Per-sid bounded queues with writer tasks and slow-consumer policies"""
+
+    def __init__(self, sio, broker_client=None, queue_size: int = QUEUE_SIZE):
+        self.sio = sio
+        self.broker_client = broker_client
+        self.queue_size = queue_size
+        self._connections = {}  # sid -> Connection
+        self._listener = None
+        self._receipts = {}  # receipt name -> async handler
+        self._receipt_tasks = set()
+        self._relayed = OrderedDict()  # token -> receipt run here once another worker has sent its event
+        self._receipt_listener = None
+        self.stats = {'queued': 0, 'sent': 0, 'dropped': 0, 'disconnected': 0, 'max_depth': 0}
+
+    def start(self):
+        """Start taking emits published by other workers off the broker"""
+        if self.broker_client and self._listener is None:
+            self._listener = asyncio.create_task(self._listen())
+            self._receipt_listener = asyncio.create_task(self._listen_receipts())
+
+    async def _listen(self):
+        queue = self.broker_client.subscribe(CHANNEL)
+        while True:
+            self._deliver(*await queue.get())
+
+    async def _listen_receipts(self):
+        queue = self.broker_client.subscribe(RECEIPT_CHANNEL)
+        while True:
+            receipt = self._relayed.pop(await queue.get(), None)
+            if receipt is not None:  # another worker's token
+                self._run_receipt(*receipt)
+
+    def register_receipt(self, name: str, handler: Callable[..., Awaitable[Any]]):
+        """Handler run as handler(*args) for each event emitted with receipt=(name, args) once it is sent"""
+        self._receipts[name] = handler
+
+    async def emit(self, event: str, data: Any = None, to: Optional[str] = None, room: Optional[str] = None,
+                   skip_sid: Optional[str] = None, receipt: Optional[Tuple[str, tuple]] = None):
+        """Queue an event for a sid, a room, or everyone (to/room None), like sio.emit"""
+        target = to if to is not None else room
+        if self.broker_client and not self._is_local_sid(target):
+            if receipt is not None and any(isinstance(arg, concurrent.futures.Future) for arg in receipt[1]):
+                # Futures can't travel; the worker that sends the event hands the token back
+                token = uuid.uuid4().hex
+                self._relayed[token] = receipt
+                while len(self._relayed) > MAX_RELAYED_RECEIPTS:
+                    self._relayed.popitem(last=False)
+                receipt = (RELAY, (token,))
+            # Recipients may be on any worker; each one queues for its own connections
+            self.broker_client.publish(CHANNEL, (event, data, target, skip_sid, receipt))
+        else:
+            self._deliver(event, data, target, skip_sid, receipt)
+
+    def emit_local(self, event: str, data: Any = None, to: Optional[str] = None):
+        """Queue an event for this worker's connections only, e.g. when every worker sends the same broadcast"""
+        self._deliver(event, data, to, None)
+
+    def _is_local_sid(self, target: Optional[str]) -> bool:
+        """True if target is the sid of a connection this worker holds"""
+        return target is not None and self.sio.manager.eio_sid_from_sid(target, NAMESPACE) is not None
+
+    def _deliver(self, event: str, data: Any, target: Optional[str], skip_sid: Optional[str],
+                 receipt: Optional[Tuple[str, tuple]] = None):
+        for participant in self.sio.manager.get_participants(NAMESPACE, target):
+            sid = participant[0] if isinstance(participant, tuple) else participant
+            if sid != skip_sid:
+                self._enqueue(sid, event, data, receipt)
+
+    def _enqueue(self, sid: str, event: str, data: Any, receipt: Optional[Tuple[str, tuple]] = None):
+        connection = self._connections.get(sid)
+        if connection is None:
+            connection = self._connections[sid] = Connection()
+            connection.writer = asyncio.create_task(self._write(sid, connection))
+        if len(connection.queue) >= self.queue_size:
+            if event in DISCONNECT_EVENTS:
+                print(f"[Outbound] {sid} is {len(connection.queue)} events behind; disconnecting")
+                self.stats['disconnected'] += 1
+                self.close(sid)
+                asyncio.create_task(self.sio.disconnect(sid))
+                return
+            connection.queue.popleft()
+            connection.dropped += 1
+            self.stats['dropped'] += 1
+        connection.queue.append((event, data, receipt))
+        connection.ready.set()
+        self.stats['queued'] += 1
+        self.stats['max_depth'] = max(self.stats['max_depth'], len(connection.queue))
+
+    async def _write(self, sid: str, connection: Connection):
+        while True:
+            if not connection.queue:
+                connection.ready.clear()
+                await connection.ready.wait()
+                continue
+            event, data, receipt = connection.queue.popleft()
+            try:
+                await self.sio.emit(event, data, to=sid, ignore_queue=True)
+                self.stats['sent'] += 1
+            except Exception as e:
+                print(f"[Outbound] Error sending {event} to {sid}: {e}")
+            else:
+                if receipt is not None:
+                    self._run_receipt(*receipt)
+            await self._wait_for_drain(sid)
+
+    def _run_receipt(self, name: str, args: tuple):
+        if name == RELAY:
+            self.broker_client.publish(RECEIPT_CHANNEL, args[0])
+            return
+        handler = self._receipts.get(name)
+        if handler is None:
+            print(f"[Outbound] No receipt handler named {name}")
+            return
+        task = asyncio.create_task(self._call_receipt(handler, args))
+        self._receipt_tasks.add(task)
+        task.add_done_callback(self._receipt_done)
+
+    @staticmethod
+    async def _call_receipt(handler: Callable[..., Awaitable[Any]], args: tuple):
+        args = [await asyncio.wrap_future(arg) if isinstance(arg, concurrent.futures.Future) else arg
+                for arg in args]
+        await handler(*args)
+
+    def _receipt_done(self, task: asyncio.Task):
+        self._receipt_tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            print(f"[Outbound] Receipt handler failed: {task.exception()}")
+
+    async def _wait_for_drain(self, sid: str):
+        """Hold the writer while the client's engine.io send queue is backed up"""
+        try:
+            eio_sid = self.sio.manager.eio_sid_from_sid(sid, NAMESPACE)
+            socket = self.sio.eio.sockets.get(eio_sid)
+        except AttributeError:
+            return
+        while socket is not None and not socket.closed and socket.queue.qsize() > ENGINE_HIGH_WATER:
+            await asyncio.sleep(DRAIN_POLL_SECONDS)
+
+    def close(self, sid: str):
+        """Stop a connection's writer and discard what it had queued"""
+        connection = self._connections.pop(sid, None)
+        if connection is not None and connection.writer is not None:
+            connection.writer.cancel()
+
+    def get_stats(self, slowest: int = 10) -> Dict[str, Any]:
+        depths = sorted(((len(c.queue), sid, c.dropped) for sid, c in self._connections.items()), reverse=True)
+        return dict(
+            self.stats,
+            connections=len(self._connections),
+            depth=sum(depth for depth, _, _ in depths),
+            slowest=[{'sid': sid, 'depth': depth, 'dropped': dropped} for depth, sid, dropped in depths[:slowest]],
+        )
@@ -0,0 +1,27 @@
+import asyncio
+import functools
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+DB_EXECUTOR_WORKERS = int(os.getenv('DB_EXECUTOR_WORKERS', '1'))
+
+# Dedicated thread(s) for SQLite work so the aiohttp event loop never waits on disk
+db_executor = ThreadPoolExecutor(max_workers=DB_EXECUTOR_WORKERS, thread_name_prefix="DB")
+
+
+async def run_in_db_thread(func, *args, **kwargs):
+    """Run a blocking persistence call on the DB executor and await its result"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(db_executor, functools.partial(func, *args, **kwargs))
+
+
+def to_async(func):
+    """Wrap a blocking DAL function in a coroutine function with the same signature"""
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        return await run_in_db_thread(func, *args, **kwargs)
+    return wrapper
+
+
+def shutdown_db_executor(wait: bool = True):
+    db_executor.shutdown(wait=wait)
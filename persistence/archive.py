@@ -0,0 +1,250 @@
+import glob
+import os
+import shutil
+import sqlite3
+import threading
+from typing import Optional, Iterable, List, Dict, Any, Set, Tuple
+from .connection import get_manager
+
+try:
+    import zstandard
+except ImportError:  # compression of closed months is optional
+    zstandard = None
+
+ARCHIVE_DIR = os.getenv('CHAT_ARCHIVE_DIR', os.path.join(os.path.dirname(__file__), '../archive'))
+
+# Archived message tables and the column that scopes their history
+ARCHIVED_TABLES = {
+    'global_messages': None,
+    'room_messages': 'room_id',
+    'messages': 'inbox_uid',
+    'adventure_messages': 'adventure_id',
+}
+
+ARCHIVE_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS global_messages (
+    id INTEGER PRIMARY KEY, user_id INTEGER, useruid TEXT, message TEXT NOT NULL,
+    file_id INTEGER, message_type TEXT, created_at DATETIME
+);
+CREATE TABLE IF NOT EXISTS room_messages (
+    id INTEGER PRIMARY KEY, room_id INTEGER, user_id INTEGER, useruid TEXT, message TEXT NOT NULL,
+    file_id INTEGER, message_type TEXT, created_at DATETIME
+);
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY, inbox_uid TEXT, user_id INTEGER, useruid TEXT, message TEXT NOT NULL,
+    file_id INTEGER, message_type TEXT, created_at DATETIME
+);
+CREATE TABLE IF NOT EXISTS adventure_messages (
+    id INTEGER PRIMARY KEY, adventure_id INTEGER, user_id INTEGER, useruid TEXT, message TEXT NOT NULL,
+    file_id INTEGER, message_type TEXT, created_at DATETIME
+);
+CREATE TABLE IF NOT EXISTS file_attachments (
+    id INTEGER PRIMARY KEY, filename TEXT, blob TEXT, sha256 TEXT, file_size INTEGER,
+    mime_type TEXT, created_at DATETIME
+);
+CREATE INDEX IF NOT EXISTS idx_room_messages_room_id ON room_messages(room_id, id);
+CREATE INDEX IF NOT EXISTS idx_messages_inbox_id ON messages(inbox_uid, id);
+CREATE INDEX IF NOT EXISTS idx_adventure_messages_adventure_id ON adventure_messages(adventure_id, id);
+CREATE INDEX IF NOT EXISTS idx_global_messages_file_id ON global_messages(file_id);
+CREATE INDEX IF NOT EXISTS idx_room_messages_file_id ON room_messages(file_id);
+CREATE INDEX IF NOT EXISTS idx_messages_file_id ON messages(file_id);
+CREATE INDEX IF NOT EXISTS idx_adventure_messages_file_id ON adventure_messages(file_id);
+'''
+
+_lock = threading.Lock()  # serializes compress/decompress of archive files
+
+
+def archive_path(month: str) -> str:
+    """Plain archive file for a 'YYYY-MM' month"""
+    return os.path.join(ARCHIVE_DIR, f'chat-{month}.sqlite3')
+
+
+def _compressed_path(month: str) -> str:
+    return archive_path(month) + '.zst'
+
+
+def _cache_path(month: str) -> str:
+    return os.path.join(ARCHIVE_DIR, '.cache', f'chat-{month}.sqlite3')
+
+
+_months_cache = {'mtime': None, 'months': []}
+
+
+def list_months() -> List[str]:
+    """Archived months, newest first (re-listed only when the archive directory changes)"""
+    try:
+        mtime = os.stat(ARCHIVE_DIR).st_mtime_ns
+    except FileNotFoundError:
+        return []
+    if _months_cache['mtime'] != mtime:
+        months = set()
+        for path in glob.glob(os.path.join(ARCHIVE_DIR, 'chat-*.sqlite3*')):
+            name = os.path.basename(path)
+            months.add(name[len('chat-'):len('chat-') + 7])
+        _months_cache['months'] = sorted(months, reverse=True)
+        _months_cache['mtime'] = mtime
+    return _months_cache['months']
+
+
+def open_for_write(month: str) -> str:
+    """Path of a writable archive for the month, decompressing it first if needed"""
+    path = archive_path(month)
+    with _lock:
+        compressed = _compressed_path(month)
+        if not os.path.exists(path) and os.path.exists(compressed):
+            _decompress(compressed, path)
+            os.unlink(compressed)
+            _drop_cache(month)
+        os.makedirs(ARCHIVE_DIR, exist_ok=True)
+    get_manager(path).run_script(ARCHIVE_SCHEMA)
+    return path
+
+
+def _readable_path(month: str) -> Optional[str]:
+    path = archive_path(month)
+    if os.path.exists(path):
+        return path
+    compressed = _compressed_path(month)
+    if not os.path.exists(compressed):
+        return None
+    cached = _cache_path(month)
+    with _lock:
+        if not os.path.exists(cached):
+            os.makedirs(os.path.dirname(cached), exist_ok=True)
+            _decompress(compressed, cached)
+    return cached
+
+
+def _decompress(src: str, dest: str):
+    if zstandard is None:
+        raise RuntimeError(f"zstandard is required to read {src}")
+    tmp = dest + '.tmp'
+    with open(src, 'rb') as fin, open(tmp, 'wb') as fout:
+        zstandard.ZstdDecompressor().copy_stream(fin, fout)
+    os.replace(tmp, dest)
+
+
+def _drop_cache(month: str):
+    cached = _cache_path(month)
+    get_manager(cached).close_all()
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(cached + suffix):
+            os.unlink(cached + suffix)
+
+
+def compress_month(month: str) -> bool:
+    """Replace a closed month's archive with a zstd-compressed copy"""
+    path = archive_path(month)
+    if zstandard is None or not os.path.exists(path):
+        return False
+    manager = get_manager(path)
+    with manager.transaction() as db:
+        db.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+    manager.close_all()
+    with _lock:
+        tmp = _compressed_path(month) + '.tmp'
+        with open(path, 'rb') as fin, open(tmp, 'wb') as fout:
+            zstandard.ZstdCompressor(level=10).copy_stream(fin, fout)
+        os.replace(tmp, _compressed_path(month))
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(path + suffix):
+                os.unlink(path + suffix)
+    return True
+
+
+def read_history(table: str, scope_value: Any, limit: int,
+                 before_id: Optional[int] = None) -> List[Dict[str, Any]]:
+    """Archived rows for one history scope, newest first, continuing below before_id"""
+    scope_column = ARCHIVED_TABLES[table]
+    rows = []
+    for month in list_months():
+        if len(rows) >= limit:
+            break
+        path = _readable_path(month)
+        if path is None:
+            continue
+        conditions, params = [], []
+        if scope_column:
+            conditions.append(f'{scope_column} = ?')
+            params.append(scope_value)
+        if before_id is not None:
+            conditions.append('id < ?')
+            params.append(before_id)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+        params.append(limit - len(rows))
+        with get_manager(path).transaction() as db:
+            page = db.execute(f'SELECT * FROM {table} {where} ORDER BY id DESC LIMIT ?', params).fetchall()
+        for row in page:
+            entry = dict(row)
+            entry['archived'] = True
+            rows.append(entry)
+        if page:
+            before_id = page[-1]['id']
+    return rows
+
+
+def find_attachment(file_id: int) -> Tuple[Optional[Dict[str, Any]], Dict[str, Set[Any]]]:
+    """Archived metadata of an attachment (blob included, for legacy rows) and the
+    history scopes of the archived messages carrying it, per table ('global_messages'
+    maps to {None}). Retention archives an attachment's row in every month holding one
+    of its messages, so only those months are searched for messages."""
+    attachment, scopes = None, {}
+    for month in list_months():
+        path = _readable_path(month)
+        if path is None:
+            continue
+        with get_manager(path).transaction() as db:
+            row = db.execute(
+                'SELECT id, filename, blob, sha256, file_size, mime_type, created_at FROM file_attachments WHERE id = ?',
+                (file_id,)
+            ).fetchone()
+            if row is None:
+                continue
+            attachment = attachment or dict(row)
+            for table, scope_column in ARCHIVED_TABLES.items():
+                cur = db.execute(f'SELECT {scope_column or "NULL"} FROM {table} WHERE file_id = ?', (file_id,))
+                scopes.setdefault(table, set()).update(r[0] for r in cur.fetchall())
+    return attachment, scopes
+
+
+def export_month(month: str, directory: str) -> str:
+    """Copy a month's archive into directory: a plain file through the backup API
+    (it may still be written to), a compressed one as is; returns the file name"""
+    os.makedirs(directory, exist_ok=True)
+    path = archive_path(month)
+    with _lock:
+        if os.path.exists(path):
+            target = os.path.join(directory, os.path.basename(path))
+            source = sqlite3.connect(f'file:{path}?mode=ro', uri=True)
+            dest = sqlite3.connect(target + '.tmp')
+            try:
+                source.backup(dest)
+            finally:
+                dest.close()
+                source.close()
+        else:
+            target = os.path.join(directory, os.path.basename(_compressed_path(month)))
+            shutil.copyfile(_compressed_path(month), target + '.tmp')
+        os.replace(target + '.tmp', target)
+    return os.path.basename(target)
+
+
+def import_month(month: str, source: str) -> bool:
+    """Put an exported month's archive file in place; False if that month is already archived here"""
+    target = _compressed_path(month) if source.endswith('.zst') else archive_path(month)
+    with _lock:
+        if os.path.exists(archive_path(month)) or os.path.exists(_compressed_path(month)):
+            return False
+        os.makedirs(ARCHIVE_DIR, exist_ok=True)
+        shutil.copyfile(source, target + '.tmp')
+        os.replace(target + '.tmp', target)
+    return True
+
+
+def max_id(month: str, tables: Iterable[str]) -> int:
+    """Highest message id archived for the month across the given tables"""
+    path = _readable_path(month)
+    if path is None:
+        return 0
+    with get_manager(path).transaction() as db:
+        return max(db.execute(f'SELECT COALESCE(MAX(id), 0) FROM {table}').fetchone()[0] for table in tables)
@@ -0,0 +1,20 @@
+"""
+Async mirror of persistence.authdb. Every function runs on the dedicated DB
+executor thread.
+"""
+from . import authdb
+from .aio import to_async
+
+init_auth_db = to_async(authdb.init_auth_db)
+create_user = to_async(authdb.create_user)
+get_user_by_email = to_async(authdb.get_user_by_email)
+get_user_by_username = to_async(authdb.get_user_by_username)
+get_user_by_id = to_async(authdb.get_user_by_id)
+update_user_last_seen = to_async(authdb.update_user_last_seen)
+update_user_profile = to_async(authdb.update_user_profile)
+change_password = to_async(authdb.change_password)
+update_password_hash = to_async(authdb.update_password_hash)
+delete_user = to_async(authdb.delete_user)
+load_session = to_async(authdb.load_session)
+save_session = to_async(authdb.save_session)
+delete_session = to_async(authdb.delete_session)
@@ -0,0 +1,70 @@
+"""
+Async mirror of persistence.chatdb. Every function runs on the dedicated DB
+executor thread; save_* still return the journal's durability future.
+Full global and room history pages held in the recent-history windows are
+answered on the event loop without a trip to the executor; anything else,
+including short pages that may continue in the archive, goes to the executor.
+"""
+from typing import Optional
+from . import chatdb
+from .aio import to_async
+
+UNDELIVERED_PAGE_SIZE = chatdb.UNDELIVERED_PAGE_SIZE
+
+init_db = to_async(chatdb.init_db)
+flush_messages = to_async(chatdb.flush_messages)
+get_cache_stats = chatdb.get_cache_stats  # in-memory counters, no I/O
+
+save_global_message = to_async(chatdb.save_global_message)
+save_room_message = to_async(chatdb.save_room_message)
+save_private_message = to_async(chatdb.save_private_message)
+save_adventure_message = to_async(chatdb.save_adventure_message)
+save_file_attachment = to_async(chatdb.save_file_attachment)
+get_file_attachment = to_async(chatdb.get_file_attachment)
+get_legacy_attachment_blob = to_async(chatdb.get_legacy_attachment_blob)
+can_access_attachment = to_async(chatdb.can_access_attachment)
+
+get_or_create_user = to_async(chatdb.get_or_create_user)
+get_room_by_name = to_async(chatdb.get_room_by_name)
+create_new_room = to_async(chatdb.create_new_room)
+get_or_create_inbox = to_async(chatdb.get_or_create_inbox)
+add_user_to_room = to_async(chatdb.add_user_to_room)
+remove_user_from_room = to_async(chatdb.remove_user_from_room)
+is_user_in_room = to_async(chatdb.is_user_in_room)
+
+get_global_messages = to_async(chatdb.get_global_messages)
+_get_global_messages_with_users = to_async(chatdb.get_global_messages_with_users)
+_get_room_messages_with_users = to_async(chatdb.get_room_messages_with_users)
+
+async def get_global_messages_with_users(limit: int = 50, before_id: Optional[int] = None,
+                                         after_id: Optional[int] = None):
+    rows = chatdb.recent_history_page('global_messages', None, limit, before_id, after_id)
+    if rows is not None:
+        return rows
+    return await _get_global_messages_with_users(limit, before_id, after_id)
+
+async def get_room_messages_with_users(room_id: int, limit: int = 50, before_id: Optional[int] = None,
+                                       after_id: Optional[int] = None):
+    rows = chatdb.recent_history_page('room_messages', room_id, limit, before_id, after_id)
+    if rows is not None:
+        return rows
+    return await _get_room_messages_with_users(room_id, limit, before_id, after_id)
+
+get_private_messages_with_users = to_async(chatdb.get_private_messages_with_users)
+get_adventure_messages_with_users = to_async(chatdb.get_adventure_messages_with_users)
+get_user_rooms = to_async(chatdb.get_user_rooms)
+get_room_directory = to_async(chatdb.get_room_directory)
+get_user_inboxes = to_async(chatdb.get_user_inboxes)
+mark_inbox_read = to_async(chatdb.mark_inbox_read)
+
+get_undelivered_private_messages = to_async(chatdb.get_undelivered_private_messages)
+mark_private_messages_delivered = to_async(chatdb.mark_private_messages_delivered)
+mark_inbox_delivered = to_async(chatdb.mark_inbox_delivered)
+update_user_last_seen = to_async(chatdb.update_user_last_seen)
+
+search_messages = to_async(chatdb.search_messages)
+
+create_adventure = to_async(chatdb.create_adventure)
+add_adventure_participant = to_async(chatdb.add_adventure_participant)
+get_adventure_by_id = to_async(chatdb.get_adventure_by_id)
+get_adventure_participants = to_async(chatdb.get_adventure_participants)
@@ -17,4 +17,13 @@ CREATE TABLE IF NOT EXISTS users (
 CREATE INDEX IF NOT EXISTS idx_users_useruid ON users(useruid);
 CREATE INDEX IF NOT EXISTS idx_users_email ON users(email);
 
+-- Server-side web sessions; the cookie carries only the signed session id.
+-- data is the JSON aiohttp_session stores, expires_at a unix timestamp.
+CREATE TABLE IF NOT EXISTS sessions (
+    id TEXT PRIMARY KEY,
+    data TEXT NOT NULL,
+    expires_at REAL NOT NULL
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_sessions_expires ON sessions(expires_at);
+
 PRAGMA foreign_keys = ON;
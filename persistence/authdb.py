@@ -1,44 +1,34 @@
-import sqlite3
-from contextlib import contextmanager
 from typing import Optional, Dict, Any
+import json
 import os
-import bcrypt
+import time
 import uuid
+from .cache import LRUCache, WORKER_PROCESS
+from .connection import get_manager
+from .passwords import hash_password, verify_password
 
 AUTH_DB_PATH = os.path.join(os.path.dirname(__file__), '../auth.sqlite3')
+SESSION_CACHE_SIZE = int(os.getenv('SESSION_CACHE_SIZE', '10000'))
+
+# Off in worker mode: a logout on one worker must end the session on every worker at once
+_sessions = LRUCache(0 if WORKER_PROCESS else SESSION_CACHE_SIZE, 'sessions')  # session id -> (data, expires_at)
 
-@contextmanager
 def get_auth_db():
-    conn = sqlite3.connect(AUTH_DB_PATH)
-    conn.row_factory = sqlite3.Row
-    try:
-        yield conn
-        conn.commit()
-    finally:
-        conn.close()
+    """Reuse this thread's pooled auth DB connection inside a transaction"""
+    return get_manager(AUTH_DB_PATH).transaction()
 
 def init_auth_db():
     """Initialize the authentication database"""
-    with get_auth_db() as db:
-        with open(os.path.join(os.path.dirname(__file__), 'auth_schema.sql'), 'r') as f:
-            db.executescript(f.read())
-
-def hash_password(password: str) -> str:
-    """Hash a password using bcrypt"""
-    salt = bcrypt.gensalt()
-    return bcrypt.hashpw(password.encode('utf-8'), salt).decode('utf-8')
-
-def verify_password(password: str, hashed: str) -> bool:
-    """Verify a password against its hash"""
-    return bcrypt.checkpw(password.encode('utf-8'), hashed.encode('utf-8'))
+    with open(os.path.join(os.path.dirname(__file__), 'auth_schema.sql'), 'r') as f:
+        get_manager(AUTH_DB_PATH).run_script(f.read())
 
 def create_user(username: str, email: Optional[str] = None, password: Optional[str] = None, 
                 firstname: Optional[str] = None, lastname: Optional[str] = None, 
-                is_anonymous: bool = True) -> int:
-    """Create a new user in the auth database"""
+                is_anonymous: bool = True, password_hash: Optional[str] = None) -> int:
+    """Create a new user in the auth database; pass password_hash if it was hashed off-thread already"""
+    if password and not password_hash:
+        password_hash = hash_password(password)
     with get_auth_db() as db:
-        password_hash = hash_password(password) if password else None
-        
         cur = db.execute(
             '''INSERT INTO users (useruid, firstname, lastname, email, password_hash, is_anonymous) 
                VALUES (?, ?, ?, ?, ?, ?)''',
@@ -105,6 +95,11 @@ def change_password(user_id: int, new_password: str) -> bool:
         print(f"Error changing password: {e}")
         return False
 
+def update_password_hash(user_id: int, password_hash: str):
+    """Store a new hash for the same password, e.g. after BCRYPT_ROUNDS changed"""
+    with get_auth_db() as db:
+        db.execute('UPDATE users SET password_hash = ? WHERE id = ?', (password_hash, user_id))
+
 def delete_user(user_id: int) -> bool:
     """Delete a user from auth database (soft delete by marking inactive could be better)"""
     try:
@@ -114,3 +109,52 @@ def delete_user(user_id: int) -> bool:
     except Exception as e:
         print(f"Error deleting user: {e}")
         return False
+
+def get_cached_session(session_id: str) -> Optional[Dict[str, Any]]:
+    """Session data from the in-memory LRU only; None if it isn't cached or has expired"""
+    entry = _sessions.get(session_id, None)
+    if entry is None:
+        return None
+    data, expires_at = entry
+    if expires_at <= time.time():
+        _sessions.invalidate(session_id)
+        return None
+    return data
+
+def load_session(session_id: str) -> Optional[Dict[str, Any]]:
+    """Session data by id, from the LRU or the sessions table; None if unknown or expired"""
+    data = get_cached_session(session_id)
+    if data is not None:
+        return data
+    with get_auth_db() as db:
+        row = db.execute('SELECT data, expires_at FROM sessions WHERE id = ? AND expires_at > ?',
+                         (session_id, time.time())).fetchone()
+    if not row:
+        return None
+    data = json.loads(row['data'])
+    _sessions.put(session_id, (data, row['expires_at']))
+    return data
+
+def save_session(session_id: str, data: Dict[str, Any], max_age: float):
+    """Insert or replace a session, expiring max_age seconds from now"""
+    expires_at = time.time() + max_age
+    with get_auth_db() as db:
+        db.execute(
+            """INSERT INTO sessions (id, data, expires_at) VALUES (?, ?, ?)
+               ON CONFLICT(id) DO UPDATE SET data = excluded.data, expires_at = excluded.expires_at""",
+            (session_id, json.dumps(data), expires_at)
+        )
+    _sessions.put(session_id, (data, expires_at))
+
+def delete_session(session_id: str):
+    _sessions.invalidate(session_id)
+    with get_auth_db() as db:
+        db.execute('DELETE FROM sessions WHERE id = ?', (session_id,))
+
+def purge_expired_sessions() -> int:
+    """Delete expired sessions; returns how many were removed"""
+    with get_auth_db() as db:
+        return db.execute('DELETE FROM sessions WHERE expires_at <= ?', (time.time(),)).rowcount
+
+def get_session_cache_stats() -> Dict[str, Any]:
+    return _sessions.stats()
@@ -0,0 +1,80 @@
+import base64
+import hashlib
+import os
+import tempfile
+from typing import Iterable, Iterator, Tuple, BinaryIO
+
+ATTACHMENT_STORE_DIR = os.getenv(
+    'ATTACHMENT_STORE_DIR', os.path.join(os.path.dirname(__file__), '../attachments')
+)
+
+# Decode base64 in slices that are a multiple of 4 characters so each slice decodes on its own
+B64_SLICE = 4 * 16 * 1024
+READ_CHUNK = 64 * 1024
+
+
+class BlobStore:
+    """Content-addressed file store: blobs live at <root>/<aa>/<bb>/<sha256>"""
+
+    def __init__(self, root: str = ATTACHMENT_STORE_DIR):
+        self.root = os.path.abspath(root)
+
+    def path_for(self, digest: str) -> str:
+        return os.path.join(self.root, digest[:2], digest[2:4], digest)
+
+    def exists(self, digest: str) -> bool:
+        return os.path.exists(self.path_for(digest))
+
+    def put_stream(self, chunks: Iterable[bytes]) -> Tuple[str, int]:
+        """Write chunks to the store, returning (sha256, size); identical content is stored once"""
+        os.makedirs(self.root, exist_ok=True)
+        sha = hashlib.sha256()
+        size = 0
+        fd, tmp_path = tempfile.mkstemp(dir=self.root, prefix='.upload-')
+        try:
+            with os.fdopen(fd, 'wb') as tmp:
+                for chunk in chunks:
+                    sha.update(chunk)
+                    size += len(chunk)
+                    tmp.write(chunk)
+                tmp.flush()
+                os.fsync(tmp.fileno())
+            digest = sha.hexdigest()
+            final_path = self.path_for(digest)
+            if os.path.exists(final_path):
+                os.unlink(tmp_path)
+            else:
+                os.makedirs(os.path.dirname(final_path), exist_ok=True)
+                os.replace(tmp_path, final_path)
+            return digest, size
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+
+    def put_base64(self, b64: str) -> Tuple[str, int]:
+        """Decode a base64 string slice by slice into the store"""
+        b64 = ''.join(b64.split())  # ignore line breaks so slices stay 4-aligned
+        return self.put_stream(
+            base64.b64decode(b64[i:i + B64_SLICE]) for i in range(0, len(b64), B64_SLICE)
+        )
+
+    def open(self, digest: str) -> BinaryIO:
+        return open(self.path_for(digest), 'rb')
+
+    def iter_chunks(self, digest: str, chunk_size: int = READ_CHUNK) -> Iterator[bytes]:
+        """Stream a blob without loading it into memory"""
+        with self.open(digest) as f:
+            while True:
+                chunk = f.read(chunk_size)
+                if not chunk:
+                    break
+                yield chunk
+
+    def read_base64(self, digest: str) -> str:
+        """Whole blob as base64, for clients that still expect inline file data"""
+        with self.open(digest) as f:
+            return base64.b64encode(f.read()).decode('ascii')
+
+
+blob_store = BlobStore()
@@ -0,0 +1,390 @@
+"""
+Streaming export/import of the chat database, its shards and attachments.
+
+Export writes one file per table (newline-delimited JSON, optionally gzipped,
+or Parquet when pyarrow is installed) plus a manifest.json. Rows are read in
+keyset batches, so memory stays bounded and the live server keeps writing.
+Sharded tables are merged into one file. Attachments are exported by
+reference: file_attachments rows carry their sha256, and with
+--attachments copy the referenced blobs are copied under <dir>/attachments.
+A full export (no --tables) also copies the monthly archive files that
+retention moved expired messages into, under <dir>/archive.
+
+Import loads an export into an empty database. Rows go in large batched
+transactions with the tables' indexes and search triggers dropped; they are
+recreated, and the full-text index rebuilt, once every row is in. An import
+that dies halfway should be rerun against a fresh database (init_db restores
+any index or trigger it had dropped). Archive months are copied back into
+CHAT_ARCHIVE_DIR unless that month is already archived there.
+
+    python -m persistence.bulk export DIR [--format ndjson|parquet] [--gzip] [--attachments none|ref|copy]
+    python -m persistence.bulk import DIR [--batch 50000]
+"""
+import argparse
+import gzip
+import json
+import os
+import time
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from .blobstore import blob_store, READ_CHUNK
+from .connection import get_manager, ConnectionManager
+from . import archive, chatdb, shards
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:  # Parquet output is optional
+    pyarrow = None
+
+EXPORT_BATCH_ROWS = int(os.getenv('BULK_EXPORT_BATCH_ROWS', '5000'))
+IMPORT_BATCH_ROWS = int(os.getenv('BULK_IMPORT_BATCH_ROWS', '50000'))
+
+# Sharded tables (merged on export, routed by this column on import)
+SHARD_ROUTING = dict(shards.SHARDED_TABLES, inbox_delivery='inbox_uid')
+
+# Derived or layout-specific tables that are never exported
+SKIPPED_TABLES = {'message_search', 'shard_config', 'sqlite_sequence', 'sqlite_stat1', 'sqlite_stat4'}
+
+# Full-text rows rebuilt from each message table after an import (same encoding as the triggers)
+SEARCH_REBUILD = {
+    'global_messages': "INSERT INTO message_search (rowid, body, scope) SELECT id * 4, message, 'g' FROM global_messages",
+    'room_messages': "INSERT INTO message_search (rowid, body, scope) SELECT id * 4 + 1, message, 'r ' || room_id FROM room_messages",
+    'messages': "INSERT INTO message_search (rowid, body, scope) SELECT id * 4 + 2, message, 'p ' || inbox_uid FROM messages",
+    'adventure_messages': "INSERT INTO message_search (rowid, body, scope) SELECT id * 4 + 3, message, 'a ' || adventure_id FROM adventure_messages",
+}
+
+# SQLite declared type -> Parquet column type
+PARQUET_TYPES = {'INTEGER': 'int64', 'BOOLEAN': 'int64', 'REAL': 'float64'}
+
+
+def _central() -> ConnectionManager:
+    return get_manager(chatdb.CHAT_DB_PATH)
+
+
+def _shard_managers() -> List[ConnectionManager]:
+    return [shards.shard_manager(index) for index in range(shards.shard_count())]
+
+
+def _columns(manager: ConnectionManager, table: str) -> List[Tuple[str, str]]:
+    """(name, declared type) of a table's columns"""
+    with manager.transaction() as db:
+        return [(row['name'], (row['type'] or 'TEXT').split()[0].upper())
+                for row in db.execute(f'PRAGMA table_info({table})')]
+
+
+def export_tables() -> Dict[str, List[ConnectionManager]]:
+    """Every exported table and the databases holding its rows"""
+    with _central().transaction() as db:
+        names = [row['name'] for row in db.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table' ORDER BY rowid")]
+    tables = {}
+    for name in names:
+        if name in SKIPPED_TABLES or name.startswith('message_search_'):
+            continue
+        # Central copies of sharded tables only hold rows left by pre-sharding databases
+        tables[name] = [_central()] + (_shard_managers() if name in SHARD_ROUTING else [])
+    return tables
+
+
+def _stream_rows(manager: ConnectionManager, table: str, batch_rows: int) -> Iterator[List[Dict[str, Any]]]:
+    """Batches of a table's rows; keyset pages on rowid so no read transaction stays open"""
+    with manager.transaction() as db:
+        without_rowid = db.execute(
+            "SELECT sql LIKE '%WITHOUT ROWID%' FROM sqlite_master WHERE name = ?", (table,)).fetchone()[0]
+    if without_rowid:
+        # Small keyed tables (cursors, policies): one streaming cursor
+        with manager.transaction() as db:
+            cur = db.execute(f'SELECT * FROM {table}')
+            while True:
+                rows = cur.fetchmany(batch_rows)
+                if not rows:
+                    return
+                yield [dict(row) for row in rows]
+    last_rowid = None
+    while True:
+        with manager.transaction() as db:
+            if last_rowid is None:
+                cur = db.execute(f'SELECT rowid AS _rowid, * FROM {table} ORDER BY rowid LIMIT ?', (batch_rows,))
+            else:
+                cur = db.execute(f'SELECT rowid AS _rowid, * FROM {table} WHERE rowid > ? ORDER BY rowid LIMIT ?',
+                                 (last_rowid, batch_rows))
+            rows = [dict(row) for row in cur.fetchall()]
+        if not rows:
+            return
+        last_rowid = rows[-1]['_rowid']
+        for row in rows:
+            del row['_rowid']
+        yield rows
+
+
+class _NdjsonWriter:
+    def __init__(self, path: str, compress: bool):
+        self.file = gzip.open(path, 'wt', encoding='utf-8') if compress else open(path, 'w', encoding='utf-8')
+
+    def write(self, rows: List[Dict[str, Any]]):
+        self.file.writelines(json.dumps(row, ensure_ascii=False) + '\n' for row in rows)
+
+    def close(self):
+        self.file.close()
+
+
+class _ParquetWriter:
+    def __init__(self, path: str, columns: List[Tuple[str, str]]):
+        self.schema = pyarrow.schema([(name, getattr(pyarrow, PARQUET_TYPES.get(decl, 'string'))())
+                                      for name, decl in columns])
+        self.writer = pyarrow.parquet.ParquetWriter(path, self.schema)
+
+    def write(self, rows: List[Dict[str, Any]]):
+        self.writer.write_table(pyarrow.Table.from_pylist(rows, schema=self.schema))
+
+    def close(self):
+        self.writer.close()
+
+
+def _table_file(table: str, fmt: str, compress: bool) -> str:
+    if fmt == 'parquet':
+        return f'{table}.parquet'
+    return f'{table}.ndjson' + ('.gz' if compress else '')
+
+
+def _copy_blob(digest: str, target_root: str) -> bool:
+    """Copy one blob into an export's attachments directory, in chunks"""
+    target = os.path.join(target_root, digest[:2], digest[2:4], digest)
+    if os.path.exists(target) or not blob_store.exists(digest):
+        return False
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    with open(target + '.tmp', 'wb') as f:
+        for chunk in blob_store.iter_chunks(digest, READ_CHUNK):
+            f.write(chunk)
+    os.replace(target + '.tmp', target)
+    return True
+
+
+def export(directory: str, fmt: str = 'ndjson', compress: bool = False, attachments: str = 'ref',
+           tables: Optional[List[str]] = None, batch_rows: int = EXPORT_BATCH_ROWS) -> Dict[str, Any]:
+    """Stream the selected tables (default: all) into directory and write its manifest"""
+    if fmt == 'parquet' and pyarrow is None:
+        raise RuntimeError("pyarrow is required for Parquet export")
+    os.makedirs(directory, exist_ok=True)
+    with _central().transaction() as db:
+        user_version = db.execute('PRAGMA user_version').fetchone()[0]
+    manifest = {'format': fmt, 'compressed': compress and fmt == 'ndjson', 'attachments': attachments,
+                'user_version': user_version, 'created_at': time.strftime('%Y-%m-%d %H:%M:%S'), 'tables': {},
+                'archive': {}}
+
+    for table, sources in export_tables().items():
+        if tables and table not in tables:
+            continue
+        if table == 'file_attachments' and attachments == 'none':
+            continue
+        columns = _columns(sources[0], table)
+        if table == 'file_attachments':
+            columns = [column for column in columns if column[0] != 'blob']  # content goes by reference
+        names = [name for name, _ in columns]
+        filename = _table_file(table, fmt, compress)
+        path = os.path.join(directory, filename)
+        writer = _ParquetWriter(path, columns) if fmt == 'parquet' else _NdjsonWriter(path, compress)
+        count = inline = copied = 0
+        try:
+            for source in sources:
+                for rows in _stream_rows(source, table, batch_rows):
+                    if table == 'file_attachments':
+                        inline += sum(1 for row in rows if not row['sha256'])
+                        if attachments == 'copy':
+                            copied += sum(_copy_blob(row['sha256'], os.path.join(directory, 'attachments'))
+                                          for row in rows if row['sha256'])
+                    writer.write([{name: row.get(name) for name in names} for row in rows])
+                    count += len(rows)
+        finally:
+            writer.close()
+        manifest['tables'][table] = {'file': filename, 'rows': count, 'columns': names}
+        print(f"[Bulk] Exported {count} rows of {table}")
+        if inline:
+            print(f"[Bulk] {inline} attachments still inline were exported without content; "
+                  f"run python -m persistence.migrate_attachments first")
+        if copied:
+            print(f"[Bulk] Copied {copied} attachment blobs")
+
+    months = archive.list_months()
+    if tables:
+        if months:
+            print(f"[Bulk] {len(months)} archived months were not exported; run without --tables to include them")
+    else:
+        for month in months:
+            manifest['archive'][month] = 'archive/' + archive.export_month(month, os.path.join(directory, 'archive'))
+        if months:
+            print(f"[Bulk] Copied {len(months)} archived months")
+
+    with open(os.path.join(directory, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+def _read_batches(path: str, fmt: str, compress: bool, batch_rows: int) -> Iterator[List[Dict[str, Any]]]:
+    if fmt == 'parquet':
+        if pyarrow is None:
+            raise RuntimeError("pyarrow is required to import Parquet files")
+        for batch in pyarrow.parquet.ParquetFile(path).iter_batches(batch_size=batch_rows):
+            yield batch.to_pylist()
+        return
+    with (gzip.open(path, 'rt', encoding='utf-8') if compress else open(path, encoding='utf-8')) as f:
+        rows = []
+        for line in f:
+            if line.strip():
+                rows.append(json.loads(line))
+            if len(rows) >= batch_rows:
+                yield rows
+                rows = []
+        if rows:
+            yield rows
+
+
+def _defer_indexes(manager: ConnectionManager, tables: List[str]) -> List[str]:
+    """Drop the tables' indexes and search triggers; returns the SQL that recreates them"""
+    with manager.transaction() as db:
+        found = [(row['type'], row['name'], row['sql']) for row in db.execute(
+            f"""SELECT type, name, sql FROM sqlite_master
+                WHERE type IN ('index', 'trigger') AND sql IS NOT NULL
+                  AND tbl_name IN ({','.join('?' * len(tables))})""", tables)]
+        for kind, name, _ in found:
+            db.execute(f'DROP {kind.upper()} {name}')
+    return [sql for _, _, sql in found]
+
+
+class _Loader:
+    """Batched inserts into one database with its indexes deferred"""
+
+    def __init__(self, manager: ConnectionManager, table: str, columns: List[str]):
+        self.manager = manager
+        self.sql = f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})"
+        self.columns = columns
+        self.rows = []
+
+    def add(self, row: Dict[str, Any], batch_rows: int):
+        self.rows.append(tuple(row.get(column) for column in self.columns))
+        if len(self.rows) >= batch_rows:
+            self.flush()
+
+    def flush(self):
+        if self.rows:
+            with self.manager.transaction() as db:
+                db.executemany(self.sql, self.rows)
+            self.rows = []
+
+
+def _import_blobs(directory: str) -> int:
+    """Add an export's copied blobs to the blob store (verified by re-hashing)"""
+    imported = 0
+    for root, _, names in os.walk(os.path.join(directory, 'attachments')):
+        for name in names:
+            if name.endswith('.tmp') or blob_store.exists(name):
+                continue
+            with open(os.path.join(root, name), 'rb') as f:
+                digest, _ = blob_store.put_stream(iter(lambda: f.read(READ_CHUNK), b''))
+            if digest != name:
+                print(f"[Bulk] Attachment {name} is corrupt (content hashes to {digest})")
+            imported += 1
+    return imported
+
+
+def import_export(directory: str, batch_rows: int = IMPORT_BATCH_ROWS) -> Dict[str, int]:
+    """Load an export into the (empty) chat database and shards"""
+    with open(os.path.join(directory, 'manifest.json')) as f:
+        manifest = json.load(f)
+    tables = list(manifest['tables'])
+    central = _central()
+    targets = {table: [shards.shard_manager(index) for index in range(shards.shard_count())]
+               if table in SHARD_ROUTING else [central] for table in tables}
+
+    for table, managers in targets.items():
+        for manager in managers:
+            with manager.transaction() as db:
+                if db.execute(f'SELECT 1 FROM {table} LIMIT 1').fetchone():
+                    raise RuntimeError(f"{table} already has rows in {manager.db_path}; import needs an empty database")
+
+    deferred = {}
+    for manager in [central] + _shard_managers():
+        names = [table for table, managers in targets.items() if manager in managers]
+        if names:
+            deferred[manager] = _defer_indexes(manager, names)
+
+    counts = {}
+    max_sharded_id = 0
+    started = time.perf_counter()
+    try:
+        for table in tables:
+            info = manifest['tables'][table]
+            existing = {name for name, _ in _columns(targets[table][0], table)}
+            columns = [column for column in info['columns'] if column in existing]
+            dropped = set(info['columns']) - existing
+            if dropped:
+                print(f"[Bulk] {table}: skipping columns not in this schema: {', '.join(sorted(dropped))}")
+            loaders = [_Loader(manager, table, columns) for manager in targets[table]]
+            route = SHARD_ROUTING.get(table)
+            count = 0
+            for rows in _read_batches(os.path.join(directory, info['file']), manifest['format'],
+                                      manifest.get('compressed', False), batch_rows):
+                for row in rows:
+                    loaders[shards.shard_for(row[route]) if route else 0].add(row, batch_rows)
+                    if route and 'id' in row:
+                        max_sharded_id = max(max_sharded_id, row['id'] or 0)
+                count += len(rows)
+            for loader in loaders:
+                loader.flush()
+            counts[table] = count
+            print(f"[Bulk] Imported {count} rows of {table} ({time.perf_counter() - started:.0f}s)")
+    finally:
+        # Indexes and triggers come back even if the import failed, so the schema stays whole
+        for manager, statements in deferred.items():
+            with manager.transaction() as db:
+                for statement in statements:
+                    db.execute(statement)
+
+    print(f"[Bulk] Rebuilt indexes ({time.perf_counter() - started:.0f}s)")
+    for manager in [central] + _shard_managers():
+        rebuild = [SEARCH_REBUILD[table] for table in tables
+                   if table in SEARCH_REBUILD and manager in targets[table]]
+        if rebuild:
+            with manager.transaction() as db:
+                for statement in rebuild:
+                    db.execute(statement)
+                db.execute('PRAGMA optimize')
+    print(f"[Bulk] Rebuilt the search index ({time.perf_counter() - started:.0f}s)")
+    for month, filename in manifest.get('archive', {}).items():
+        if archive.import_month(month, os.path.join(directory, filename)):
+            print(f"[Bulk] Restored archive month {month}")
+            max_sharded_id = max(max_sharded_id, archive.max_id(month, shards.SHARDED_TABLES))
+        else:
+            print(f"[Bulk] Archive month {month} already exists in {archive.ARCHIVE_DIR}; left as is")
+    # New shard ids must not collide with ids that came from the exporting layout or its archive
+    shards.reserve_ids_above(central, max_sharded_id)
+    if manifest.get('attachments') == 'copy':
+        print(f"[Bulk] Imported {_import_blobs(directory)} attachment blobs into {blob_store.root}")
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('command', choices=['export', 'import'])
+    parser.add_argument('directory', help='export directory')
+    parser.add_argument('--format', choices=['ndjson', 'parquet'], default='ndjson', help='export file format')
+    parser.add_argument('--gzip', action='store_true', help='gzip NDJSON files')
+    parser.add_argument('--attachments', choices=['none', 'ref', 'copy'], default='ref',
+                        help='skip attachment rows, export them by sha256 reference, or also copy the blobs')
+    parser.add_argument('--tables', nargs='*', help='export only these tables')
+    parser.add_argument('--batch', type=int, help='rows per read (export) or per transaction (import)')
+    args = parser.parse_args()
+
+    chatdb.init_db()
+    if args.command == 'export':
+        manifest = export(args.directory, args.format, args.gzip, args.attachments, args.tables,
+                          args.batch or EXPORT_BATCH_ROWS)
+        total = sum(table['rows'] for table in manifest['tables'].values())
+        print(f"Done: {total} rows in {len(manifest['tables'])} tables written to {args.directory}")
+    else:
+        counts = import_export(args.directory, args.batch or IMPORT_BATCH_ROWS)
+        print(f"Done: {sum(counts.values())} rows imported into {chatdb.CHAT_DB_PATH}")
+
+
+if __name__ == '__main__':
+    main()
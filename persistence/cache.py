@@ -0,0 +1,67 @@
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Hashable
+
+MISSING = object()
+
+# Set in each process of a CHAT_WORKERS deployment (see cluster.py). The processes
+# share the databases but not their caches, and nothing tells one process about
+# another's writes, so caches of state that changes are turned off there.
+WORKER_PROCESS = os.getenv('CHAT_WORKER_INDEX') is not None
+
+
+class LRUCache:
+    """Thread-safe bounded LRU mapping with hit/miss counters"""
+
+    def __init__(self, maxsize: int, name: str = ''):
+        self.maxsize = maxsize
+        self.name = name
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable, default: Any = MISSING) -> Any:
+        """Return the cached value (marking it recently used) or default"""
+        with self._lock:
+            try:
+                value = self._data[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key: Hashable, value: Any):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key: Hashable):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            'name': self.name,
+            'size': len(self._data),
+            'maxsize': self.maxsize,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_ratio': round(self.hits / lookups, 4) if lookups else 0.0,
+        }
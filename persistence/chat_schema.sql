@@ -1,4 +1,7 @@
 -- SQLite schema for chat, messages, and adventure system
+-- room_messages, messages and adventure_messages are kept here only for databases
+-- created before sharding; init_db moves their rows into the shard files
+-- (see chat_shard_schema.sql and persistence/shards.py).
 
 CREATE TABLE IF NOT EXISTS users (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -12,15 +15,29 @@ CREATE TABLE IF NOT EXISTS inbox (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
     inboxuid TEXT UNIQUE NOT NULL,
     last_message TEXT,
-    last_sent_user_id INTEGER REFERENCES users(id)
+    last_sent_user_id INTEGER REFERENCES users(id),
+    last_message_id INTEGER,
+    last_activity_at DATETIME,
+    message_count INTEGER NOT NULL DEFAULT 0
 );
 
 CREATE TABLE IF NOT EXISTS inbox_participants (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
     inbox_uid TEXT NOT NULL,
-    user_id INTEGER REFERENCES users(id)
+    user_id INTEGER REFERENCES users(id),
+    peer_user_id INTEGER REFERENCES users(id),  -- the other participant, so the PM list needs no self-join
+    unread_count INTEGER NOT NULL DEFAULT 0,
+    last_activity_at DATETIME                   -- copy of inbox.last_activity_at for the per-user sort index
 );
 
+-- Per-(user, inbox) delivery cursor: id of the last private message delivered to the user
+CREATE TABLE IF NOT EXISTS inbox_delivery (
+    user_id INTEGER NOT NULL REFERENCES users(id),
+    inbox_uid TEXT NOT NULL,
+    last_delivered_id INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (user_id, inbox_uid)
+) WITHOUT ROWID;
+
 CREATE TABLE IF NOT EXISTS messages (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
     inbox_uid TEXT NOT NULL,
@@ -84,7 +101,8 @@ CREATE TABLE IF NOT EXISTS adventure_messages (
 CREATE TABLE IF NOT EXISTS file_attachments (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
     filename TEXT NOT NULL,
-    blob TEXT NOT NULL,
+    blob TEXT NOT NULL DEFAULT '',  -- legacy inline base64; empty once content is in the blob store
+    sha256 TEXT,                    -- content address in the on-disk blob store
     file_size INTEGER,
     mime_type TEXT,
     created_at DATETIME DEFAULT CURRENT_TIMESTAMP
@@ -102,7 +120,100 @@ CREATE TABLE IF NOT EXISTS global_messages (
 PRAGMA foreign_keys = ON;
 
 CREATE INDEX IF NOT EXISTS idx_inbox_uid ON inbox_participants(inbox_uid);
+CREATE INDEX IF NOT EXISTS idx_inbox_participants_user ON inbox_participants(user_id, inbox_uid);
 CREATE INDEX IF NOT EXISTS idx_room_participants ON room_participants(room_id);
 CREATE INDEX IF NOT EXISTS idx_adventure_participants ON adventure_participants(adventure_id);
-CREATE INDEX IF NOT EXISTS idx_messages_inbox_uid ON messages(inbox_uid);
 CREATE INDEX IF NOT EXISTS idx_users_useruid ON users(useruid);
+
+-- History is paged by message id within a scope (keyset pagination)
+DROP INDEX IF EXISTS idx_messages_inbox_uid;
+CREATE INDEX IF NOT EXISTS idx_messages_inbox_id ON messages(inbox_uid, id);
+CREATE INDEX IF NOT EXISTS idx_room_messages_room_id ON room_messages(room_id, id);
+CREATE INDEX IF NOT EXISTS idx_adventure_messages_adventure_id ON adventure_messages(adventure_id, id);
+
+-- Membership lookups by user (search scoping, room restore)
+CREATE INDEX IF NOT EXISTS idx_room_participants_user ON room_participants(user_id, room_id);
+CREATE INDEX IF NOT EXISTS idx_adventure_participants_user ON adventure_participants(user_id, adventure_id);
+
+-- Full-text search over every message table.
+-- rowid = message id * 4 + kind (0 global, 1 room, 2 private, 3 adventure) so each
+-- source row maps to exactly one index row. scope holds an indexed token phrase
+-- ("g", "r <room_id>", "p inbox <a> <b>", "a <adventure_id>") that search uses to
+-- restrict matches to conversations the caller can see.
+CREATE VIRTUAL TABLE IF NOT EXISTS message_search USING fts5(body, scope, tokenize = 'unicode61');
+
+CREATE TRIGGER IF NOT EXISTS global_messages_search_ai AFTER INSERT ON global_messages BEGIN
+    INSERT INTO message_search (rowid, body, scope) VALUES (NEW.id * 4, NEW.message, 'g');
+END;
+CREATE TRIGGER IF NOT EXISTS global_messages_search_ad AFTER DELETE ON global_messages BEGIN
+    DELETE FROM message_search WHERE rowid = OLD.id * 4;
+END;
+
+CREATE TRIGGER IF NOT EXISTS room_messages_search_ai AFTER INSERT ON room_messages BEGIN
+    INSERT INTO message_search (rowid, body, scope) VALUES (NEW.id * 4 + 1, NEW.message, 'r ' || NEW.room_id);
+END;
+CREATE TRIGGER IF NOT EXISTS room_messages_search_ad AFTER DELETE ON room_messages BEGIN
+    DELETE FROM message_search WHERE rowid = OLD.id * 4 + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS messages_search_ai AFTER INSERT ON messages BEGIN
+    INSERT INTO message_search (rowid, body, scope) VALUES (NEW.id * 4 + 2, NEW.message, 'p ' || NEW.inbox_uid);
+END;
+CREATE TRIGGER IF NOT EXISTS messages_search_ad AFTER DELETE ON messages BEGIN
+    DELETE FROM message_search WHERE rowid = OLD.id * 4 + 2;
+END;
+
+-- Inbox summaries are maintained by chatdb once the shard insert commits
+DROP TRIGGER IF EXISTS messages_inbox_summary_ai;
+
+CREATE TRIGGER IF NOT EXISTS adventure_messages_search_ai AFTER INSERT ON adventure_messages BEGIN
+    INSERT INTO message_search (rowid, body, scope) VALUES (NEW.id * 4 + 3, NEW.message, 'a ' || NEW.adventure_id);
+END;
+CREATE TRIGGER IF NOT EXISTS adventure_messages_search_ad AFTER DELETE ON adventure_messages BEGIN
+    DELETE FROM message_search WHERE rowid = OLD.id * 4 + 3;
+END;
+
+-- Retention: messages older than max_age_days move to the monthly archive files.
+-- scope_id '' is the table default; a room id / inbox uid / adventure id overrides it.
+-- No row for a table means its messages are kept forever.
+CREATE TABLE IF NOT EXISTS retention_policies (
+    table_name TEXT NOT NULL,
+    scope_id TEXT NOT NULL DEFAULT '',
+    max_age_days INTEGER NOT NULL,
+    PRIMARY KEY (table_name, scope_id)
+) WITHOUT ROWID;
+
+-- Attachment reference checks when archived messages are pruned
+CREATE INDEX IF NOT EXISTS idx_global_messages_file ON global_messages(file_id) WHERE file_id IS NOT NULL;
+CREATE INDEX IF NOT EXISTS idx_room_messages_file ON room_messages(file_id) WHERE file_id IS NOT NULL;
+CREATE INDEX IF NOT EXISTS idx_messages_file ON messages(file_id) WHERE file_id IS NOT NULL;
+CREATE INDEX IF NOT EXISTS idx_adventure_messages_file ON adventure_messages(file_id) WHERE file_id IS NOT NULL;
+
+-- Per-room aggregates for the room directory. Membership is counted by the
+-- triggers below; message_count / last activity are bumped by chatdb once a
+-- room message commits in its shard (messages posted, archived ones included).
+CREATE TABLE IF NOT EXISTS room_stats (
+    room_id INTEGER PRIMARY KEY REFERENCES rooms(id),
+    member_count INTEGER NOT NULL DEFAULT 0,
+    message_count INTEGER NOT NULL DEFAULT 0,
+    last_message_id INTEGER,
+    last_activity_at DATETIME
+);
+CREATE INDEX IF NOT EXISTS idx_room_stats_activity ON room_stats(last_activity_at DESC);
+CREATE INDEX IF NOT EXISTS idx_room_stats_members ON room_stats(member_count DESC);
+
+CREATE TRIGGER IF NOT EXISTS rooms_stats_ai AFTER INSERT ON rooms BEGIN
+    INSERT OR IGNORE INTO room_stats (room_id) VALUES (NEW.id);
+END;
+CREATE TRIGGER IF NOT EXISTS room_participants_stats_ai AFTER INSERT ON room_participants BEGIN
+    UPDATE room_stats SET member_count = member_count + 1 WHERE room_id = NEW.room_id;
+END;
+CREATE TRIGGER IF NOT EXISTS room_participants_stats_ad AFTER DELETE ON room_participants BEGIN
+    UPDATE room_stats SET member_count = member_count - 1 WHERE room_id = OLD.room_id;
+END;
+
+-- Shard layout: shard_count, generation (id range epoch) and a rebalancing flag
+CREATE TABLE IF NOT EXISTS shard_config (
+    name TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+) WITHOUT ROWID;
@@ -0,0 +1,74 @@
+-- SQLite schema for one chat shard: conversation messages routed here by
+-- hash of room_id / inbox_uid / adventure_id. Users, rooms, memberships,
+-- inbox summaries and global chat stay in the central chat database, so the
+-- user_id / room_id / file_id columns below are not foreign keys here.
+
+CREATE TABLE IF NOT EXISTS room_messages (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    room_id INTEGER,
+    user_id INTEGER,
+    message TEXT NOT NULL,
+    file_id INTEGER,
+    message_type TEXT DEFAULT 'text',
+    created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    inbox_uid TEXT NOT NULL,
+    user_id INTEGER,
+    message TEXT NOT NULL,
+    file_id INTEGER,
+    message_type TEXT DEFAULT 'text',
+    created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS adventure_messages (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    adventure_id INTEGER,
+    user_id INTEGER,
+    message TEXT NOT NULL,
+    file_id INTEGER,
+    message_type TEXT DEFAULT 'text',
+    created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Per-(user, inbox) delivery cursor, kept next to the inbox's messages
+CREATE TABLE IF NOT EXISTS inbox_delivery (
+    user_id INTEGER NOT NULL,
+    inbox_uid TEXT NOT NULL,
+    last_delivered_id INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (user_id, inbox_uid)
+) WITHOUT ROWID;
+
+CREATE INDEX IF NOT EXISTS idx_messages_inbox_id ON messages(inbox_uid, id);
+CREATE INDEX IF NOT EXISTS idx_room_messages_room_id ON room_messages(room_id, id);
+CREATE INDEX IF NOT EXISTS idx_adventure_messages_adventure_id ON adventure_messages(adventure_id, id);
+
+CREATE INDEX IF NOT EXISTS idx_room_messages_file ON room_messages(file_id) WHERE file_id IS NOT NULL;
+CREATE INDEX IF NOT EXISTS idx_messages_file ON messages(file_id) WHERE file_id IS NOT NULL;
+CREATE INDEX IF NOT EXISTS idx_adventure_messages_file ON adventure_messages(file_id) WHERE file_id IS NOT NULL;
+
+-- Same rowid / scope encoding as the central message_search table
+CREATE VIRTUAL TABLE IF NOT EXISTS message_search USING fts5(body, scope, tokenize = 'unicode61');
+
+CREATE TRIGGER IF NOT EXISTS room_messages_search_ai AFTER INSERT ON room_messages BEGIN
+    INSERT INTO message_search (rowid, body, scope) VALUES (NEW.id * 4 + 1, NEW.message, 'r ' || NEW.room_id);
+END;
+CREATE TRIGGER IF NOT EXISTS room_messages_search_ad AFTER DELETE ON room_messages BEGIN
+    DELETE FROM message_search WHERE rowid = OLD.id * 4 + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS messages_search_ai AFTER INSERT ON messages BEGIN
+    INSERT INTO message_search (rowid, body, scope) VALUES (NEW.id * 4 + 2, NEW.message, 'p ' || NEW.inbox_uid);
+END;
+CREATE TRIGGER IF NOT EXISTS messages_search_ad AFTER DELETE ON messages BEGIN
+    DELETE FROM message_search WHERE rowid = OLD.id * 4 + 2;
+END;
+
+CREATE TRIGGER IF NOT EXISTS adventure_messages_search_ai AFTER INSERT ON adventure_messages BEGIN
+    INSERT INTO message_search (rowid, body, scope) VALUES (NEW.id * 4 + 3, NEW.message, 'a ' || NEW.adventure_id);
+END;
+CREATE TRIGGER IF NOT EXISTS adventure_messages_search_ad AFTER DELETE ON adventure_messages BEGIN
+    DELETE FROM message_search WHERE rowid = OLD.id * 4 + 3;
+END;
@@ -1,83 +1,392 @@
-import sqlite3
-from contextlib import contextmanager
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, Tuple
+from concurrent.futures import Future
+from datetime import datetime
 import os
+from .connection import get_manager
+from .journal import get_journal
+from .blobstore import blob_store
+from .cache import LRUCache, MISSING, WORKER_PROCESS
+from .recent import RecentHistory
+from . import archive, shards
 
 CHAT_DB_PATH = os.path.join(os.path.dirname(__file__), '../chatdb.sqlite3')
 
-@contextmanager
+# Identity/lookup caches in front of the hottest near-immutable queries
+LOOKUP_CACHE_SIZE = int(os.getenv('CHAT_LOOKUP_CACHE_SIZE', '10000'))
+_user_ids = LRUCache(LOOKUP_CACHE_SIZE, 'users')          # username -> user id
+_room_ids = LRUCache(LOOKUP_CACHE_SIZE, 'rooms')          # room name -> room id
+_memberships = LRUCache(0 if WORKER_PROCESS else LOOKUP_CACHE_SIZE, 'memberships')  # (user id, room id) -> bool
+_inboxes = LRUCache(LOOKUP_CACHE_SIZE, 'inboxes')         # inbox uid -> True once it exists
+_usernames = LRUCache(LOOKUP_CACHE_SIZE, 'usernames')     # user id -> username, for rows read from shards
+_filenames = LRUCache(LOOKUP_CACHE_SIZE, 'filenames')     # file id -> filename, for file messages in history
+
+# Ring buffers of the newest global/room history rows, keyed by (table, scope value)
+RECENT_HISTORY_SIZE = int(os.getenv('CHAT_RECENT_HISTORY_SIZE', '200'))
+RECENT_HISTORY_SCOPES = int(os.getenv('CHAT_RECENT_HISTORY_SCOPES', '1000'))
+# Another worker's messages never reach this process's windows, so worker mode reads SQLite
+RECENT_HISTORY_ENABLED = RECENT_HISTORY_SIZE > 0 and not WORKER_PROCESS
+_recent = RecentHistory(RECENT_HISTORY_SIZE, RECENT_HISTORY_SCOPES, 'recent_history')
+
+def get_cache_stats() -> List[Dict[str, Any]]:
+    """Hit/miss counters for the lookup caches and recent-history windows"""
+    return [cache.stats() for cache in (_user_ids, _room_ids, _memberships, _inboxes, _usernames, _filenames, _recent)]
+
+def clear_lookup_caches():
+    for cache in (_user_ids, _room_ids, _memberships, _inboxes, _usernames, _filenames):
+        cache.clear()
+
+def clear_recent_history():
+    """Drop every recent-history window; they are re-warmed from SQLite on next read"""
+    _recent.clear()
+
 def get_db():
-    conn = sqlite3.connect(CHAT_DB_PATH)
-    conn.row_factory = sqlite3.Row
-    try:
-        yield conn
-        conn.commit()
-    finally:
-        conn.close()
-
-def init_db():
-    """Initialize the chat database"""
+    """Reuse this thread's pooled chat DB connection inside a transaction"""
+    return get_manager(CHAT_DB_PATH).transaction()
+
+def get_message_journal():
+    """Write-behind journal that batches chat message inserts"""
+    return get_journal(CHAT_DB_PATH)
+
+def flush_messages(timeout: Optional[float] = None) -> bool:
+    """Block until every queued message insert is committed, in the central DB and every shard"""
+    # Shards first: their commits queue inbox summary updates on the central journal
+    flushed = all([journal.flush(timeout) for journal in shards.all_journals()])
+    return get_message_journal().flush(timeout) and flushed
+
+def close_message_journals(timeout: Optional[float] = None):
+    """Drain and stop the message journals, in the same order as flush_messages"""
+    # Shards first: their commits queue inbox summary and room_stats updates on the central journal
+    for journal in shards.all_journals():
+        journal.close(timeout)
+    get_message_journal().close(timeout)
+
+def message_sources(table: str) -> List[Any]:
+    """Transaction factories for every database holding rows of a message table"""
+    if table in shards.SHARDED_TABLES:
+        return [lambda index=index: shards.shard_db(index) for index in range(shards.shard_count())]
+    return [get_db]
+
+def attach_usernames(rows: List[Dict[str, Any]], field: str = 'useruid') -> List[Dict[str, Any]]:
+    """Fill in each row's username from its user_id (shard rows can't join the central users table)"""
+    missing = {row['user_id'] for row in rows if _usernames.get(row['user_id']) is MISSING}
+    missing.discard(None)
+    if missing:
+        with get_db() as db:
+            for row in db.execute(f"SELECT id, useruid FROM users WHERE id IN ({','.join('?' * len(missing))})",
+                                  list(missing)):
+                _usernames.put(row['id'], row['useruid'])
+    for row in rows:
+        username = _usernames.get(row['user_id'])
+        row[field] = None if username is MISSING else username
+    return rows
+
+def attach_filenames(rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Fill in the filename of each file message's attachment, so clients can link to /attachments"""
+    missing = {row['file_id'] for row in rows if row.get('file_id') and _filenames.get(row['file_id']) is MISSING}
+    if missing:
+        with get_db() as db:
+            for row in db.execute(f"SELECT id, filename FROM file_attachments WHERE id IN ({','.join('?' * len(missing))})",
+                                  list(missing)):
+                _filenames.put(row['id'], row['filename'])
+        for file_id in missing:
+            if _filenames.get(file_id) is MISSING:
+                attachment = get_file_attachment(file_id)  # pruned by retention; look in the archive
+                if attachment:
+                    _filenames.put(file_id, attachment['filename'])
+    for row in rows:
+        if row.get('file_id'):
+            filename = _filenames.get(row['file_id'])
+            row['filename'] = None if filename is MISSING else filename
+    return rows
+
+def is_attachment_referenced(file_id: int) -> bool:
+    """Whether any hot message row, central or sharded, still points at the attachment"""
+    for table in archive.ARCHIVED_TABLES:
+        for source in message_sources(table):
+            with source() as db:
+                if db.execute(f'SELECT 1 FROM {table} WHERE file_id = ? LIMIT 1', (file_id,)).fetchone():
+                    return True
+    return False
+
+# Columns added after the original schema; CREATE TABLE IF NOT EXISTS won't add them to old databases
+ADDED_COLUMNS = {
+    'file_attachments': [('sha256', 'TEXT')],
+    'inbox': [('last_message_id', 'INTEGER'), ('last_activity_at', 'DATETIME'),
+              ('message_count', 'INTEGER NOT NULL DEFAULT 0')],
+    'inbox_participants': [('peer_user_id', 'INTEGER REFERENCES users(id)'),
+                           ('unread_count', 'INTEGER NOT NULL DEFAULT 0'), ('last_activity_at', 'DATETIME')],
+}
+
+# Indexes over ADDED_COLUMNS, created once the columns are guaranteed to exist
+MIGRATION_INDEXES = [
+    'CREATE INDEX IF NOT EXISTS idx_file_attachments_sha256 ON file_attachments(sha256)',
+    # PM list: one range scan per user, already in last-activity order
+    'CREATE INDEX IF NOT EXISTS idx_inbox_participants_activity ON inbox_participants(user_id, last_activity_at DESC)',
+]
+
+# One-off data backfills, applied in order and tracked with PRAGMA user_version
+DATA_MIGRATIONS = [
+    # 1: seed delivery cursors from last_seen so existing users aren't re-sent old messages
+    '''INSERT OR IGNORE INTO inbox_delivery (user_id, inbox_uid, last_delivered_id)
+       SELECT ip.user_id, ip.inbox_uid,
+              COALESCE((SELECT MAX(m.id) FROM messages m
+                        WHERE m.inbox_uid = ip.inbox_uid AND m.created_at <= u.last_seen), 0)
+       FROM inbox_participants ip JOIN users u ON u.id = ip.user_id''',
+    # 2: index messages written before full-text search existed
+    (
+        "INSERT INTO message_search (rowid, body, scope) SELECT id * 4, message, 'g' FROM global_messages",
+        "INSERT INTO message_search (rowid, body, scope) SELECT id * 4 + 1, message, 'r ' || room_id FROM room_messages",
+        "INSERT INTO message_search (rowid, body, scope) SELECT id * 4 + 2, message, 'p ' || inbox_uid FROM messages",
+        "INSERT INTO message_search (rowid, body, scope) SELECT id * 4 + 3, message, 'a ' || adventure_id FROM adventure_messages",
+    ),
+    # 3: fill inbox summaries for conversations that predate them; unread starts at the delivery cursor
+    (
+        '''UPDATE inbox SET
+               (last_message, last_sent_user_id, last_message_id, last_activity_at) =
+                   (SELECT m.message, m.user_id, m.id, m.created_at FROM messages m
+                    WHERE m.inbox_uid = inbox.inboxuid ORDER BY m.id DESC LIMIT 1),
+               message_count = (SELECT COUNT(*) FROM messages m WHERE m.inbox_uid = inbox.inboxuid)''',
+        '''UPDATE inbox_participants SET
+               peer_user_id = (SELECT p.user_id FROM inbox_participants p
+                               WHERE p.inbox_uid = inbox_participants.inbox_uid
+                                 AND p.user_id != inbox_participants.user_id),
+               last_activity_at = (SELECT i.last_activity_at FROM inbox i
+                                   WHERE i.inboxuid = inbox_participants.inbox_uid),
+               unread_count = (SELECT COUNT(*) FROM messages m
+                               WHERE m.inbox_uid = inbox_participants.inbox_uid
+                                 AND m.user_id != inbox_participants.user_id
+                                 AND m.id > COALESCE((SELECT d.last_delivered_id FROM inbox_delivery d
+                                                      WHERE d.user_id = inbox_participants.user_id
+                                                        AND d.inbox_uid = inbox_participants.inbox_uid), 0))''',
+    ),
+]
+
+def _apply_migrations(db):
+    """Bring an existing chat database up to the current schema"""
+    for table, columns in ADDED_COLUMNS.items():
+        existing = {row['name'] for row in db.execute(f'PRAGMA table_info({table})')}
+        for name, decl in columns:
+            if name not in existing:
+                db.execute(f'ALTER TABLE {table} ADD COLUMN {name} {decl}')
+    for statement in MIGRATION_INDEXES:
+        db.execute(statement)
+    version = db.execute('PRAGMA user_version').fetchone()[0]
+    for number, migration in enumerate(DATA_MIGRATIONS[version:], start=version + 1):
+        for statement in (migration if isinstance(migration, tuple) else (migration,)):
+            db.execute(statement)
+        db.execute(f'PRAGMA user_version = {number}')
+
+def init_db(open_shards: bool = True):
+    """Initialize the chat database and its shards (open_shards=False for the rebalance tool)"""
+    with open(os.path.join(os.path.dirname(__file__), 'chat_schema.sql'), 'r') as f:
+        get_manager(CHAT_DB_PATH).run_script(f.read())
     with get_db() as db:
-        with open(os.path.join(os.path.dirname(__file__), 'chat_schema.sql'), 'r') as f:
-            db.executescript(f.read())
+        _apply_migrations(db)
+    if open_shards:
+        shards.init_shards(get_manager(CHAT_DB_PATH))
+        with get_db() as db:
+            stale = db.execute('SELECT (SELECT COUNT(*) FROM rooms) > (SELECT COUNT(*) FROM room_stats)').fetchone()[0]
+        if stale:
+            rebuild_room_stats()  # rooms that predate room_stats
+
+def _now() -> str:
+    """UTC timestamp in SQLite's CURRENT_TIMESTAMP format"""
+    return datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')
 
-def save_global_message(user_id: int, message: str, message_type: str = 'text', file_id: Optional[int] = None):
+def _append_recent(future: Future, table: str, scope_value: Any, row: Dict[str, Any]):
+    """Once the insert commits, add the row to its scope's recent-history window"""
+    def done(f: Future):
+        if f.exception() is not None:
+            return
+        username = _usernames.get(row['user_id'])
+        filename = _filenames.get(row['file_id']) if row['file_id'] else None
+        if username is MISSING or filename is MISSING:
+            _recent.invalidate((table, scope_value))  # can't build the row; re-warm from SQLite
+            return
+        entry = dict(row, id=f.result(), useruid=username)
+        if filename is not None:
+            entry['filename'] = filename
+        _recent.append((table, scope_value), entry)
+    future.add_done_callback(done)
+    return future
+
+def save_global_message(user_id: int, message: str, message_type: str = 'text', file_id: Optional[int] = None) -> Future:
+    """Queue a global message insert; the returned future resolves to its id once committed"""
+    created_at = _now()
+    future = get_message_journal().submit(
+        'INSERT INTO global_messages (user_id, message, message_type, file_id, created_at) VALUES (?, ?, ?, ?, ?)',
+        (user_id, message, message_type, file_id, created_at)
+    )
+    return _append_recent(future, 'global_messages', None, {
+        'user_id': user_id, 'message': message, 'file_id': file_id,
+        'message_type': message_type, 'created_at': created_at,
+    })
+
+def save_file_attachment(filename: str, blob: str, file_size: Optional[int] = None, mime_type: Optional[str] = None) -> int:
+    """Store base64 file content in the blob store and save its metadata; returns file_id"""
+    digest, size = blob_store.put_base64(blob)
     with get_db() as db:
-        db.execute(
-            'INSERT INTO global_messages (user_id, message, message_type, file_id) VALUES (?, ?, ?, ?)',
-            (user_id, message, message_type, file_id)
+        # blob stays empty: content lives on disk under its SHA-256
+        cur = db.execute(
+            'INSERT INTO file_attachments (filename, blob, sha256, file_size, mime_type) VALUES (?, ?, ?, ?, ?)',
+            (filename, '', digest, size, mime_type)
         )
+        file_id = cur.lastrowid or 0
+    _filenames.put(file_id, filename)
+    return file_id
 
-def save_file_attachment(filename: str, blob: str, file_size: Optional[int] = None, mime_type: Optional[str] = None) -> int:
-    """Save file attachment and return file_id"""
+def get_file_attachment(file_id: int) -> Optional[Dict[str, Any]]:
+    """Get attachment metadata (without content) by ID, from the archive once retention pruned it"""
     with get_db() as db:
         cur = db.execute(
-            'INSERT INTO file_attachments (filename, blob, file_size, mime_type) VALUES (?, ?, ?, ?)',
-            (filename, blob, file_size, mime_type)
+            'SELECT id, filename, sha256, file_size, mime_type, created_at FROM file_attachments WHERE id = ?',
+            (file_id,)
         )
-        return cur.lastrowid or 0
+        row = cur.fetchone()
+    if row:
+        return dict(row)
+    attachment, _ = archive.find_attachment(file_id)
+    if attachment:
+        del attachment['blob']
+    return attachment
+
+def can_access_attachment(user_id: int, file_id: int) -> bool:
+    """True if the file is attached to a global message, or to a room, private or
+    adventure message in a conversation the user takes part in (hot or archived)"""
+    with get_db() as db:
+        if db.execute('SELECT 1 FROM global_messages WHERE file_id = ? LIMIT 1', (file_id,)).fetchone():
+            return True
+    scopes = {'room_messages': set(), 'messages': set(), 'adventure_messages': set()}
+    for index in range(shards.shard_count()):
+        with shards.shard_db(index) as db:
+            for table, column in (('room_messages', 'room_id'), ('messages', 'inbox_uid'),
+                                  ('adventure_messages', 'adventure_id')):
+                cur = db.execute(f'SELECT {column} FROM {table} WHERE file_id = ?', (file_id,))
+                scopes[table].update(row[0] for row in cur.fetchall())
+    if _is_participant(user_id, scopes):
+        return True
+    # Messages moved out by retention keep their attachments reachable
+    _, archived = archive.find_attachment(file_id)
+    return bool(archived.get('global_messages')) or _is_participant(user_id, archived)
+
+def _is_participant(user_id: int, scopes: Dict[str, Any]) -> bool:
+    checks = (('room_messages', 'SELECT 1 FROM room_participants WHERE user_id = ? AND room_id = ?'),
+              ('messages', 'SELECT 1 FROM inbox_participants WHERE user_id = ? AND inbox_uid = ?'),
+              ('adventure_messages', 'SELECT 1 FROM adventure_participants WHERE user_id = ? AND adventure_id = ?'))
+    with get_db() as db:
+        for table, sql in checks:
+            for scope_value in scopes.get(table, ()):
+                if db.execute(sql, (user_id, scope_value)).fetchone():
+                    return True
+    return False
+
+def get_legacy_attachment_blob(file_id: int) -> Optional[str]:
+    """Base64 content of an attachment that has not been moved to the blob store yet"""
+    with get_db() as db:
+        cur = db.execute('SELECT blob FROM file_attachments WHERE id = ? AND sha256 IS NULL', (file_id,))
+        row = cur.fetchone()
+    if row:
+        return row['blob']
+    attachment, _ = archive.find_attachment(file_id)
+    return attachment['blob'] if attachment and attachment['sha256'] is None else None
 
 def get_global_messages(limit: int = 50) -> List[Dict[str, Any]]:
     with get_db() as db:
         cur = db.execute(
-            'SELECT * FROM global_messages ORDER BY created_at DESC LIMIT ?', (limit,)
+            'SELECT * FROM global_messages ORDER BY id DESC LIMIT ?', (limit,)
         )
         return [dict(row) for row in cur.fetchall()]
 
-def save_room_message(room_id: int, user_id: int, message: str, message_type: str = 'text', file_id: Optional[int] = None):
-    with get_db() as db:
-        db.execute(
-            'INSERT INTO room_messages (room_id, user_id, message, message_type, file_id) VALUES (?, ?, ?, ?, ?)',
-            (room_id, user_id, message, message_type, file_id)
-        )
+def save_room_message(room_id: int, user_id: int, message: str, message_type: str = 'text', file_id: Optional[int] = None) -> Future:
+    """Queue a room message insert; the returned future resolves to its id once committed"""
+    created_at = _now()
+    future = shards.journal_for(room_id).submit(
+        'INSERT INTO room_messages (room_id, user_id, message, message_type, file_id, created_at) VALUES (?, ?, ?, ?, ?, ?)',
+        (room_id, user_id, message, message_type, file_id, created_at)
+    )
 
-def save_private_message(inbox_uid: str, user_id: int, message: str, message_type: str = 'text', file_id: Optional[int] = None):
-    with get_db() as db:
-        db.execute(
-            'INSERT INTO messages (inbox_uid, user_id, message, message_type, file_id) VALUES (?, ?, ?, ?, ?)',
-            (inbox_uid, user_id, message, message_type, file_id)
+    def update_stats(f: Future):
+        if f.exception() is None:
+            # Runs on the shard's writer thread, which must not wait on the central queue
+            get_message_journal().submit_followup(
+                '''UPDATE room_stats SET message_count = message_count + 1, last_activity_at = ?,
+                                         last_message_id = MAX(COALESCE(last_message_id, 0), ?)
+                   WHERE room_id = ?''',
+                (created_at, f.result(), room_id)
+            )
+    future.add_done_callback(update_stats)
+    return _append_recent(future, 'room_messages', room_id, {
+        'room_id': room_id, 'user_id': user_id, 'message': message, 'file_id': file_id,
+        'message_type': message_type, 'created_at': created_at,
+    })
+
+def save_private_message(inbox_uid: str, user_id: int, message: str, message_type: str = 'text', file_id: Optional[int] = None) -> Future:
+    """Queue a private message insert; the returned future resolves to its id once committed.
+
+    Once the insert commits in the inbox's shard, the inbox summary (last message,
+    sender, activity time, count) and the other participant's unread count are
+    queued on the central journal.
+    """
+    created_at = _now()
+    future = shards.journal_for(inbox_uid).submit(
+        'INSERT INTO messages (inbox_uid, user_id, message, message_type, file_id, created_at) VALUES (?, ?, ?, ?, ?, ?)',
+        (inbox_uid, user_id, message, message_type, file_id, created_at)
+    )
+
+    def update_summary(f: Future):
+        if f.exception() is not None:
+            return
+        journal = get_message_journal()
+        journal.submit_followup(
+            '''UPDATE inbox SET last_message = ?, last_sent_user_id = ?, last_message_id = ?,
+                                last_activity_at = ?, message_count = message_count + 1
+               WHERE inboxuid = ?''',
+            (message, user_id, f.result(), created_at, inbox_uid)
+        )
+        journal.submit_followup(
+            '''UPDATE inbox_participants SET last_activity_at = ?, unread_count = unread_count + (user_id != ?)
+               WHERE inbox_uid = ?''',
+            (created_at, user_id, inbox_uid)
         )
+    future.add_done_callback(update_summary)
+    return future
 
 def get_or_create_user(username: str, is_anonymous: bool = True) -> int:
     """Get user ID by username, or create if doesn't exist (chat database only stores basic user info)"""
+    user_id = _user_ids.get(username)
+    if user_id is not MISSING:
+        if _usernames.get(user_id) is MISSING:
+            _usernames.put(user_id, username)
+        return user_id
     with get_db() as db:
         cur = db.execute('SELECT id FROM users WHERE useruid = ?', (username,))
         row = cur.fetchone()
         if row:
-            return row['id']
-        
-        cur = db.execute(
-            'INSERT INTO users (useruid, is_anonymous) VALUES (?, ?)',
-            (username, is_anonymous)
-        )
-        return cur.lastrowid or 0
+            user_id = row['id']
+        else:
+            cur = db.execute(
+                'INSERT INTO users (useruid, is_anonymous) VALUES (?, ?)',
+                (username, is_anonymous)
+            )
+            user_id = cur.lastrowid or 0
+    if user_id:
+        _user_ids.put(username, user_id)
+        _usernames.put(user_id, username)
+    return user_id
 
 def get_room_by_name(room_name: str) -> Optional[int]:
     """Get room ID by name, return None if doesn't exist"""
+    room_id = _room_ids.get(room_name)
+    if room_id is not MISSING:
+        return room_id
     with get_db() as db:
         cur = db.execute('SELECT id FROM rooms WHERE name = ?', (room_name,))
         row = cur.fetchone()
-        return row['id'] if row else None
+    # Only positive lookups are cached so a room created elsewhere is seen immediately
+    if row:
+        _room_ids.put(room_name, row['id'])
+        return row['id']
+    return None
 
 def create_new_room(room_name: str, description: str = '', is_adventure: bool = False) -> int:
     """Create a new room and return room ID"""
@@ -86,28 +395,41 @@ def create_new_room(room_name: str, description: str = '', is_adventure: bool =
             'INSERT INTO rooms (name, description, is_adventure) VALUES (?, ?, ?)',
             (room_name, description, is_adventure)
         )
-        return cur.lastrowid or 0
+        room_id = cur.lastrowid or 0
+    if room_id:
+        _room_ids.put(room_name, room_id)
+    return room_id
 
 def get_or_create_inbox(user1_id: int, user2_id: int) -> str:
     """Get or create private inbox between two users"""
     # Create a consistent inbox UID regardless of user order
     user_ids = sorted([user1_id, user2_id])
     inbox_uid = f"inbox_{user_ids[0]}_{user_ids[1]}"
+    if _inboxes.get(inbox_uid) is not MISSING:
+        return inbox_uid
     
     with get_db() as db:
         # Check if inbox exists
         cur = db.execute('SELECT inboxuid FROM inbox WHERE inboxuid = ?', (inbox_uid,))
-        if cur.fetchone():
-            return inbox_uid
-        
-        # Create new inbox
-        db.execute('INSERT INTO inbox (inboxuid) VALUES (?)', (inbox_uid,))
-        
-        # Add participants
-        db.execute('INSERT INTO inbox_participants (inbox_uid, user_id) VALUES (?, ?)', (inbox_uid, user1_id))
-        db.execute('INSERT INTO inbox_participants (inbox_uid, user_id) VALUES (?, ?)', (inbox_uid, user2_id))
-        
-        return inbox_uid
+        if not cur.fetchone():
+            # Create new inbox
+            db.execute('INSERT INTO inbox (inboxuid) VALUES (?)', (inbox_uid,))
+            
+            # Add participants, each pointing at the other for the PM list
+            db.executemany(
+                'INSERT INTO inbox_participants (inbox_uid, user_id, peer_user_id) VALUES (?, ?, ?)',
+                [(inbox_uid, user1_id, user2_id), (inbox_uid, user2_id, user1_id)]
+            )
+            
+            # Start both delivery cursors at the beginning of the conversation, in the inbox's shard
+            with shards.db_for(inbox_uid) as sdb:
+                sdb.executemany(
+                    'INSERT OR IGNORE INTO inbox_delivery (user_id, inbox_uid, last_delivered_id) VALUES (?, ?, 0)',
+                    [(user1_id, inbox_uid), (user2_id, inbox_uid)]
+                )
+    
+    _inboxes.put(inbox_uid, True)
+    return inbox_uid
 
 def add_user_to_room(user_id: int, room_id: int):
     """Add user to room"""
@@ -122,6 +444,7 @@ def add_user_to_room(user_id: int, room_id: int):
                 'INSERT INTO room_participants (user_id, room_id) VALUES (?, ?)',
                 (user_id, room_id)
             )
+    _memberships.put((user_id, room_id), True)
 
 def remove_user_from_room(user_id: int, room_id: int):
     """Remove user from room"""
@@ -130,116 +453,384 @@ def remove_user_from_room(user_id: int, room_id: int):
             'DELETE FROM room_participants WHERE user_id = ? AND room_id = ?',
             (user_id, room_id)
         )
+    _memberships.put((user_id, room_id), False)
 
 def is_user_in_room(user_id: int, room_id: int) -> bool:
     """Check if user is in room"""
+    is_member = _memberships.get((user_id, room_id))
+    if is_member is not MISSING:
+        return is_member
     with get_db() as db:
         cur = db.execute(
             'SELECT 1 FROM room_participants WHERE user_id = ? AND room_id = ?',
             (user_id, room_id)
         )
-        return cur.fetchone() is not None
+        is_member = cur.fetchone() is not None
+    _memberships.put((user_id, room_id), is_member)
+    return is_member
 
-def get_global_messages_with_users(limit: int = 50) -> List[Dict[str, Any]]:
-    """Get global messages with user information"""
-    with get_db() as db:
-        cur = db.execute(
-            '''SELECT gm.*, u.useruid 
-               FROM global_messages gm 
-               JOIN users u ON gm.user_id = u.id 
-               ORDER BY gm.created_at DESC LIMIT ?''',
-            (limit,)
-        )
-        return [dict(row) for row in cur.fetchall()]
+def _fetch_history_page(select_sql: str, alias: str, conditions: List[str], params: List[Any],
+                        table: str, scope_value: Any, limit: int, before_id: Optional[int] = None,
+                        after_id: Optional[int] = None, fill_from_archive: bool = True) -> List[Dict[str, Any]]:
+    """Run a keyset-paginated history query and return the page newest first.
+
+    Messages are ordered by their AUTOINCREMENT id (insertion order), so the
+    (scope, id) composite indexes serve both the filter and the ORDER BY.
+    Sharded tables are read from the scope's shard and get their usernames
+    from the central users table afterwards. When paging backwards runs past
+    the hot rows, the page is filled from the monthly archive files (archived
+    rows carry archived=True).
+    """
+    conditions = list(conditions)
+    params = list(params)
+    if before_id is not None:
+        conditions.append(f'{alias}.id < ?')
+        params.append(before_id)
+    if after_id is not None:
+        conditions.append(f'{alias}.id > ?')
+        params.append(after_id)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+    # Paging forward from after_id walks the index ascending, then flips the page
+    order = 'ASC' if after_id is not None and before_id is None else 'DESC'
+    params.append(limit)
+    sharded = table in shards.SHARDED_TABLES
+    with (shards.db_for(scope_value) if sharded else get_db()) as db:
+        cur = db.execute(f'{select_sql} {where} ORDER BY {alias}.id {order} LIMIT ?', params)
+        rows = [dict(row) for row in cur.fetchall()]
+    if sharded:
+        attach_usernames(rows)
+    if order == 'ASC':
+        rows.reverse()
+    if fill_from_archive and after_id is None and len(rows) < limit:
+        oldest = rows[-1]['id'] if rows else before_id
+        rows.extend(archive.read_history(table, scope_value, limit - len(rows), oldest))
+    return attach_filenames(rows)
+
+def recent_history_page(table: str, scope_value: Any, limit: int, before_id: Optional[int] = None,
+                        after_id: Optional[int] = None) -> Optional[List[Dict[str, Any]]]:
+    """History page answered purely from memory, or None if it needs SQLite or the archive.
+
+    Safe to call on the event loop: it never touches the disk, so a short
+    backward page (which may continue in the archive) is left to the caller.
+    """
+    if not RECENT_HISTORY_ENABLED:
+        return None
+    rows = _recent.page((table, scope_value), limit, before_id, after_id)
+    if rows is not None and len(rows) < limit and after_id is None:
+        return None
+    return rows
+
+def _recent_or_fetch(select_sql: str, alias: str, conditions: List[str], params: List[Any],
+                     table: str, scope_value: Any, limit: int, before_id: Optional[int],
+                     after_id: Optional[int]) -> List[Dict[str, Any]]:
+    """Serve a history page from the scope's recent window, warming it from SQLite on first access"""
+    if not RECENT_HISTORY_ENABLED:
+        return _fetch_history_page(select_sql, alias, conditions, params, table, scope_value,
+                                   limit, before_id, after_id)
+    rows = _recent.page(
+        (table, scope_value), limit, before_id, after_id,
+        load=lambda size: _fetch_history_page(select_sql, alias, conditions, params, table, scope_value,
+                                              size, fill_from_archive=False)
+    )
+    if rows is None:
+        return _fetch_history_page(select_sql, alias, conditions, params, table, scope_value,
+                                   limit, before_id, after_id)
+    if len(rows) < limit and after_id is None:
+        oldest = rows[-1]['id'] if rows else before_id
+        rows.extend(attach_filenames(archive.read_history(table, scope_value, limit - len(rows), oldest)))
+    return rows
 
-def get_room_messages_with_users(room_id: int, limit: int = 50) -> List[Dict[str, Any]]:
-    """Get room messages with user information"""
+def get_global_messages_with_users(limit: int = 50, before_id: Optional[int] = None,
+                                   after_id: Optional[int] = None) -> List[Dict[str, Any]]:
+    """Get global messages with user information, newest first, paginated by message id"""
+    return _recent_or_fetch(
+        '''SELECT gm.*, u.useruid 
+           FROM global_messages gm 
+           JOIN users u ON gm.user_id = u.id''',
+        'gm', [], [], 'global_messages', None, limit, before_id, after_id
+    )
+
+def get_room_messages_with_users(room_id: int, limit: int = 50, before_id: Optional[int] = None,
+                                 after_id: Optional[int] = None) -> List[Dict[str, Any]]:
+    """Get room messages with user information, newest first, paginated by message id"""
+    return _recent_or_fetch(
+        'SELECT rm.* FROM room_messages rm',
+        'rm', ['rm.room_id = ?'], [room_id], 'room_messages', room_id, limit, before_id, after_id
+    )
+
+def get_private_messages_with_users(inbox_uid: str, limit: int = 50, before_id: Optional[int] = None,
+                                    after_id: Optional[int] = None) -> List[Dict[str, Any]]:
+    """Get private messages with user information, newest first, paginated by message id"""
+    return _fetch_history_page(
+        'SELECT m.* FROM messages m',
+        'm', ['m.inbox_uid = ?'], [inbox_uid], 'messages', inbox_uid, limit, before_id, after_id
+    )
+
+def get_adventure_messages_with_users(adventure_id: int, limit: int = 50, before_id: Optional[int] = None,
+                                      after_id: Optional[int] = None) -> List[Dict[str, Any]]:
+    """Get adventure messages with user information, newest first, paginated by message id"""
+    return _fetch_history_page(
+        'SELECT am.* FROM adventure_messages am',
+        'am', ['am.adventure_id = ?'], [adventure_id], 'adventure_messages', adventure_id,
+        limit, before_id, after_id
+    )
+
+def get_user_rooms(user_id: int) -> List[Dict[str, Any]]:
+    """Get rooms that user is in, with their member count and last activity"""
     with get_db() as db:
         cur = db.execute(
-            '''SELECT rm.*, u.useruid 
-               FROM room_messages rm 
-               JOIN users u ON rm.user_id = u.id 
-               WHERE rm.room_id = ? 
-               ORDER BY rm.created_at DESC LIMIT ?''',
-            (room_id, limit)
+            '''SELECT r.*, rp.joined_at, s.member_count, s.message_count, s.last_activity_at
+               FROM rooms r
+               JOIN room_participants rp ON r.id = rp.room_id
+               LEFT JOIN room_stats s ON s.room_id = r.id
+               WHERE rp.user_id = ?''',
+            (user_id,)
         )
         return [dict(row) for row in cur.fetchall()]
 
-def get_private_messages_with_users(inbox_uid: str, limit: int = 50) -> List[Dict[str, Any]]:
-    """Get private messages with user information"""
+# Directory orderings: (sort column, descending, room id column, nullable). Each is served by
+# an index that lists rooms in that order with the room id ascending, so a page needs no sort
+ROOM_DIRECTORY_ORDERS = {
+    'activity': ('s.last_activity_at', True, 's.room_id', True),
+    'members': ('s.member_count', True, 's.room_id', False),
+    'name': ('r.name', False, 'r.id', False),
+}
+MAX_ROOM_DIRECTORY_PAGE = 1000
+
+def get_room_directory(user_id: int, order: str = 'activity', limit: int = 100,
+                       after: Optional[Tuple[Any, int]] = None) -> List[Dict[str, Any]]:
+    """Page of all rooms with member/message counts and last activity, and whether the user is in each.
+
+    Pages are keyset ranges: pass the (sort_key, id) of the previous page's last
+    room as after. Rooms whose sort key is NULL (no messages yet) come last.
+    """
+    column, descending, id_column, nullable = ROOM_DIRECTORY_ORDERS[order]
+    limit = min(limit, MAX_ROOM_DIRECTORY_PAGE)
+    select = f'''SELECT r.id, r.name, r.description, r.is_adventure, s.member_count, s.message_count,
+                     s.last_activity_at, rp.user_id IS NOT NULL AS is_member, {column} AS sort_key
+                 FROM room_stats s
+                 JOIN rooms r ON r.id = s.room_id
+                 LEFT JOIN room_participants rp ON rp.user_id = ? AND rp.room_id = s.room_id'''
+    direction, past, beyond = ('DESC', '<', '<=') if descending else ('ASC', '>', '>=')
     with get_db() as db:
-        cur = db.execute(
-            '''SELECT m.*, u.useruid 
-               FROM messages m 
-               JOIN users u ON m.user_id = u.id 
-               WHERE m.inbox_uid = ? 
-               ORDER BY m.created_at DESC LIMIT ?''',
-            (inbox_uid, limit)
-        )
-        return [dict(row) for row in cur.fetchall()]
+        if after is None:
+            rows = db.execute(f'{select} ORDER BY {column} {direction}, {id_column} LIMIT ?',
+                              (user_id, limit)).fetchall()
+        elif after[0] is None:
+            rows = []
+        else:
+            rows = db.execute(
+                f'''{select} WHERE {column} {beyond} ? AND ({column} {past} ? OR {id_column} > ?)
+                    ORDER BY {column} {direction}, {id_column} LIMIT ?''',
+                (user_id, after[0], after[0], after[1], limit)
+            ).fetchall()
+        rows = [dict(row) for row in rows]
+        if nullable and descending and after is not None and len(rows) < limit:
+            # Comparisons skip NULL keys; they sort last in a descending index, so page through them by id
+            last_id = after[1] if after[0] is None else 0
+            rows.extend(dict(row) for row in db.execute(
+                f'{select} WHERE {column} IS NULL AND {id_column} > ? ORDER BY {id_column} LIMIT ?',
+                (user_id, last_id, limit - len(rows))
+            ))
+    return rows
 
-def get_adventure_messages_with_users(adventure_id: int, limit: int = 50) -> List[Dict[str, Any]]:
-    """Get adventure messages with user information"""
+def rebuild_room_stats():
+    """Recount every room's members and hot messages (backfill; run with the server stopped)"""
     with get_db() as db:
-        cur = db.execute(
-            '''SELECT am.*, u.useruid 
-               FROM adventure_messages am 
-               JOIN users u ON am.user_id = u.id 
-               WHERE am.adventure_id = ? 
-               ORDER BY am.created_at DESC LIMIT ?''',
-            (adventure_id, limit)
+        db.execute('INSERT OR IGNORE INTO room_stats (room_id) SELECT id FROM rooms')
+        db.execute('''UPDATE room_stats SET member_count =
+                          (SELECT COUNT(*) FROM room_participants rp WHERE rp.room_id = room_stats.room_id)''')
+    totals = {}  # room id -> (count, last id, last created_at)
+    for source in message_sources('room_messages'):
+        with source() as db:
+            for row in db.execute('''SELECT room_id, COUNT(*) AS total, MAX(id) AS last_id, MAX(created_at) AS last_at
+                                     FROM room_messages GROUP BY room_id'''):
+                total, last_id, last_at = totals.get(row['room_id'], (0, 0, None))
+                totals[row['room_id']] = (total + row['total'], max(last_id, row['last_id']),
+                                          max(filter(None, (last_at, row['last_at'])), default=None))
+    with get_db() as db:
+        db.executemany(
+            'UPDATE room_stats SET message_count = ?, last_message_id = ?, last_activity_at = ? WHERE room_id = ?',
+            [(total, last_id, last_at, room_id) for room_id, (total, last_id, last_at) in totals.items()]
         )
-        return [dict(row) for row in cur.fetchall()]
 
-def get_user_rooms(user_id: int) -> List[Dict[str, Any]]:
-    """Get rooms that user is in"""
+def get_user_inboxes(user_id: int) -> List[Dict[str, Any]]:
+    """Get the user's conversations, most recently active first, from the maintained inbox summaries"""
     with get_db() as db:
         cur = db.execute(
-            '''SELECT r.*, rp.joined_at 
-               FROM rooms r 
-               JOIN room_participants rp ON r.id = rp.room_id 
-               WHERE rp.user_id = ?''',
+            '''SELECT peer.useruid as username, peer.id as user_id, ip.inbox_uid,
+                      ip.unread_count, ip.last_activity_at as last_message_time,
+                      i.last_message, i.last_message_id, i.message_count, sender.useruid as last_sender
+               FROM inbox_participants ip
+               JOIN inbox i ON i.inboxuid = ip.inbox_uid
+               JOIN users peer ON peer.id = ip.peer_user_id
+               LEFT JOIN users sender ON sender.id = i.last_sent_user_id
+               WHERE ip.user_id = ?
+               ORDER BY ip.last_activity_at DESC''',
             (user_id,)
         )
         return [dict(row) for row in cur.fetchall()]
 
-def get_user_inboxes(user_id: int) -> List[Dict[str, Any]]:
-    """Get inboxes/conversations for user"""
+def mark_inbox_read(user_id: int, inbox_uid: str):
+    """Reset the user's unread count for a conversation they have opened"""
     with get_db() as db:
-        cur = db.execute(
-            '''SELECT DISTINCT u.useruid as username, u.id as user_id
-               FROM inbox_participants ip1
-               JOIN inbox_participants ip2 ON ip1.inbox_uid = ip2.inbox_uid
-               JOIN users u ON ip2.user_id = u.id
-               WHERE ip1.user_id = ? AND ip2.user_id != ?''',
-            (user_id, user_id)
+        db.execute(
+            'UPDATE inbox_participants SET unread_count = 0 WHERE user_id = ? AND inbox_uid = ?',
+            (user_id, inbox_uid)
         )
-        return [dict(row) for row in cur.fetchall()]
 
-def get_undelivered_private_messages(user_id: int) -> List[Dict[str, Any]]:
-    """Get private messages sent to user since their last seen time"""
+UNDELIVERED_PAGE_SIZE = 50
+
+def get_undelivered_private_messages(user_id: int, limit: int = UNDELIVERED_PAGE_SIZE) -> List[Dict[str, Any]]:
+    """Get up to limit private messages past the user's delivery cursors, oldest first per inbox.
+
+    Each inbox is an indexed (inbox_uid, id) range read in its shard, starting
+    at that inbox's cursor. Nothing is marked delivered here; call
+    mark_private_messages_delivered once the page has been sent, then fetch
+    again for the next page.
+    """
     with get_db() as db:
-        # Get user's last seen time
-        cur = db.execute('SELECT last_seen FROM users WHERE id = ?', (user_id,))
-        user_row = cur.fetchone()
-        if not user_row:
-            return []
-        
-        last_seen = user_row['last_seen']
-        
-        # Get messages in inboxes where user is participant, sent after last_seen
-        cur = db.execute(
-            '''SELECT m.*, sender.useruid as sender_username
-               FROM messages m
-               JOIN inbox_participants ip ON m.inbox_uid = ip.inbox_uid
-               JOIN users sender ON m.user_id = sender.id
-               WHERE ip.user_id = ? 
-               AND m.user_id != ?
-               AND m.created_at > ?
-               ORDER BY m.created_at DESC''',
-            (user_id, user_id, last_seen)
-        )
-        return [dict(row) for row in cur.fetchall()]
+        inbox_uids = [row['inbox_uid'] for row in db.execute(
+            'SELECT inbox_uid FROM inbox_participants WHERE user_id = ?', (user_id,))]
+    messages = []
+    for inbox_uid in inbox_uids:
+        remaining = limit - len(messages)
+        if remaining <= 0:
+            break
+        with shards.db_for(inbox_uid) as db:
+            cursor = db.execute(
+                'SELECT last_delivered_id FROM inbox_delivery WHERE user_id = ? AND inbox_uid = ?',
+                (user_id, inbox_uid)
+            ).fetchone()
+            cur = db.execute(
+                '''SELECT m.* FROM messages m
+                   WHERE m.inbox_uid = ? AND m.id > ? AND m.user_id != ?
+                   ORDER BY m.id LIMIT ?''',
+                (inbox_uid, cursor['last_delivered_id'] if cursor else 0, user_id, remaining)
+            )
+            messages.extend(dict(row) for row in cur.fetchall())
+    return attach_filenames(attach_usernames(messages, 'sender_username'))
+
+def mark_private_messages_delivered(user_id: int, last_ids: Dict[str, int]):
+    """Advance the user's delivery cursor for each inbox to the given message id"""
+    by_shard = {}
+    for inbox_uid, last_id in last_ids.items():
+        by_shard.setdefault(shards.shard_for(inbox_uid), []).append((user_id, inbox_uid, last_id))
+    for index, params in by_shard.items():
+        with shards.shard_db(index) as db:
+            db.executemany(
+                '''INSERT INTO inbox_delivery (user_id, inbox_uid, last_delivered_id) VALUES (?, ?, ?)
+                   ON CONFLICT(user_id, inbox_uid)
+                   DO UPDATE SET last_delivered_id = MAX(last_delivered_id, excluded.last_delivered_id)''',
+                params
+            )
+
+def mark_inbox_delivered(user_id: int, inbox_uid: str) -> Future:
+    """Queue a cursor bump to the newest message in the inbox (after a live delivery).
+
+    Goes through the inbox's shard journal so it is applied after any queued
+    insert into the same inbox.
+    """
+    return shards.journal_for(inbox_uid).submit(
+        '''INSERT INTO inbox_delivery (user_id, inbox_uid, last_delivered_id)
+           VALUES (?, ?, (SELECT COALESCE(MAX(id), 0) FROM messages WHERE inbox_uid = ?))
+           ON CONFLICT(user_id, inbox_uid)
+           DO UPDATE SET last_delivered_id = MAX(last_delivered_id, excluded.last_delivered_id)''',
+        (user_id, inbox_uid, inbox_uid)
+    )
+
+# message_search rowid encoding: message id * 4 + kind
+SEARCH_KINDS = ('global', 'room', 'private', 'adventure')
+SEARCH_TABLES = ('global_messages', 'room_messages', 'messages', 'adventure_messages')
+MAX_SEARCH_PAGE = 50
+
+def _fts_phrase(text: str) -> str:
+    """Quote text as an FTS5 phrase so user input can't inject query syntax"""
+    return '"' + text.replace('"', '""') + '"'
+
+def _search_scopes(db, user_id: int) -> Dict[Optional[int], List[str]]:
+    """Scope phrases for every conversation the user can read, grouped by shard (None = central)"""
+    scopes = {None: ['g']}
+    memberships = (
+        ('r', 'SELECT room_id AS scope FROM room_participants WHERE user_id = ?'),
+        ('p', 'SELECT inbox_uid AS scope FROM inbox_participants WHERE user_id = ?'),
+        ('a', 'SELECT adventure_id AS scope FROM adventure_participants WHERE user_id = ?'),
+    )
+    for prefix, sql in memberships:
+        for row in db.execute(sql, (user_id,)):
+            scopes.setdefault(shards.shard_for(row['scope']), []).append(f"{prefix} {row['scope']}")
+    return scopes
+
+def _in_marks(values) -> str:
+    return ','.join('?' * len(values))
+
+def search_messages(user_id: int, query: str, limit: int = 20, offset: int = 0) -> List[Dict[str, Any]]:
+    """Full-text search over messages the user can see, best bm25 match first.
+
+    Only the central index and the shards holding one of the user's
+    conversations are searched; their hits are merged by score.
+    """
+    terms = query.split()
+    if not terms:
+        return []
+    limit = max(1, min(limit, MAX_SEARCH_PAGE))
+    body = ' '.join(_fts_phrase(term) for term in terms)
+    with get_db() as db:
+        scopes = _search_scopes(db, user_id)
+
+    hits = []
+    for index, shard_scopes in scopes.items():
+        match = '{body} : (%s) AND {scope} : (%s)' % (body, ' OR '.join(_fts_phrase(scope) for scope in shard_scopes))
+        with (get_db() if index is None else shards.shard_db(index)) as db:
+            hits.extend(dict(hit, shard=index) for hit in db.execute(
+                '''SELECT rowid, snippet(message_search, 0, '[', ']', '...', 12) AS snippet,
+                          bm25(message_search, 1.0, 0.0) AS score
+                   FROM message_search WHERE message_search MATCH ?
+                   ORDER BY score LIMIT ?''',
+                (match, offset + limit)
+            ))
+    hits.sort(key=lambda hit: hit['score'])
+    hits = hits[offset:offset + limit]
+
+    # Resolve hits back to their source rows, one IN query per (database, message table)
+    ids_by_source = {}
+    for hit in hits:
+        ids_by_source.setdefault((hit['shard'], hit['rowid'] % 4), []).append(hit['rowid'] // 4)
+    rows = {}
+    for (index, kind), ids in ids_by_source.items():
+        table = SEARCH_TABLES[kind]
+        with (get_db() if index is None else shards.shard_db(index)) as db:
+            for row in db.execute(f'SELECT * FROM {table} WHERE id IN ({_in_marks(ids)})', ids):
+                rows[row['id'] * 4 + kind] = dict(row)
+    attach_usernames(list(rows.values()))
+
+    room_ids = list({row['room_id'] for row in rows.values() if 'room_id' in row})
+    inbox_uids = list({row['inbox_uid'] for row in rows.values() if 'inbox_uid' in row})
+    room_names, peers = {}, {}
+    with get_db() as db:
+        if room_ids:
+            room_names = {row['id']: row['name'] for row in db.execute(
+                f'SELECT id, name FROM rooms WHERE id IN ({_in_marks(room_ids)})', room_ids)}
+        if inbox_uids:
+            peers = {row['inbox_uid']: row['useruid'] for row in db.execute(
+                f'''SELECT ip.inbox_uid, peer.useruid FROM inbox_participants ip
+                     JOIN users peer ON peer.id = ip.peer_user_id
+                     WHERE ip.user_id = ? AND ip.inbox_uid IN ({_in_marks(inbox_uids)})''',
+                [user_id] + inbox_uids)}
+
+    results = []
+    for hit in hits:
+        row = rows.get(hit['rowid'])
+        if row is None:
+            continue
+        kind = hit['rowid'] % 4
+        target = ('global', room_names.get(row.get('room_id')), peers.get(row.get('inbox_uid')),
+                  str(row.get('adventure_id')))[kind]
+        results.append({
+            'id': row['id'], 'created_at': row['created_at'], 'useruid': row['useruid'], 'target': target,
+            'kind': SEARCH_KINDS[kind], 'snippet': hit['snippet'], 'score': hit['score'],
+        })
+    return results
 
 def update_user_last_seen(user_id: int):
     """Update user's last seen timestamp"""
@@ -264,13 +855,12 @@ def add_adventure_participant(adventure_id: int, user_id: int, role: str = 'play
             (adventure_id, user_id, role)
         )
 
-def save_adventure_message(adventure_id: int, user_id: int, message: str, message_type: str = 'text', file_id: Optional[int] = None):
-    """Save adventure message"""
-    with get_db() as db:
-        db.execute(
-            'INSERT INTO adventure_messages (adventure_id, user_id, message, message_type, file_id) VALUES (?, ?, ?, ?, ?)',
-            (adventure_id, user_id, message, message_type, file_id)
-        )
+def save_adventure_message(adventure_id: int, user_id: int, message: str, message_type: str = 'text', file_id: Optional[int] = None) -> Future:
+    """Queue an adventure message insert; the returned future resolves to its id once committed"""
+    return shards.journal_for(adventure_id).submit(
+        'INSERT INTO adventure_messages (adventure_id, user_id, message, message_type, file_id) VALUES (?, ?, ?, ?, ?)',
+        (adventure_id, user_id, message, message_type, file_id)
+    )
 
 def get_adventure_by_id(adventure_id: int) -> Optional[Dict[str, Any]]:
     """Get adventure by ID"""
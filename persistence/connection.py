@@ -0,0 +1,105 @@
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import Dict, Optional, Any
+import os
+from .instrumentation import connection_factory
+
+# Default PRAGMAs applied once to every pooled connection
+DEFAULT_PRAGMAS = {
+    'auto_vacuum': 'INCREMENTAL',  # only takes effect on a new file, so it must precede journal_mode
+    'journal_mode': 'WAL',
+    # Backstop only: the maintenance task checkpoints on a schedule well before this many pages
+    'wal_autocheckpoint': int(os.getenv('SQLITE_WAL_AUTOCHECKPOINT_PAGES', '10000')),
+    'synchronous': 'NORMAL',
+    'cache_size': int(os.getenv('SQLITE_CACHE_KIB', '16384')) * -1,  # negative = KiB
+    'mmap_size': int(os.getenv('SQLITE_MMAP_BYTES', str(256 * 1024 * 1024))),
+    'temp_store': 'MEMORY',
+    'busy_timeout': 5000,
+    'foreign_keys': 'OFF',  # schema scripts turn this on; pooled connections must not inherit it
+}
+
+
+class ConnectionManager:
+    """Keeps one long-lived, pre-configured sqlite3 connection per thread for a database file"""
+
+    def __init__(self, db_path: str, pragmas: Optional[Dict[str, Any]] = None):
+        self.db_path = db_path
+        self.pragmas = dict(DEFAULT_PRAGMAS)
+        if pragmas:
+            self.pragmas.update(pragmas)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._connections = {}  # thread id -> connection
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path, check_same_thread=False, factory=connection_factory())
+        conn.row_factory = sqlite3.Row
+        self._apply_pragmas(conn)
+        with self._lock:
+            self._connections[threading.get_ident()] = conn
+        return conn
+
+    def connection(self) -> sqlite3.Connection:
+        """Return this thread's connection, opening and configuring it on first use"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._connect()
+            self._local.conn = conn
+        return conn
+
+    def _apply_pragmas(self, conn: sqlite3.Connection):
+        for name, value in self.pragmas.items():
+            conn.execute(f'PRAGMA {name} = {value}')
+
+    def run_script(self, sql: str):
+        """Run a schema script, then restore the pooled connection's PRAGMAs"""
+        conn = self.connection()
+        conn.executescript(sql)
+        self._apply_pragmas(conn)
+
+    @contextmanager
+    def transaction(self):
+        """Yield the thread's connection and commit on success, roll back on error"""
+        conn = self.connection()
+        try:
+            yield conn
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+
+    def close_all(self):
+        """Close every pooled connection (call on shutdown)"""
+        with self._lock:
+            connections = list(self._connections.values())
+            self._connections.clear()
+        for conn in connections:
+            try:
+                conn.close()
+            except sqlite3.Error as e:
+                print(f"Error closing connection to {self.db_path}: {e}")
+        self._local = threading.local()
+
+
+_managers = {}  # db path -> ConnectionManager
+_managers_lock = threading.Lock()
+
+
+def get_manager(db_path: str) -> ConnectionManager:
+    """Get the shared connection manager for a database file"""
+    key = os.path.abspath(db_path)
+    with _managers_lock:
+        manager = _managers.get(key)
+        if manager is None:
+            manager = ConnectionManager(key)
+            _managers[key] = manager
+        return manager
+
+
+def close_all_connections():
+    """Close pooled connections for every managed database"""
+    with _managers_lock:
+        managers = list(_managers.values())
+    for manager in managers:
+        manager.close_all()
@@ -0,0 +1,293 @@
+"""
+Per-statement SQL instrumentation for every pooled SQLite connection.
+
+Statements are keyed by normalized SQL (literals and IN lists folded to ?),
+and each key records count, total/max time, p50/p99 over a sliding sample
+and rows returned. A statement's time covers execute() plus every fetch on
+its cursor. Statements that raise are counted as errors and kept out of the
+timings. Statements slower than SQL_SLOW_QUERY_MS are appended to the
+slow-query log as JSON lines with their EXPLAIN QUERY PLAN.
+
+Set SQL_INSTRUMENTATION=0 to open plain connections instead.
+"""
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import deque
+from typing import Any, Dict, List, Optional
+
+INSTRUMENTATION_ENABLED = os.getenv('SQL_INSTRUMENTATION', '1') != '0'
+SLOW_QUERY_MS = float(os.getenv('SQL_SLOW_QUERY_MS', '50'))
+SLOW_QUERY_LOG = os.getenv('SQL_SLOW_QUERY_LOG', os.path.join(os.path.dirname(__file__), '../slow_queries.log'))
+SAMPLES_PER_STATEMENT = int(os.getenv('SQL_STATS_SAMPLES', '1024'))
+RECENT_SLOW_QUERIES = 100
+
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_LITERAL = re.compile(r'\b\d+(?:\.\d+)?\b')
+_IN_LIST = re.compile(r'\(\s*\?(?:\s*,\s*\?)+\s*\)')
+_WHITESPACE = re.compile(r'\s+')
+
+
+def normalize_sql(sql: str) -> str:
+    """Fold whitespace, literals and IN lists so equivalent statements share one key"""
+    sql = _STRING_LITERAL.sub('?', sql)
+    sql = _NUMBER_LITERAL.sub('?', sql)
+    sql = _WHITESPACE.sub(' ', sql).strip()
+    return _IN_LIST.sub('(?...)', sql)
+
+
+class QueryStats:
+    """Thread-safe aggregates per normalized statement plus the recent slow queries"""
+
+    def __init__(self, samples: int = SAMPLES_PER_STATEMENT):
+        self.samples = samples
+        self._entries = {}  # normalized sql -> counters
+        self._slow = deque(maxlen=RECENT_SLOW_QUERIES)
+        self._planned = set()  # (database, normalized sql) already explained in the slow log
+        self._lock = threading.Lock()
+
+    def _entry(self, key: str, database: str) -> Dict[str, Any]:
+        entry = self._entries.get(key)
+        if entry is None:
+            entry = self._entries[key] = {
+                'count': 0, 'errors': 0, 'total_ms': 0.0, 'max_ms': 0.0, 'rows': 0,
+                'samples': deque(maxlen=self.samples), 'databases': set(),
+            }
+        entry['databases'].add(database)
+        return entry
+
+    def record(self, key: str, database: str, elapsed_ms: float, rows: int):
+        with self._lock:
+            entry = self._entry(key, database)
+            entry['count'] += 1
+            entry['total_ms'] += elapsed_ms
+            entry['max_ms'] = max(entry['max_ms'], elapsed_ms)
+            entry['rows'] += rows
+            entry['samples'].append(elapsed_ms)
+
+    def record_error(self, key: str, database: str):
+        with self._lock:
+            self._entry(key, database)['errors'] += 1
+
+    def needs_plan(self, database: str, key: str) -> bool:
+        """True the first time a statement is slow on a database (its plan is logged once)"""
+        with self._lock:
+            if (database, key) in self._planned:
+                return False
+            self._planned.add((database, key))
+            return True
+
+    def record_slow(self, entry: Dict[str, Any]):
+        with self._lock:
+            self._slow.append(entry)
+        if SLOW_QUERY_LOG:
+            try:
+                with open(SLOW_QUERY_LOG, 'a') as f:
+                    f.write(json.dumps(entry) + '\n')
+            except OSError as e:
+                print(f"[SQL] Could not write slow-query log: {e}")
+
+    def snapshot(self, order_by: str = 'total_ms', limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Aggregates per statement, most expensive first"""
+        with self._lock:
+            items = [(key, dict(entry, samples=list(entry['samples']), databases=sorted(entry['databases'])))
+                     for key, entry in self._entries.items()]
+        result = []
+        for key, entry in items:
+            samples = sorted(entry.pop('samples'))
+            result.append({
+                'sql': key,
+                'count': entry['count'],
+                'errors': entry['errors'],
+                'total_ms': round(entry['total_ms'], 3),
+                'avg_ms': round(entry['total_ms'] / entry['count'], 3) if entry['count'] else 0.0,
+                'p50_ms': round(_percentile(samples, 0.50), 3),
+                'p99_ms': round(_percentile(samples, 0.99), 3),
+                'max_ms': round(entry['max_ms'], 3),
+                'rows': entry['rows'],
+                'databases': entry['databases'],
+            })
+        result.sort(key=lambda item: item.get(order_by, 0), reverse=True)
+        return result[:limit] if limit else result
+
+    def slow_queries(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            return list(self._slow)
+
+    def reset(self):
+        with self._lock:
+            self._entries.clear()
+            self._slow.clear()
+            self._planned.clear()
+
+
+def _percentile(sorted_samples: List[float], fraction: float) -> float:
+    if not sorted_samples:
+        return 0.0
+    return sorted_samples[min(len(sorted_samples) - 1, int(fraction * len(sorted_samples)))]
+
+
+query_stats = QueryStats()
+
+# Callables notified of every finished statement: listener(connection, sql, params, elapsed_ms)
+_listeners = []
+
+
+def add_listener(listener):
+    _listeners.append(listener)
+
+
+def remove_listener(listener):
+    _listeners.remove(listener)
+
+
+class InstrumentedCursor(sqlite3.Cursor):
+    """Cursor that times execute() plus its fetches and records the statement when it is done"""
+
+    _sql = None
+
+    def _begin(self, sql: str):
+        self._finish()
+        self._sql = sql
+        self._elapsed = 0.0
+        self._rows = 0
+
+    def _finish(self):
+        sql, self._sql = self._sql, None
+        if sql is None:
+            return
+        elapsed_ms = self._elapsed * 1000
+        key = normalize_sql(sql)
+        database = self.connection.database_name
+        query_stats.record(key, database, elapsed_ms, self._rows)
+        for listener in list(_listeners):
+            listener(self.connection, sql, self._params, elapsed_ms)
+        if elapsed_ms >= SLOW_QUERY_MS:
+            entry = {'ts': time.strftime('%Y-%m-%d %H:%M:%S'), 'database': database, 'sql': key,
+                     'ms': round(elapsed_ms, 3), 'rows': self._rows}
+            if query_stats.needs_plan(database, key):
+                entry['plan'] = self.connection.explain(sql, self._params)
+            query_stats.record_slow(entry)
+
+    def _fail(self):
+        """Count the current statement as an error instead of a timing"""
+        sql, self._sql = self._sql, None
+        if sql is not None:
+            query_stats.record_error(normalize_sql(sql), self.connection.database_name)
+
+    def execute(self, sql, parameters=()):
+        self._begin(sql)
+        self._params = parameters
+        started = time.perf_counter()
+        try:
+            super().execute(sql, parameters)
+        except Exception:
+            self._fail()
+            raise
+        finally:
+            self._elapsed += time.perf_counter() - started
+        if self.description is None:
+            self._rows = max(self.rowcount, 0)
+            self._finish()  # no result set: the statement is complete
+        return self
+
+    def executemany(self, sql, seq_of_parameters):
+        self._begin(sql)
+        self._params = None  # explain() binds NULLs; the plan doesn't depend on the values
+        started = time.perf_counter()
+        try:
+            super().executemany(sql, seq_of_parameters)
+        except Exception:
+            self._fail()
+            raise
+        finally:
+            self._elapsed += time.perf_counter() - started
+        self._rows = max(self.rowcount, 0)
+        self._finish()
+        return self
+
+    def _timed_fetch(self, fetch, *args):
+        started = time.perf_counter()
+        try:
+            return fetch(*args)
+        except Exception:
+            self._fail()
+            raise
+        finally:
+            if self._sql is not None:
+                self._elapsed += time.perf_counter() - started
+
+    def fetchone(self):
+        row = self._timed_fetch(super().fetchone)
+        if row is None:
+            self._finish()
+        elif self._sql is not None:
+            self._rows += 1
+        return row
+
+    def fetchmany(self, size=None):
+        size = self.arraysize if size is None else size
+        rows = self._timed_fetch(super().fetchmany, size)
+        if self._sql is not None:
+            self._rows += len(rows)
+            if len(rows) < size:
+                self._finish()
+        return rows
+
+    def fetchall(self):
+        rows = self._timed_fetch(super().fetchall)
+        if self._sql is not None:
+            self._rows += len(rows)
+            self._finish()
+        return rows
+
+    def __iter__(self):
+        # One fetchall() in C instead of a timed fetchone() per row
+        return iter(self.fetchall())
+
+    def close(self):
+        self._finish()
+        super().close()
+
+    def __del__(self):
+        try:
+            self._finish()
+        except Exception:
+            pass
+
+
+class InstrumentedConnection(sqlite3.Connection):
+    """sqlite3 connection whose execute()/executemany() go through InstrumentedCursor"""
+
+    def __init__(self, database, *args, **kwargs):
+        super().__init__(database, *args, **kwargs)
+        name = os.path.basename(str(database))
+        # Shards share their statements; report them under one database name
+        self.database_name = re.sub(r'^shard-\d+', 'shard-*', name)
+
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def explain(self, sql: str, parameters=None) -> List[str]:
+        """EXPLAIN QUERY PLAN for a statement, without recording it"""
+        if parameters is None:
+            parameters = [None] * _STRING_LITERAL.sub('', sql).count('?')
+        try:
+            cur = sqlite3.Cursor(self)
+            return [row[-1] for row in cur.execute(f'EXPLAIN QUERY PLAN {sql}', parameters)]
+        except sqlite3.Error as e:
+            return [f'(no plan: {e})']
+
+
+def connection_factory():
+    """Connection class for ConnectionManager to open"""
+    return InstrumentedConnection if INSTRUMENTATION_ENABLED else sqlite3.Connection
@@ -0,0 +1,239 @@
+import asyncio
+import concurrent.futures
+import queue
+import threading
+import time
+from collections import deque
+from typing import Optional, Tuple, Any
+import os
+from .connection import get_manager, ConnectionManager
+
+MAX_BATCH_ROWS = int(os.getenv('JOURNAL_MAX_BATCH_ROWS', '500'))
+MAX_DELAY_MS = float(os.getenv('JOURNAL_MAX_DELAY_MS', '20'))
+MAX_PENDING = int(os.getenv('JOURNAL_MAX_PENDING', '10000'))
+SUBMIT_TIMEOUT = float(os.getenv('JOURNAL_SUBMIT_TIMEOUT', '2.0'))
+
+
+class JournalFullError(Exception):
+    """Raised when the write-behind queue stays full for longer than the submit timeout
+    (immediately when submitting from an event loop thread)"""
+
+
+class JournalClosedError(Exception):
+    """Raised when submitting to a journal that has been shut down"""
+
+
+_BARRIER = None  # sql value marking a flush barrier
+
+
+class WriteBehindJournal:
+    """Queue of INSERT/UPDATE statements committed in coalesced multi-row transactions.
+
+    Every submit() returns a concurrent.futures.Future that resolves to the
+    statement's lastrowid once the transaction containing it has committed.
+    """
+
+    def __init__(self, manager: ConnectionManager, max_batch_rows: int = MAX_BATCH_ROWS,
+                 max_delay_ms: float = MAX_DELAY_MS, max_pending: int = MAX_PENDING):
+        self.manager = manager
+        self.max_batch_rows = max_batch_rows
+        self.max_delay = max_delay_ms / 1000.0
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._lock = threading.Lock()  # orders submits against close()'s stop marker
+        self._closed = False
+        self._overflow = deque()  # follow-up writes that found the queue full
+        self.stats = {'submitted': 0, 'committed': 0, 'failed': 0, 'batches': 0, 'deferred': 0, 'dropped': 0}
+
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name=f"journal:{os.path.basename(self.manager.db_path)}", daemon=True
+                )
+                self._thread.start()
+
+    def _put(self, item: Tuple[Optional[str], Any, concurrent.futures.Future], timeout: Optional[float],
+             block: bool = True):
+        if block:
+            try:
+                asyncio.get_running_loop()
+                block = False  # never stall an event loop on a full queue
+            except RuntimeError:
+                pass
+        with self._lock:
+            if self._closed:
+                raise JournalClosedError(f"Journal for {self.manager.db_path} is closed")
+            self._ensure_started()
+            try:
+                self._queue.put(item, block=block, timeout=timeout)
+            except queue.Full:
+                raise JournalFullError(f"Write-behind queue for {self.manager.db_path} is full")
+
+    def submit(self, sql: str, params: tuple = (), timeout: Optional[float] = SUBMIT_TIMEOUT) -> concurrent.futures.Future:
+        """Queue a write; blocks up to timeout when the queue is full (backpressure)"""
+        future = concurrent.futures.Future()
+        self._put((sql, params, future), timeout)
+        self.stats['submitted'] += 1
+        return future
+
+    def submit_followup(self, sql: str, params: tuple = ()) -> concurrent.futures.Future:
+        """Queue a write without ever blocking, for callbacks running on another journal's writer thread.
+
+        When the queue is full the write is set aside and folded into the writer's
+        next batch instead of being refused.
+        """
+        future = concurrent.futures.Future()
+        try:
+            self._put((sql, params, future), None, block=False)
+        except JournalFullError:
+            self._overflow.append((sql, params, future))
+            self.stats['deferred'] += 1
+        except JournalClosedError as e:
+            print(f"[Journal] Dropping follow-up write: {e}")
+            self.stats['dropped'] += 1
+            future.set_exception(e)
+            return future
+        self.stats['submitted'] += 1
+        return future
+
+    def barrier(self, timeout: Optional[float] = SUBMIT_TIMEOUT) -> concurrent.futures.Future:
+        """Future that resolves once everything submitted before it is durable; raises JournalFullError
+        if the queue stays full for timeout seconds"""
+        future = concurrent.futures.Future()
+        if self._thread is None or self._closed:
+            future.set_result(None)
+            return future
+        try:
+            self._put((_BARRIER, None, future), timeout)
+        except JournalClosedError:
+            future.set_result(None)  # close() drains everything queued before it
+        return future
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """Block until all writes submitted so far are committed; False on timeout"""
+        try:
+            self.barrier(SUBMIT_TIMEOUT if timeout is None else timeout).result(timeout=timeout)
+            return True
+        except (concurrent.futures.TimeoutError, JournalFullError):
+            return False
+
+    async def wait_durable(self, future: Optional[concurrent.futures.Future] = None):
+        """Await durability of one submitted write, or of everything submitted so far"""
+        await asyncio.wrap_future(future if future is not None else self.barrier())
+
+    def pending(self) -> int:
+        return self._queue.qsize() + len(self._overflow)
+
+    def close(self, timeout: Optional[float] = None):
+        """Stop accepting writes, drain the queue and stop the writer thread"""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            if self._thread is not None:
+                self._queue.put((_BARRIER, None, None))
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _collect(self, first):
+        batch = [first]
+        while self._overflow and len(batch) < self.max_batch_rows:
+            batch.append(self._overflow.popleft())
+        deadline = time.monotonic() + self.max_delay
+        while len(batch) < self.max_batch_rows:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _commit(self, batch):
+        writes = [item for item in batch if item[0] is not _BARRIER]
+        results = []
+        try:
+            with self.manager.transaction() as db:
+                for sql, params, _ in writes:
+                    results.append(db.execute(sql, params).lastrowid)
+        except Exception as e:
+            print(f"[Journal] Batch of {len(writes)} failed ({e}), retrying individually")
+            self._commit_individually(writes)
+        else:
+            for (_, _, future), rowid in zip(writes, results):
+                future.set_result(rowid)
+            self.stats['committed'] += len(writes)
+        self.stats['batches'] += 1
+
+    def _commit_individually(self, writes):
+        for sql, params, future in writes:
+            try:
+                with self.manager.transaction() as db:
+                    rowid = db.execute(sql, params).lastrowid
+                future.set_result(rowid)
+                self.stats['committed'] += 1
+            except Exception as e:
+                print(f"[Journal] Dropping write that failed: {e}")
+                future.set_exception(e)
+                self.stats['failed'] += 1
+
+    def _run(self):
+        while True:
+            if self._overflow:
+                first = self._overflow.popleft()
+            else:
+                try:
+                    # Wake up now and then for follow-ups deferred while the queue was draining
+                    first = self._queue.get(timeout=1.0)
+                except queue.Empty:
+                    continue
+            batch = self._collect(first)
+            self._commit(batch)
+            stop = False
+            for sql, _, future in batch:
+                if sql is _BARRIER:
+                    if future is None:
+                        stop = True
+                    else:
+                        future.set_result(None)
+            if stop:
+                # Follow-ups deferred before close() are written before the thread exits
+                while self._overflow:
+                    self._commit(self._collect(self._overflow.popleft()))
+                break
+        # Nothing can be queued after the stop marker, but never leave a future unresolved
+        while True:
+            try:
+                sql, _, future = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if future is not None and not future.done():
+                future.set_exception(JournalClosedError(f"Journal for {self.manager.db_path} is closed"))
+
+
+_journals = {}  # db path -> WriteBehindJournal
+_journals_lock = threading.Lock()
+
+
+def get_journal(db_path: str) -> WriteBehindJournal:
+    """Get the shared write-behind journal for a database file"""
+    key = os.path.abspath(db_path)
+    with _journals_lock:
+        journal = _journals.get(key)
+        if journal is None:
+            journal = WriteBehindJournal(get_manager(key))
+            _journals[key] = journal
+        return journal
+
+
+def close_all_journals(timeout: Optional[float] = None):
+    """Drain and stop every journal (call on shutdown before closing connections)"""
+    with _journals_lock:
+        journals = list(_journals.values())
+    for journal in journals:
+        journal.close(timeout)
@@ -0,0 +1,162 @@
+"""
+Background SQLite maintenance for the chat database, its shards and the auth
+database: scheduled WAL checkpoints, PRAGMA optimize and a bounded ANALYZE.
+Expired web sessions are purged from the auth database with each optimize.
+
+Checkpoints run here on a dedicated thread, so WAL pages are folded back
+between requests and not by whichever request crosses the auto-checkpoint
+threshold (which stays as a backstop, see SQLITE_WAL_AUTOCHECKPOINT_PAGES).
+A PASSIVE checkpoint runs every interval. It becomes TRUNCATE when the WAL
+has grown past MAINTENANCE_TRUNCATE_WAL_BYTES.
+
+Run one pass by hand with: python -m persistence.maintenance
+"""
+import asyncio
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Tuple
+from .connection import get_manager, ConnectionManager
+from .chatdb import CHAT_DB_PATH, init_db
+from .authdb import AUTH_DB_PATH, init_auth_db, purge_expired_sessions
+from . import shards
+
+CHECKPOINT_INTERVAL = float(os.getenv('MAINTENANCE_CHECKPOINT_SECONDS', '30'))
+TRUNCATE_WAL_BYTES = int(os.getenv('MAINTENANCE_TRUNCATE_WAL_BYTES', str(64 * 1024 * 1024)))
+OPTIMIZE_INTERVAL = float(os.getenv('MAINTENANCE_OPTIMIZE_SECONDS', '3600'))
+ANALYZE_INTERVAL = float(os.getenv('MAINTENANCE_ANALYZE_SECONDS', '86400'))
+ANALYZE_LIMIT = int(os.getenv('MAINTENANCE_ANALYZE_LIMIT', '1000'))  # rows sampled per index
+REPORT_INTERVAL = float(os.getenv('MAINTENANCE_REPORT_SECONDS', '300'))
+SLOW_CHECKPOINT_MS = float(os.getenv('MAINTENANCE_SLOW_CHECKPOINT_MS', '100'))
+
+# One thread keeps one pooled connection per database for all maintenance work
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="Maintenance")
+
+
+def maintained_databases() -> List[Tuple[str, ConnectionManager]]:
+    """(name, manager) for every database file the server writes"""
+    databases = [('chat', get_manager(CHAT_DB_PATH))]
+    databases += [(f'shard-{index}', shards.shard_manager(index)) for index in range(shards.shard_count())]
+    databases.append(('auth', get_manager(AUTH_DB_PATH)))
+    return databases
+
+
+def wal_bytes(manager: ConnectionManager) -> int:
+    try:
+        return os.path.getsize(manager.db_path + '-wal')
+    except OSError:
+        return 0
+
+
+class MaintenanceService:
+    """Runs checkpoints and planner maintenance and keeps per-database stats"""
+
+    def __init__(self):
+        self.stats = {}  # database name -> counters
+        self._last_optimize = time.monotonic()
+        self._last_analyze = time.monotonic()
+
+    def _entry(self, name: str) -> Dict[str, Any]:
+        return self.stats.setdefault(name, {
+            'checkpoints': 0, 'truncates': 0, 'busy': 0, 'last_checkpoint_ms': 0.0,
+            'max_checkpoint_ms': 0.0, 'total_checkpoint_ms': 0.0, 'wal_bytes': 0,
+            'optimize_runs': 0, 'analyze_runs': 0,
+        })
+
+    def checkpoint(self, name: str, manager: ConnectionManager) -> Dict[str, Any]:
+        """PASSIVE checkpoint, or TRUNCATE once the WAL is past the size threshold"""
+        entry = self._entry(name)
+        size = wal_bytes(manager)
+        mode = 'TRUNCATE' if size >= TRUNCATE_WAL_BYTES else 'PASSIVE'
+        started = time.perf_counter()
+        with manager.transaction() as db:
+            busy, log_pages, checkpointed = db.execute(f'PRAGMA wal_checkpoint({mode})').fetchone()
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        entry['checkpoints'] += 1
+        entry['truncates'] += mode == 'TRUNCATE'
+        entry['busy'] += bool(busy)
+        entry['last_checkpoint_ms'] = round(elapsed_ms, 2)
+        entry['max_checkpoint_ms'] = round(max(entry['max_checkpoint_ms'], elapsed_ms), 2)
+        entry['total_checkpoint_ms'] += elapsed_ms
+        entry['wal_bytes'] = wal_bytes(manager)
+        if elapsed_ms >= SLOW_CHECKPOINT_MS:
+            print(f"[Maintenance] {name}: {mode} checkpoint of {checkpointed}/{log_pages} pages "
+                  f"took {elapsed_ms:.0f}ms (WAL {size} -> {entry['wal_bytes']} bytes)")
+        return entry
+
+    def optimize(self, name: str, manager: ConnectionManager, analyze: bool = False):
+        """PRAGMA optimize, or a sampled ANALYZE that refreshes every table's statistics"""
+        entry = self._entry(name)
+        with manager.transaction() as db:
+            if analyze:
+                db.execute(f'PRAGMA analysis_limit = {ANALYZE_LIMIT}')
+                db.execute('ANALYZE')
+                entry['analyze_runs'] += 1
+            else:
+                db.execute('PRAGMA optimize')
+                entry['optimize_runs'] += 1
+
+    def run_once(self, force: bool = False) -> Dict[str, Dict[str, Any]]:
+        """One maintenance pass; optimize/ANALYZE only when their interval is due (or force)"""
+        now = time.monotonic()
+        analyze = force or now - self._last_analyze >= ANALYZE_INTERVAL
+        optimize = analyze or now - self._last_optimize >= OPTIMIZE_INTERVAL
+        for name, manager in maintained_databases():
+            try:
+                if optimize:
+                    self.optimize(name, manager, analyze=analyze)
+                self.checkpoint(name, manager)
+            except Exception as e:
+                print(f"[Maintenance] {name} failed: {e}")
+        if optimize:
+            try:
+                purged = purge_expired_sessions()
+                if purged:
+                    print(f"[Maintenance] Purged {purged} expired sessions")
+            except Exception as e:
+                print(f"[Maintenance] Session purge failed: {e}")
+            self._last_optimize = now
+        if analyze:
+            self._last_analyze = now
+        return self.stats
+
+    def report(self) -> str:
+        parts = []
+        for name, entry in self.stats.items():
+            average = entry['total_checkpoint_ms'] / entry['checkpoints'] if entry['checkpoints'] else 0.0
+            parts.append(f"{name}: wal={entry['wal_bytes']}B ckpt avg={average:.1f}ms "
+                         f"max={entry['max_checkpoint_ms']:.1f}ms busy={entry['busy']}")
+        return '; '.join(parts)
+
+
+maintenance = MaintenanceService()
+
+
+def get_maintenance_stats() -> Dict[str, Dict[str, Any]]:
+    return maintenance.stats
+
+
+async def maintenance_loop(service: MaintenanceService = maintenance):
+    """Background task: checkpoint every interval and report WAL sizes and checkpoint times"""
+    loop = asyncio.get_running_loop()
+    last_report = time.monotonic()
+    while True:
+        await asyncio.sleep(CHECKPOINT_INTERVAL)
+        try:
+            await loop.run_in_executor(_executor, service.run_once)
+        except Exception as e:
+            print(f"[Maintenance] Run failed: {e}")
+        if time.monotonic() - last_report >= REPORT_INTERVAL:
+            last_report = time.monotonic()
+            print(f"[Maintenance] {service.report()}")
+
+
+def shutdown_maintenance(wait: bool = True):
+    _executor.shutdown(wait=wait)
+
+
+if __name__ == '__main__':
+    init_db()
+    init_auth_db()
+    maintenance.run_once(force=True)
+    print(maintenance.report())
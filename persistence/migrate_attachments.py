@@ -0,0 +1,54 @@
+"""
+Move inline base64 attachments out of chatdb.sqlite3 into the on-disk blob store.
+
+Usage: python -m persistence.migrate_attachments [--batch 100] [--vacuum]
+"""
+import argparse
+from .chatdb import get_db, init_db
+from .blobstore import blob_store
+
+
+def migrate_attachments(batch_size: int = 100) -> int:
+    """Move every legacy row's content to the blob store; returns the number of rows migrated"""
+    migrated = 0
+    last_id = 0
+    while True:
+        with get_db() as db:
+            ids = [row['id'] for row in db.execute(
+                '''SELECT id FROM file_attachments
+                   WHERE sha256 IS NULL AND id > ? ORDER BY id LIMIT ?''',
+                (last_id, batch_size)
+            )]
+        if not ids:
+            return migrated
+        for file_id in ids:
+            # One row at a time keeps at most a single attachment in memory
+            with get_db() as db:
+                row = db.execute('SELECT blob FROM file_attachments WHERE id = ?', (file_id,)).fetchone()
+                digest, size = blob_store.put_base64(row['blob'] or '')
+                db.execute(
+                    "UPDATE file_attachments SET sha256 = ?, file_size = ?, blob = '' WHERE id = ?",
+                    (digest, size, file_id)
+                )
+            migrated += 1
+        last_id = ids[-1]
+        print(f"Migrated {migrated} attachments (up to id {last_id})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--batch', type=int, default=100, help='rows to select per batch')
+    parser.add_argument('--vacuum', action='store_true', help='VACUUM afterwards to reclaim the freed pages')
+    args = parser.parse_args()
+
+    init_db()
+    count = migrate_attachments(args.batch)
+    print(f"Done: {count} attachments moved to {blob_store.root}")
+    if args.vacuum and count:
+        with get_db() as db:
+            db.commit()
+            db.execute('VACUUM')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,130 @@
+"""
+bcrypt hashing and verification off the event loop.
+
+Each bcrypt call burns ~100-300 ms of CPU, so the async API runs them in a
+small process pool. At most PASSWORD_HASH_WORKERS run at once; up to
+PASSWORD_MAX_WAITING more wait their turn, and anything past that is shed
+with PasswordBusyError (the login handlers answer 503) instead of queueing
+unbounded CPU work. Both limits are per deployment: with CHAT_WORKERS
+server processes each one gets its share.
+
+BCRYPT_ROUNDS is the work factor for new hashes. needs_rehash() tells the
+login path when a stored hash was made with a different cost, so it can be
+replaced on the next successful login.
+"""
+import asyncio
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, Optional
+import bcrypt
+
+BCRYPT_ROUNDS = int(os.getenv('BCRYPT_ROUNDS', '12'))
+_SERVER_PROCESSES = max(1, int(os.getenv('CHAT_WORKERS', '1')))
+PASSWORD_HASH_WORKERS = max(1, int(os.getenv('PASSWORD_HASH_WORKERS', str(max(1, (os.cpu_count() or 2) // 2))))
+                            // _SERVER_PROCESSES)
+PASSWORD_MAX_WAITING = max(1, int(os.getenv('PASSWORD_MAX_WAITING', '32')) // _SERVER_PROCESSES)
+# spawn: the server has live threads, which a forked worker must not inherit. Spawned
+# workers import the server script as __mp_main__, so it must not do work at import.
+PASSWORD_POOL_START_METHOD = os.getenv('PASSWORD_POOL_START_METHOD', 'spawn')
+
+
+class PasswordBusyError(RuntimeError):
+    """Raised when every hashing worker is busy and the wait queue is full"""
+
+
+def hash_password(password: str, rounds: int = BCRYPT_ROUNDS) -> str:
+    """Hash a password using bcrypt (blocking)"""
+    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds)).decode('utf-8')
+
+
+def verify_password(password: str, hashed: str) -> bool:
+    """Verify a password against its hash (blocking)"""
+    return bcrypt.checkpw(password.encode('utf-8'), hashed.encode('utf-8'))
+
+
+def hash_rounds(hashed: str) -> Optional[int]:
+    """Cost factor of a bcrypt hash ($2b$<rounds>$...), or None if it isn't one"""
+    parts = hashed.split('$')
+    return int(parts[2]) if len(parts) >= 4 and parts[2].isdigit() else None
+
+
+def needs_rehash(hashed: str) -> bool:
+    return hash_rounds(hashed) != BCRYPT_ROUNDS
+
+
+class PasswordHasher:
+    """Bounded process pool for bcrypt with a capped wait queue"""
+
+    def __init__(self, workers: int = PASSWORD_HASH_WORKERS, max_waiting: int = PASSWORD_MAX_WAITING):
+        self.workers = workers
+        self.max_waiting = max_waiting
+        self.waiting = 0
+        self._pool = None
+        self._slots = None  # asyncio.Semaphore, created on the running loop
+        self.stats = {'hashed': 0, 'verified': 0, 'shed': 0, 'max_wait_ms': 0.0, 'busy_ms': 0.0}
+
+    def _executor(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.workers, mp_context=multiprocessing.get_context(PASSWORD_POOL_START_METHOD))
+        return self._pool
+
+    async def _run(self, func, *args):
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.workers)
+        if self._slots.locked() and self.waiting >= self.max_waiting:
+            self.stats['shed'] += 1
+            raise PasswordBusyError("Too many password checks in progress")
+        queued = time.perf_counter()
+        self.waiting += 1
+        try:
+            await self._slots.acquire()
+        finally:
+            self.waiting -= 1
+        try:
+            started = time.perf_counter()
+            self.stats['max_wait_ms'] = max(self.stats['max_wait_ms'], (started - queued) * 1000)
+            result = await asyncio.get_running_loop().run_in_executor(self._executor(), func, *args)
+            self.stats['busy_ms'] += (time.perf_counter() - started) * 1000
+            return result
+        finally:
+            self._slots.release()
+
+    async def hash(self, password: str) -> str:
+        """bcrypt hash at BCRYPT_ROUNDS; raises PasswordBusyError when shedding"""
+        hashed = await self._run(hash_password, password, BCRYPT_ROUNDS)
+        self.stats['hashed'] += 1
+        return hashed
+
+    async def verify(self, password: str, hashed: str) -> bool:
+        """Check a password; raises PasswordBusyError when shedding"""
+        valid = await self._run(verify_password, password, hashed)
+        self.stats['verified'] += 1
+        return valid
+
+    def start(self):
+        """Start the workers now so the first logins don't pay for process startup"""
+        pool = self._executor()
+        for _ in range(self.workers):
+            pool.submit(hash_rounds, '')
+
+    def get_stats(self) -> Dict[str, Any]:
+        return dict(self.stats, workers=self.workers, waiting=self.waiting, rounds=BCRYPT_ROUNDS)
+
+    def shutdown(self, wait: bool = True):
+        if self._pool is not None:
+            self._pool.shutdown(wait=wait)
+            self._pool = None
+
+
+password_hasher = PasswordHasher()
+
+
+def start_password_pool():
+    password_hasher.start()
+
+
+def shutdown_password_pool():
+    password_hasher.shutdown()
@@ -0,0 +1,482 @@
+"""
+Query-plan guard and benchmark for persistence/chatdb.py.
+
+Seeds a synthetic chat database (central file plus shards) with millions of
+message rows, runs every public chatdb function against it and checks the
+EXPLAIN QUERY PLAN of each statement it issues. A full table scan or a temp
+B-tree sort on a large table fails the run, as does a public function with
+no check below. Each check's median time is compared with the stored
+baseline.
+
+    python -m persistence.plan_guard [--messages 2000000] [--update-baseline]
+
+The seeded files are kept in PLAN_GUARD_DIR and reused by later runs with the
+same --messages. Exits non-zero on any plan violation, uncovered function or
+timing regression.
+"""
+import argparse
+import inspect
+import itertools
+import json
+import os
+import re
+import statistics
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Set
+from . import archive, chatdb, instrumentation, shards
+from .blobstore import blob_store
+from .connection import close_all_connections, get_manager
+
+GUARD_DIR = os.getenv('PLAN_GUARD_DIR', os.path.join(os.path.dirname(__file__), '../plan-guard'))
+BASELINE_PATH = os.getenv('PLAN_GUARD_BASELINE', os.path.join(os.path.dirname(__file__), '../plan_baseline.json'))
+DEFAULT_MESSAGES = 2_000_000
+LARGE_TABLE_ROWS = 10_000
+
+# Share of the seeded messages per table
+MESSAGE_SHARES = {'global_messages': 0.2, 'room_messages': 0.4, 'messages': 0.3, 'adventure_messages': 0.1}
+
+# Tables whose matches are ranked: sorting the MATCH result by bm25 is inherent
+RANKED_TABLES = {'message_search'}
+
+# Public chatdb functions that only manage caches, connections or setup (no query to guard)
+NOT_QUERIES = {
+    'get_cache_stats', 'clear_lookup_caches', 'clear_recent_history', 'get_db', 'get_message_journal',
+    'flush_messages', 'close_message_journals', 'message_sources', 'init_db', 'recent_history_page',
+    'rebuild_room_stats',  # one-off backfill that recounts every room on purpose
+}
+
+HOT_USER = 1  # member of many rooms, inboxes and adventures
+
+
+def use_guard_files(directory: str):
+    """Point chatdb, the shards, the archive and the blob store at the guard's own files"""
+    chatdb.CHAT_DB_PATH = os.path.join(directory, 'chat.sqlite3')
+    shards.SHARD_DIR = os.path.join(directory, 'shards')
+    archive.ARCHIVE_DIR = os.path.join(directory, 'archive')
+    blob_store.root = os.path.join(directory, 'attachments')
+
+
+# --- Seeding ---------------------------------------------------------------
+
+SEQUENCE = 'WITH RECURSIVE seq(x) AS (SELECT 1 UNION ALL SELECT x + 1 FROM seq WHERE x < ?)'
+MESSAGE_TEXT = "'message ' || x || ' about topic' || (x % 997) || ' and thing' || (x % 31)"
+CREATED_AT = "datetime('now', '-' || (? - x) || ' seconds')"
+
+
+def seed(messages: int):
+    """Fill a fresh guard database with users, rooms, inboxes, adventures and messages"""
+    users = max(1000, messages // 50)
+    rooms = max(50, messages // 20000)
+    inboxes = max(500, messages // 100)
+    adventures = max(20, messages // 50000)
+    files = max(100, messages // 1000)
+    counts = {table: int(messages * share) for table, share in MESSAGE_SHARES.items()}
+    started = time.perf_counter()
+
+    chatdb.init_db()
+    with chatdb.get_db() as db:
+        db.execute(f"INSERT INTO users (useruid, is_anonymous) {SEQUENCE} SELECT 'user' || x, x % 2 FROM seq",
+                   (users,))
+        db.execute(f"INSERT INTO rooms (name, description) {SEQUENCE} SELECT 'room' || x, 'Room ' || x FROM seq",
+                   (rooms,))
+        db.execute(f'''INSERT INTO room_participants (room_id, user_id) {SEQUENCE}
+                       SELECT (x * 7 + k) % ? + 1, x FROM seq, (SELECT 0 AS k UNION ALL SELECT 1 UNION ALL SELECT 2)''',
+                   (users, rooms))
+        db.execute('INSERT INTO room_participants (room_id, user_id) SELECT id, ? FROM rooms', (HOT_USER,))
+        db.execute(f'''INSERT INTO adventures (room_id, story_title, created_by) {SEQUENCE}
+                       SELECT x % ? + 1, 'Adventure ' || x, x % ? + 1 FROM seq''', (adventures, rooms, users))
+        db.execute(f'''INSERT INTO adventure_participants (adventure_id, user_id, role) {SEQUENCE}
+                       SELECT x % ? + 1, x, 'player' FROM seq''', (users, adventures))
+        db.execute("INSERT INTO adventure_participants (adventure_id, user_id, role) SELECT id, ?, 'dm' FROM adventures",
+                   (HOT_USER,))
+        db.execute(f'''INSERT INTO file_attachments (filename, blob, sha256, file_size, mime_type) {SEQUENCE}
+                       SELECT 'file' || x || '.txt', '', printf('%064x', x), 100, 'text/plain' FROM seq''', (files,))
+
+    pairs = [(HOT_USER, peer) for peer in range(2, 52)]
+    pairs += [(i % users + 1, (i * 31 + 7) % users + 1) for i in range(inboxes)]
+    pairs = list({tuple(sorted(pair)): None for pair in pairs if pair[0] != pair[1]})
+    inbox_uids = [f'inbox_{a}_{b}' for a, b in pairs]
+    with chatdb.get_db() as db:
+        db.executemany('INSERT INTO inbox (inboxuid) VALUES (?)', [(uid,) for uid in inbox_uids])
+        db.executemany('INSERT INTO inbox_participants (inbox_uid, user_id, peer_user_id) VALUES (?, ?, ?)',
+                       [(uid, a, b) for uid, (a, b) in zip(inbox_uids, pairs)] +
+                       [(uid, b, a) for uid, (a, b) in zip(inbox_uids, pairs)])
+        db.execute(f'''INSERT INTO global_messages (user_id, message, file_id, created_at) {SEQUENCE}
+                       SELECT x % ? + 1, {MESSAGE_TEXT}, CASE WHEN x % 1000 = 0 THEN x / 1000 % ? + 1 END, {CREATED_AT}
+                       FROM seq''', (counts['global_messages'], users, files, counts['global_messages']))
+
+    scopes = {
+        'room_messages': list(range(1, rooms + 1)),
+        'messages': inbox_uids,
+        'adventure_messages': list(range(1, adventures + 1)),
+    }
+    for table, column in shards.SHARDED_TABLES.items():
+        by_shard = {}
+        for value in scopes[table]:
+            by_shard.setdefault(shards.shard_for(value), []).append(value)
+        for index, values in by_shard.items():
+            rows = counts[table] * len(values) // len(scopes[table])
+            with shards.shard_db(index) as db:
+                db.execute('CREATE TEMP TABLE IF NOT EXISTS guard_scopes (n INTEGER PRIMARY KEY, value)')
+                db.execute('DELETE FROM temp.guard_scopes')
+                db.executemany('INSERT INTO temp.guard_scopes (n, value) VALUES (?, ?)', enumerate(values))
+                db.execute(f'''INSERT INTO {table} ({column}, user_id, message, file_id, created_at) {SEQUENCE}
+                               SELECT (SELECT value FROM temp.guard_scopes WHERE n = x % ?), x % ? + 1, {MESSAGE_TEXT},
+                                      CASE WHEN x % 1000 = 0 THEN x / 1000 % ? + 1 END, {CREATED_AT}
+                               FROM seq''', (rows, len(values), users, files, rows))
+        print(f"[PlanGuard] Seeded {counts[table]} {table} rows ({time.perf_counter() - started:.0f}s)")
+
+    # Delivery cursors at each inbox's newest message, except the hot user's (pending deliveries)
+    cursors = [(a, uid) for uid, (a, b) in zip(inbox_uids, pairs)] + [(b, uid) for uid, (a, b) in zip(inbox_uids, pairs)]
+    by_shard = {}
+    for user_id, uid in cursors:
+        by_shard.setdefault(shards.shard_for(uid), []).append((user_id, uid))
+    summaries = []
+    for index, shard_cursors in by_shard.items():
+        with shards.shard_db(index) as db:
+            db.executemany(
+                '''INSERT OR IGNORE INTO inbox_delivery (user_id, inbox_uid, last_delivered_id)
+                   VALUES (?, ?, (SELECT CASE WHEN ? = ? THEN 0 ELSE COALESCE(MAX(id), 0) END
+                                  FROM messages WHERE inbox_uid = ?))''',
+                [(user_id, uid, HOT_USER, user_id, uid) for user_id, uid in shard_cursors]
+            )
+            summaries += [tuple(row) for row in db.execute(
+                '''SELECT m.message, m.user_id, m.id, m.created_at, s.total, m.inbox_uid
+                   FROM (SELECT inbox_uid, MAX(id) AS last_id, COUNT(*) AS total FROM messages GROUP BY inbox_uid) s
+                   JOIN messages m ON m.id = s.last_id''')]
+    with chatdb.get_db() as db:
+        db.executemany(
+            '''UPDATE inbox SET last_message = ?, last_sent_user_id = ?, last_message_id = ?,
+                                last_activity_at = ?, message_count = ? WHERE inboxuid = ?''', summaries)
+        db.execute('''UPDATE inbox_participants SET last_activity_at =
+                          (SELECT i.last_activity_at FROM inbox i WHERE i.inboxuid = inbox_participants.inbox_uid)''')
+
+    chatdb.rebuild_room_stats()  # messages were inserted straight into the shards
+    for manager in guard_managers():
+        with manager.transaction() as db:
+            db.execute('ANALYZE')
+    print(f"[PlanGuard] Seeded {messages} messages in {time.perf_counter() - started:.0f}s")
+
+
+def guard_managers():
+    return [get_manager(chatdb.CHAT_DB_PATH)] + [shards.shard_manager(i) for i in range(shards.shard_count())]
+
+
+def prepare(directory: str, messages: int):
+    """Reuse the seeded guard files when they match --messages, otherwise seed them again"""
+    marker = os.path.join(directory, 'seed.json')
+    use_guard_files(directory)
+    if os.path.exists(marker):
+        with open(marker) as f:
+            if json.load(f).get('messages') == messages:
+                chatdb.init_db()
+                return
+        close_all_connections()
+        for root, _, names in os.walk(directory, topdown=False):
+            for name in names:
+                os.unlink(os.path.join(root, name))
+    os.makedirs(directory, exist_ok=True)
+    seed(messages)
+    with open(marker, 'w') as f:
+        json.dump({'messages': messages}, f)
+
+
+def large_tables(threshold: int) -> Set[str]:
+    """Tables with at least threshold rows in the central database or any shard"""
+    large = set()
+    for manager in guard_managers():
+        with manager.transaction() as db:
+            names = [row['name'] for row in db.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%' "
+                "AND name NOT LIKE 'message_search_%'")]
+            for name in names:
+                if db.execute(f'SELECT COUNT(*) FROM (SELECT 1 FROM {name} LIMIT ?)', (threshold,)).fetchone()[0] >= threshold:
+                    large.add(name)
+    return large
+
+
+# --- Plan checks -----------------------------------------------------------
+
+_TABLE_ALIAS = re.compile(r'\b(?:FROM|JOIN)\s+(\w+)(?:\s+(?:AS\s+)?(?!WHERE|JOIN|ON|LEFT|INNER|ORDER|GROUP|LIMIT)(\w+))?',
+                          re.IGNORECASE)
+_PLAN_TABLE = re.compile(r'^(SCAN|SEARCH) (\w+)(.*)$')
+
+
+_ORDERED_LIMIT = re.compile(r'\bORDER BY\b.*\bLIMIT\b', re.IGNORECASE | re.DOTALL)
+
+
+def plan_violations(sql: str, plan: List[str], large: Set[str]) -> List[str]:
+    """Full scans and temp B-tree sorts that touch a large table.
+
+    An unfiltered scan that already yields rows in ORDER BY order (no temp
+    B-tree) stops at the LIMIT, e.g. the newest page of global history, so
+    it is allowed.
+    """
+    bounded = (_ORDERED_LIMIT.search(sql) and not re.search(r'\bWHERE\b', sql, re.IGNORECASE)
+               and not any(detail.startswith('USE TEMP B-TREE') for detail in plan))
+    aliases = {}
+    for table, alias in _TABLE_ALIAS.findall(sql):
+        aliases[table] = table
+        if alias:
+            aliases[alias] = table
+    touched = set()
+    problems = []
+    for detail in plan:
+        match = _PLAN_TABLE.match(detail)
+        if match:
+            table = aliases.get(match.group(2), match.group(2))
+            touched.add(table)
+            if (match.group(1) == 'SCAN' and table in large and not bounded
+                    and 'VIRTUAL TABLE' not in match.group(3)):
+                problems.append(f'full scan of {table}: {detail}')
+    for detail in plan:
+        if detail.startswith('USE TEMP B-TREE') and (touched & large) - RANKED_TABLES:
+            problems.append(f"temp b-tree on {', '.join(sorted(touched & large))}: {detail}")
+    return problems
+
+
+class StatementRecorder:
+    """Instrumentation listener that keeps each distinct statement and its plan while a check runs"""
+
+    def __init__(self):
+        self.statements = {}  # normalized sql -> (database, plan)
+        self._lock = threading.Lock()
+
+    def __call__(self, connection, sql: str, params, elapsed_ms: float):
+        if not re.match(r'\s*(SELECT|INSERT|UPDATE|DELETE|WITH|REPLACE)\b', sql, re.IGNORECASE):
+            return
+        key = instrumentation.normalize_sql(sql)
+        with self._lock:
+            if key in self.statements:
+                return
+        plan = connection.explain(sql, params)
+        with self._lock:
+            self.statements[key] = (connection.database_name, sql, plan)
+
+
+# --- Checks ----------------------------------------------------------------
+
+class GuardContext:
+    """Seeded ids the checks run against"""
+
+    def __init__(self):
+        self._counter = itertools.count(1)
+        with chatdb.get_db() as db:
+            self.room_id = db.execute('SELECT room_id FROM room_participants WHERE user_id = ? LIMIT 1',
+                                      (HOT_USER,)).fetchone()[0]
+            self.inbox_uid = db.execute('SELECT inbox_uid FROM inbox_participants WHERE user_id = ? LIMIT 1',
+                                        (HOT_USER,)).fetchone()[0]
+            self.adventure_id = db.execute('SELECT adventure_id FROM adventure_participants WHERE user_id = ? LIMIT 1',
+                                           (HOT_USER,)).fetchone()[0]
+            self.file_id = db.execute('SELECT MAX(id) FROM file_attachments').fetchone()[0]
+            self.global_mid = self._middle(db, 'global_messages', None, None)
+            self.peer_id = db.execute('SELECT peer_user_id FROM inbox_participants WHERE user_id = ? AND inbox_uid = ?',
+                                      (HOT_USER, self.inbox_uid)).fetchone()[0]
+        with shards.db_for(self.room_id) as db:
+            self.room_mid = self._middle(db, 'room_messages', 'room_id', self.room_id)
+        with shards.db_for(self.inbox_uid) as db:
+            self.inbox_mid = self._middle(db, 'messages', 'inbox_uid', self.inbox_uid)
+        with shards.db_for(self.adventure_id) as db:
+            self.adventure_mid = self._middle(db, 'adventure_messages', 'adventure_id', self.adventure_id)
+
+    @staticmethod
+    def _middle(db, table: str, column: Optional[str], value: Any) -> int:
+        where, params = (f'WHERE {column} = ?', [value]) if column else ('', [])
+        total = db.execute(f'SELECT COUNT(*) FROM {table} {where}', params).fetchone()[0]
+        row = db.execute(f'SELECT id FROM {table} {where} ORDER BY id LIMIT 1 OFFSET ?',
+                         params + [total // 2]).fetchone()
+        return row[0] if row else 0
+
+    def unique(self, prefix: str) -> str:
+        return f'{prefix}-{os.getpid()}-{time.time_ns()}-{next(self._counter)}'
+
+
+def _flushed(call: Callable[[], Any]) -> Callable[[], Any]:
+    def run():
+        call()
+        chatdb.flush_messages()
+    return run
+
+
+def _next_directory_page(order: str) -> Callable[[], Any]:
+    """Directory page continuing from the first one's last room, through the keyset range"""
+    def run():
+        first = chatdb.get_room_directory(HOT_USER, order, 5)
+        if first:
+            chatdb.get_room_directory(HOT_USER, order, 5, (first[-1]['sort_key'], first[-1]['id']))
+    return run
+
+
+def build_checks(ctx: GuardContext) -> Dict[str, List[Callable[[], Any]]]:
+    """Representative calls per public chatdb function"""
+    c = chatdb
+    return {
+        'get_or_create_user': [lambda: c.get_or_create_user('user2'), lambda: c.get_or_create_user(ctx.unique('user'))],
+        'get_room_by_name': [lambda: c.get_room_by_name('room1'), lambda: c.get_room_by_name(ctx.unique('room'))],
+        'create_new_room': [lambda: c.create_new_room(ctx.unique('room'))],
+        'get_or_create_inbox': [lambda: c.get_or_create_inbox(HOT_USER, ctx.peer_id),
+                                lambda: c.get_or_create_inbox(c.get_or_create_user(ctx.unique('user')), HOT_USER)],
+        'add_user_to_room': [lambda: c.add_user_to_room(HOT_USER, ctx.room_id)],
+        'remove_user_from_room': [lambda: c.remove_user_from_room(2, ctx.room_id)],
+        'is_user_in_room': [lambda: c.is_user_in_room(HOT_USER, ctx.room_id)],
+        'save_global_message': [_flushed(lambda: c.save_global_message(HOT_USER, 'guard topic1'))],
+        'save_room_message': [_flushed(lambda: c.save_room_message(ctx.room_id, HOT_USER, 'guard topic1'))],
+        'save_private_message': [_flushed(lambda: c.save_private_message(ctx.inbox_uid, HOT_USER, 'guard topic1'))],
+        'save_adventure_message': [_flushed(lambda: c.save_adventure_message(ctx.adventure_id, HOT_USER, 'guard'))],
+        'save_file_attachment': [lambda: c.save_file_attachment('guard.txt', 'Z3VhcmQ=', 5, 'text/plain')],
+        'get_file_attachment': [lambda: c.get_file_attachment(ctx.file_id)],
+        'get_legacy_attachment_blob': [lambda: c.get_legacy_attachment_blob(ctx.file_id)],
+        'get_global_messages': [lambda: c.get_global_messages(50)],
+        'get_global_messages_with_users': [lambda: c.get_global_messages_with_users(50),
+                                           lambda: c.get_global_messages_with_users(50, before_id=ctx.global_mid),
+                                           lambda: c.get_global_messages_with_users(50, after_id=ctx.global_mid)],
+        'get_room_messages_with_users': [lambda: c.get_room_messages_with_users(ctx.room_id, 50),
+                                         lambda: c.get_room_messages_with_users(ctx.room_id, 50, before_id=ctx.room_mid),
+                                         lambda: c.get_room_messages_with_users(ctx.room_id, 50, after_id=ctx.room_mid)],
+        'get_private_messages_with_users': [
+            lambda: c.get_private_messages_with_users(ctx.inbox_uid, 50),
+            lambda: c.get_private_messages_with_users(ctx.inbox_uid, 50, before_id=ctx.inbox_mid),
+            lambda: c.get_private_messages_with_users(ctx.inbox_uid, 50, after_id=ctx.inbox_mid)],
+        'get_adventure_messages_with_users': [
+            lambda: c.get_adventure_messages_with_users(ctx.adventure_id, 50),
+            lambda: c.get_adventure_messages_with_users(ctx.adventure_id, 50, before_id=ctx.adventure_mid)],
+        'get_user_rooms': [lambda: c.get_user_rooms(HOT_USER)],
+        'get_room_directory': [lambda order=order: c.get_room_directory(HOT_USER, order)
+                               for order in c.ROOM_DIRECTORY_ORDERS]
+                              + [_next_directory_page(order) for order in c.ROOM_DIRECTORY_ORDERS],
+        'get_user_inboxes': [lambda: c.get_user_inboxes(HOT_USER)],
+        'mark_inbox_read': [lambda: c.mark_inbox_read(HOT_USER, ctx.inbox_uid)],
+        'get_undelivered_private_messages': [lambda: c.get_undelivered_private_messages(HOT_USER)],
+        'mark_private_messages_delivered': [lambda: c.mark_private_messages_delivered(ctx.peer_id, {ctx.inbox_uid: 1})],
+        'mark_inbox_delivered': [_flushed(lambda: c.mark_inbox_delivered(ctx.peer_id, ctx.inbox_uid))],
+        'search_messages': [lambda: c.search_messages(HOT_USER, 'topic42'),
+                            lambda: c.search_messages(HOT_USER, 'topic42 thing3', limit=20, offset=20)],
+        'update_user_last_seen': [lambda: c.update_user_last_seen(HOT_USER)],
+        'create_adventure': [lambda: c.create_adventure(ctx.room_id, 'Guard', HOT_USER)],
+        'add_adventure_participant': [lambda: c.add_adventure_participant(ctx.adventure_id, 2)],
+        'get_adventure_by_id': [lambda: c.get_adventure_by_id(ctx.adventure_id)],
+        'get_adventure_participants': [lambda: c.get_adventure_participants(ctx.adventure_id)],
+        'attach_usernames': [lambda: c.attach_usernames([{'user_id': user_id} for user_id in range(1, 51)])],
+        'attach_filenames': [lambda: c.attach_filenames([{'file_id': ctx.file_id}])],
+        'is_attachment_referenced': [lambda: c.is_attachment_referenced(ctx.file_id)],
+        'can_access_attachment': [lambda: c.can_access_attachment(HOT_USER, ctx.file_id)],
+    }
+
+
+def public_functions() -> Set[str]:
+    return {name for name, member in inspect.getmembers(chatdb, inspect.isfunction)
+            if not name.startswith('_') and member.__module__ == chatdb.__name__} - NOT_QUERIES
+
+
+def run_check(calls: List[Callable[[], Any]], repeat: int, large: Set[str]) -> Dict[str, Any]:
+    """Plans of the first run, then median/max time over repeat runs (caches cleared each time)"""
+    recorder = StatementRecorder()
+    instrumentation.add_listener(recorder)
+    try:
+        chatdb.clear_lookup_caches()
+        chatdb.clear_recent_history()
+        for call in calls:
+            call()
+    finally:
+        instrumentation.remove_listener(recorder)
+    timings = []
+    for _ in range(repeat):
+        chatdb.clear_lookup_caches()
+        chatdb.clear_recent_history()
+        started = time.perf_counter()
+        for call in calls:
+            call()
+        timings.append((time.perf_counter() - started) * 1000)
+    violations = []
+    for database, sql, plan in recorder.statements.values():
+        violations += [f'[{database}] {problem}\n      {" ".join(sql.split())}'
+                       for problem in plan_violations(sql, plan, large)]
+    return {
+        'median_ms': round(statistics.median(timings), 3),
+        'max_ms': round(max(timings), 3),
+        'statements': len(recorder.statements),
+        'violations': violations,
+    }
+
+
+def compare(name: str, result: Dict[str, Any], baseline: Dict[str, Any], tolerance: float,
+            min_delta_ms: float) -> Optional[str]:
+    previous = baseline.get(name)
+    if not previous:
+        return None
+    limit = max(previous['median_ms'] * tolerance, previous['median_ms'] + min_delta_ms)
+    if result['median_ms'] > limit:
+        return f"median {result['median_ms']:.2f}ms vs baseline {previous['median_ms']:.2f}ms"
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--messages', type=int, default=DEFAULT_MESSAGES, help='message rows to seed')
+    parser.add_argument('--dir', default=GUARD_DIR, help='where the seeded databases are kept')
+    parser.add_argument('--baseline', default=BASELINE_PATH, help='baseline timings file')
+    parser.add_argument('--update-baseline', action='store_true', help='write this run as the new baseline')
+    parser.add_argument('--repeat', type=int, default=5, help='timed runs per check')
+    parser.add_argument('--tolerance', type=float, default=1.5, help='allowed median slowdown factor')
+    parser.add_argument('--min-delta-ms', type=float, default=2.0, help='ignore slowdowns smaller than this')
+    parser.add_argument('--large-rows', type=int, default=LARGE_TABLE_ROWS, help='rows that make a table large')
+    parser.add_argument('--only', nargs='*', help='run only these checks')
+    args = parser.parse_args()
+
+    instrumentation.INSTRUMENTATION_ENABLED = True
+    instrumentation.SLOW_QUERY_LOG = ''  # seeding is slow on purpose; keep it out of the server's log
+    prepare(args.dir, args.messages)
+    large = large_tables(args.large_rows)
+    ctx = GuardContext()
+    checks = build_checks(ctx)
+
+    failures = []
+    uncovered = sorted(public_functions() - set(checks))
+    if uncovered and not args.only:
+        failures += [f'{name}: no plan-guard check' for name in uncovered]
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            stored = json.load(f)
+        if stored.get('messages') == args.messages:
+            baseline = stored.get('checks', {})
+        else:
+            print(f"[PlanGuard] Baseline was recorded with {stored.get('messages')} messages; timings not compared")
+
+    results = {}
+    for name, calls in checks.items():
+        if args.only and name not in args.only:
+            continue
+        result = results[name] = run_check(calls, args.repeat, large)
+        regression = compare(name, result, baseline, args.tolerance, args.min_delta_ms)
+        status = 'FAIL' if result['violations'] or regression else 'ok'
+        base = baseline.get(name, {}).get('median_ms')
+        print(f"{status:4} {name:36} {result['median_ms']:9.2f}ms  "
+              f"(baseline {f'{base:.2f}ms' if base is not None else '-':>9}, {result['statements']} statements)")
+        for violation in result['violations']:
+            print(f'    {violation}')
+            failures.append(f'{name}: {violation}')
+        if regression:
+            print(f'    slower: {regression}')
+            failures.append(f'{name}: {regression}')
+
+    chatdb.flush_messages()
+    if args.update_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump({'messages': args.messages, 'checks': {
+                name: {'median_ms': r['median_ms'], 'max_ms': r['max_ms']} for name, r in results.items()
+            }}, f, indent=2, sort_keys=True)
+        print(f"[PlanGuard] Baseline written to {args.baseline}")
+
+    if failures:
+        print(f"\n{len(failures)} problem(s):")
+        for failure in failures:
+            print(f'  {failure.splitlines()[0]}')
+        raise SystemExit(1)
+    print(f"\nAll {len(results)} checks passed")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,141 @@
+import threading
+from collections import OrderedDict, deque
+from typing import Any, Callable, Dict, Hashable, List, Optional
+
+
+class _Window:
+    """Newest rows of one history scope, oldest first"""
+    __slots__ = ('rows', 'warm', 'pending', 'complete')
+
+    def __init__(self):
+        self.rows = deque()
+        self.warm = False
+        self.pending = []     # rows appended while the window was being loaded
+        self.complete = False  # holds every hot row of the scope (nothing older in SQLite)
+
+
+class RecentHistory:
+    """Per-scope ring buffers of the most recent history rows.
+
+    A window is warmed from SQLite the first time its scope is read and is then
+    kept current by append() as messages commit. page() answers keyset history
+    requests that fall inside the window; it returns None when the request
+    reaches past it and must go to the database.
+    """
+
+    def __init__(self, size: int, max_scopes: int, name: str = ''):
+        self.size = size
+        self.max_scopes = max_scopes
+        self.name = name
+        self._windows = OrderedDict()  # scope key -> _Window
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.warmups = 0
+
+    def append(self, key: Hashable, row: Dict[str, Any]):
+        """Add a committed row to its scope's window (ignored if the scope is not cached)"""
+        with self._lock:
+            window = self._windows.get(key)
+            if window is None:
+                return
+            if not window.warm:
+                window.pending.append(row)
+            elif not window.rows or row['id'] > window.rows[-1]['id']:
+                self._push(window, row)
+
+    def _push(self, window: _Window, row: Dict[str, Any]):
+        if len(window.rows) >= self.size:
+            window.rows.popleft()
+            window.complete = False
+        window.rows.append(row)
+
+    def page(self, key: Hashable, limit: int, before_id: Optional[int] = None,
+             after_id: Optional[int] = None,
+             load: Optional[Callable[[int], List[Dict[str, Any]]]] = None) -> Optional[List[Dict[str, Any]]]:
+        """Newest-first page served from memory, or None if the database is needed.
+
+        With load, a cold scope is warmed by calling load(size), which must
+        return the scope's newest rows (newest first). A page shorter than limit
+        is only returned when the window holds every hot row of the scope.
+        """
+        if limit > self.size:
+            return None
+        with self._lock:
+            window = self._windows.get(key)
+            if window is not None and window.warm:
+                self._windows.move_to_end(key)
+                rows = self._slice(window, limit, before_id, after_id)
+                if rows is None:
+                    self.misses += 1
+                else:
+                    self.hits += 1
+                return rows
+            self.misses += 1
+            if window is not None or load is None:
+                return None  # another caller is already warming this scope
+            window = _Window()
+            self._windows[key] = window
+
+        try:
+            loaded = load(self.size)
+        except BaseException:
+            with self._lock:
+                self._windows.pop(key, None)
+            raise
+
+        with self._lock:
+            if self._windows.get(key) is not window:
+                return None  # invalidated while loading
+            window.rows = deque(reversed(loaded))
+            window.complete = len(loaded) < self.size
+            newest = window.rows[-1]['id'] if window.rows else 0
+            for row in sorted(window.pending, key=lambda r: r['id']):
+                if row['id'] > newest:
+                    self._push(window, row)
+                    newest = row['id']
+            window.pending = []
+            window.warm = True
+            self.warmups += 1
+            while len(self._windows) > self.max_scopes:
+                self._windows.popitem(last=False)
+            return self._slice(window, limit, before_id, after_id)
+
+    def _slice(self, window: _Window, limit: int, before_id: Optional[int],
+               after_id: Optional[int]) -> Optional[List[Dict[str, Any]]]:
+        rows = window.rows
+        # Everything in the scope with id >= floor is in the window
+        floor = 0 if window.complete else (rows[0]['id'] if rows else None)
+        if before_id is None and after_id is not None:
+            if floor is None or floor > after_id:
+                return None
+            selected = [row for row in rows if row['id'] > after_id][:limit]
+            return [dict(row) for row in reversed(selected)]
+        selected = [row for row in rows
+                    if (before_id is None or row['id'] < before_id)
+                    and (after_id is None or row['id'] > after_id)]
+        if len(selected) < limit and not window.complete:
+            if after_id is None or floor is None or floor > after_id:
+                return None
+        return [dict(row) for row in reversed(selected[-limit:])]
+
+    def invalidate(self, key: Hashable):
+        with self._lock:
+            self._windows.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._windows.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            'name': self.name,
+            'scopes': len(self._windows),
+            'max_scopes': self.max_scopes,
+            'window_size': self.size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'warmups': self.warmups,
+            'hit_ratio': round(self.hits / lookups, 4) if lookups else 0.0,
+        }
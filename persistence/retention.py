@@ -0,0 +1,217 @@
+"""
+Message retention: moves messages past their policy's age into monthly archive
+files, prunes unreferenced attachments, compresses closed months and reclaims
+space with incremental VACUUM and WAL checkpoints during off-peak hours.
+
+Policies live in the retention_policies table: a row with scope_id '' is the
+default for a table, a row with a room id / inbox uid / adventure id overrides
+it for that conversation. No policy means messages are kept forever.
+
+Run once by hand with: python -m persistence.retention
+"""
+import asyncio
+import time
+from datetime import datetime, timedelta
+from typing import Optional, List, Dict, Any, Tuple
+import os
+from .chatdb import get_db, init_db, clear_recent_history, message_sources, attach_usernames, is_attachment_referenced
+from . import archive, shards
+
+RETENTION_INTERVAL = float(os.getenv('RETENTION_INTERVAL_SECONDS', '3600'))
+RETENTION_BATCH_ROWS = int(os.getenv('RETENTION_BATCH_ROWS', '500'))
+# Local hours (start-end, end exclusive) during which archival and VACUUM may run
+RETENTION_OFFPEAK_HOURS = os.getenv('RETENTION_OFFPEAK_HOURS', '2-5')
+# Months older than this many months are zstd-compressed when zstandard is installed
+ARCHIVE_COMPRESS_AFTER_MONTHS = int(os.getenv('ARCHIVE_COMPRESS_AFTER_MONTHS', '2'))
+INCREMENTAL_VACUUM_PAGES = int(os.getenv('INCREMENTAL_VACUUM_PAGES', '2000'))
+
+
+def set_retention_policy(table: str, max_age_days: Optional[int], scope_id: Any = ''):
+    """Set (or clear with None) the retention for a table, or for one room/inbox/adventure"""
+    if table not in archive.ARCHIVED_TABLES:
+        raise ValueError(f"Unknown message table: {table}")
+    with get_db() as db:
+        if max_age_days is None:
+            db.execute('DELETE FROM retention_policies WHERE table_name = ? AND scope_id = ?',
+                       (table, str(scope_id)))
+        else:
+            db.execute(
+                '''INSERT INTO retention_policies (table_name, scope_id, max_age_days) VALUES (?, ?, ?)
+                   ON CONFLICT(table_name, scope_id) DO UPDATE SET max_age_days = excluded.max_age_days''',
+                (table, str(scope_id), max_age_days)
+            )
+
+
+def get_retention_policies() -> List[Dict[str, Any]]:
+    with get_db() as db:
+        return [dict(row) for row in db.execute('SELECT * FROM retention_policies')]
+
+
+def _cutoff(days: int) -> str:
+    return (datetime.utcnow() - timedelta(days=days)).strftime('%Y-%m-%d %H:%M:%S')
+
+
+class RetentionService:
+    """Applies retention policies in bounded batches"""
+
+    def __init__(self, batch_rows: int = RETENTION_BATCH_ROWS):
+        self.batch_rows = batch_rows
+        self.stats = {'archived': 0, 'attachments_pruned': 0, 'months_compressed': 0, 'pages_reclaimed': 0, 'runs': 0}
+
+    def run_once(self) -> Dict[str, int]:
+        """Archive everything currently past its policy, then compact"""
+        archived = 0
+        for table, default_days, overrides in self._policies():
+            scope_column = archive.ARCHIVED_TABLES[table]
+            sources = message_sources(table)
+            for scope_id, days in overrides.items():
+                # An override's rows all live in the scope's own shard
+                source = sources[shards.shard_for(scope_id)] if table in shards.SHARDED_TABLES else sources[0]
+                archived += self._archive_scope(source, table, _cutoff(days), scope_column, scope_id)
+            if default_days is not None:
+                for source in sources:
+                    archived += self._archive_scope(source, table, _cutoff(default_days), scope_column,
+                                                    exclude=list(overrides))
+        self._compress_closed_months()
+        self._compact()
+        self.stats['archived'] += archived
+        self.stats['runs'] += 1
+        return dict(self.stats)
+
+    def _policies(self) -> List[Tuple[str, Optional[int], Dict[str, int]]]:
+        defaults, overrides = {}, {}
+        for policy in get_retention_policies():
+            if policy['scope_id'] == '':
+                defaults[policy['table_name']] = policy['max_age_days']
+            else:
+                overrides.setdefault(policy['table_name'], {})[policy['scope_id']] = policy['max_age_days']
+        return [(table, defaults.get(table), overrides.get(table, {}))
+                for table in archive.ARCHIVED_TABLES if table in defaults or table in overrides]
+
+    def _archive_scope(self, source, table: str, cutoff: str, scope_column: Optional[str],
+                       scope_id: Optional[str] = None, exclude: Optional[List[str]] = None) -> int:
+        """Move rows older than cutoff out of one database, walking the table in id order (ids follow created_at)"""
+        moved = 0
+        last_id = 0
+        while True:
+            conditions, params = ['id > ?'], [last_id]
+            if scope_id is not None:
+                conditions.append(f'{scope_column} = ?')
+                params.append(scope_id)
+            params.append(self.batch_rows)
+            with source() as db:
+                rows = [dict(row) for row in db.execute(
+                    f'''SELECT * FROM {table}
+                        WHERE {' AND '.join(conditions)} ORDER BY id LIMIT ?''',
+                    params
+                )]
+            if not rows:
+                return moved
+            attach_usernames(rows)
+            last_id = rows[-1]['id']
+            expired = [row for row in rows if row['created_at'] < cutoff]
+            if exclude and scope_column:
+                expired = [row for row in expired if str(row[scope_column]) not in exclude]
+            if expired:
+                self._move(source, table, expired)
+                moved += len(expired)
+            if rows[-1]['created_at'] >= cutoff:
+                return moved  # past the cutoff; everything after is newer
+
+    def _move(self, source, table: str, rows: List[Dict[str, Any]]):
+        by_month = {}
+        for row in rows:
+            by_month.setdefault(row['created_at'][:7], []).append(row)
+        file_ids = [row['file_id'] for row in rows if row.get('file_id')]
+
+        with get_db() as db:
+            attachments = {}
+            if file_ids:
+                marks = ','.join('?' * len(file_ids))
+                for row in db.execute(f'SELECT * FROM file_attachments WHERE id IN ({marks})', file_ids):
+                    attachments[row['id']] = dict(row)
+
+        # Archive first: a crash before the delete just re-archives the same ids (INSERT OR IGNORE)
+        for month, month_rows in by_month.items():
+            path = archive.open_for_write(month)
+            columns = list(month_rows[0].keys())
+            with archive.get_manager(path).transaction() as adb:
+                adb.executemany(
+                    f"INSERT OR IGNORE INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})",
+                    [tuple(row[c] for c in columns) for row in month_rows]
+                )
+                for row in month_rows:
+                    attachment = attachments.get(row.get('file_id'))
+                    if attachment:
+                        adb.execute(
+                            '''INSERT OR IGNORE INTO file_attachments
+                               (id, filename, blob, sha256, file_size, mime_type, created_at)
+                               VALUES (?, ?, ?, ?, ?, ?, ?)''',
+                            (attachment['id'], attachment['filename'], attachment['blob'], attachment.get('sha256'),
+                             attachment['file_size'], attachment['mime_type'], attachment['created_at'])
+                        )
+
+        with source() as db:
+            db.executemany(f'DELETE FROM {table} WHERE id = ?', [(row['id'],) for row in rows])
+        for file_id in attachments:
+            # Blob content stays in the content-addressed store; only the hot row goes
+            if not is_attachment_referenced(file_id):
+                with get_db() as db:
+                    db.execute('DELETE FROM file_attachments WHERE id = ?', (file_id,))
+                self.stats['attachments_pruned'] += 1
+        # Recent-history windows may still hold rows that now live in the archive
+        clear_recent_history()
+
+    def _compress_closed_months(self):
+        if archive.zstandard is None:
+            return
+        now = datetime.utcnow()
+        oldest_open = (now.year * 12 + now.month - 1) - ARCHIVE_COMPRESS_AFTER_MONTHS
+        for month in archive.list_months():
+            year, mon = (int(part) for part in month.split('-'))
+            if year * 12 + mon - 1 < oldest_open and archive.compress_month(month):
+                self.stats['months_compressed'] += 1
+
+    def _compact(self):
+        """Return freed pages to the filesystem and fold the WAL back into each database"""
+        for source in [get_db] + message_sources('messages'):  # central DB, then every shard
+            with source() as db:
+                if db.execute('PRAGMA auto_vacuum').fetchone()[0] == 2:  # INCREMENTAL
+                    before = db.execute('PRAGMA freelist_count').fetchone()[0]
+                    # execute() steps the pragma once, freeing a single page; executescript runs it to completion
+                    db.executescript(f'PRAGMA incremental_vacuum({INCREMENTAL_VACUUM_PAGES});')
+                    after = db.execute('PRAGMA freelist_count').fetchone()[0]
+                    self.stats['pages_reclaimed'] += before - after
+                    if before:
+                        name = os.path.basename(db.execute('PRAGMA database_list').fetchone()[2])
+                        print(f"[Retention] {name}: free pages {before} -> {after}")
+            with source() as db:
+                db.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+
+
+def _in_offpeak(hour: int) -> bool:
+    start, _, end = RETENTION_OFFPEAK_HOURS.partition('-')
+    start, end = int(start), int(end or start)
+    if start <= end:
+        return start <= hour < end
+    return hour >= start or hour < end  # window wraps midnight
+
+
+async def retention_loop(service: Optional[RetentionService] = None):
+    """Background task: run the retention service once per interval inside the off-peak window"""
+    service = service or RetentionService()
+    while True:
+        await asyncio.sleep(RETENTION_INTERVAL)
+        if not _in_offpeak(datetime.now().hour):
+            continue
+        try:
+            started = time.monotonic()
+            stats = await asyncio.to_thread(service.run_once)
+            print(f"[Retention] Run finished in {time.monotonic() - started:.1f}s: {stats}")
+        except Exception as e:
+            print(f"[Retention] Run failed: {e}")
+
+
+if __name__ == '__main__':
+    init_db()
+    print(RetentionService().run_once())
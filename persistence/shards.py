@@ -0,0 +1,288 @@
+"""
+Sharded storage for conversation messages.
+
+room_messages, messages and adventure_messages (plus the private-message
+delivery cursors) live in CHAT_SHARD_COUNT shard files, picked by a stable
+hash of room_id / inbox_uid / adventure_id. Users, rooms, memberships, inbox
+summaries and global chat stay in the central chat database. Every shard has
+its own connection pool and write-behind journal, so a busy room only holds
+its own shard's writer lock.
+
+Message ids stay globally unique: each shard allocates ids from its own range
+(see _id_base), so archives, search and exports can key rows by id alone.
+
+Rows still in the central tables (databases created before sharding) are
+moved into the shards by init_db. Changing the shard count needs a rebalance
+with the server stopped:
+
+    python -m persistence.shards status
+    python -m persistence.shards rebalance [--shards N] [--batch 500]
+"""
+import argparse
+import glob
+import os
+import zlib
+from typing import Any, Callable, Dict, List, Optional
+from .connection import get_manager, ConnectionManager
+from .journal import get_journal, WriteBehindJournal
+
+SHARD_COUNT = int(os.getenv('CHAT_SHARD_COUNT', '4'))
+SHARD_DIR = os.getenv('CHAT_SHARD_DIR', os.path.join(os.path.dirname(__file__), '../chat-shards'))
+MOVE_BATCH_ROWS = int(os.getenv('CHAT_SHARD_MOVE_BATCH_ROWS', '500'))
+
+MAX_SHARDS = 256
+ID_RANGE_BITS = 36  # ids available to one shard within one layout generation
+
+# Sharded message tables and the column whose value picks the shard
+SHARDED_TABLES = {
+    'room_messages': 'room_id',
+    'messages': 'inbox_uid',
+    'adventure_messages': 'adventure_id',
+}
+
+# Active layout, loaded from the central shard_config table by init_shards
+_layout = {'count': SHARD_COUNT, 'generation': 0}
+
+
+class ShardLayoutError(RuntimeError):
+    """Raised when the configured shard count does not match the stored layout"""
+
+
+def shard_count() -> int:
+    return _layout['count']
+
+
+def shard_for(scope_value: Any, count: Optional[int] = None) -> int:
+    """Shard index for a room id, inbox uid or adventure id"""
+    return zlib.crc32(str(scope_value).encode()) % (count or _layout['count'])
+
+
+def shard_path(index: int) -> str:
+    return os.path.join(SHARD_DIR, f'shard-{index:03d}.sqlite3')
+
+
+def shard_manager(index: int) -> ConnectionManager:
+    return get_manager(shard_path(index))
+
+
+def shard_db(index: int):
+    """Reuse this thread's pooled connection to a shard inside a transaction"""
+    return shard_manager(index).transaction()
+
+
+def shard_journal(index: int) -> WriteBehindJournal:
+    """Write-behind journal that batches inserts into one shard"""
+    return get_journal(shard_path(index))
+
+
+def db_for(scope_value: Any):
+    return shard_db(shard_for(scope_value))
+
+
+def journal_for(scope_value: Any) -> WriteBehindJournal:
+    return shard_journal(shard_for(scope_value))
+
+
+def all_journals() -> List[WriteBehindJournal]:
+    return [shard_journal(index) for index in range(shard_count())]
+
+
+def _id_base(generation: int, index: int) -> int:
+    """First id of a shard's range; range 0 is left to ids from the central tables"""
+    return (generation * MAX_SHARDS + index + 1) << ID_RANGE_BITS
+
+
+def open_shard(index: int, generation: int):
+    """Create a shard's schema and move its id sequences into its range"""
+    os.makedirs(SHARD_DIR, exist_ok=True)
+    manager = shard_manager(index)
+    with open(os.path.join(os.path.dirname(__file__), 'chat_shard_schema.sql'), 'r') as f:
+        manager.run_script(f.read())
+    base = _id_base(generation, index)
+    with manager.transaction() as db:
+        for table in SHARDED_TABLES:
+            cur = db.execute('UPDATE sqlite_sequence SET seq = MAX(seq, ?) WHERE name = ?', (base, table))
+            if cur.rowcount == 0:
+                db.execute('INSERT INTO sqlite_sequence (name, seq) VALUES (?, ?)', (table, base))
+
+
+def _read_config(central: ConnectionManager) -> Dict[str, int]:
+    with central.transaction() as db:
+        return {row['name']: row['value'] for row in db.execute('SELECT name, value FROM shard_config')}
+
+
+def _write_config(central: ConnectionManager, **values: int):
+    with central.transaction() as db:
+        db.executemany(
+            '''INSERT INTO shard_config (name, value) VALUES (?, ?)
+               ON CONFLICT(name) DO UPDATE SET value = excluded.value''',
+            list(values.items())
+        )
+
+
+def init_shards(central: ConnectionManager):
+    """Load the shard layout, create the shard files and move any rows left in the central tables"""
+    config = _read_config(central)
+    if not config:
+        config = {'shard_count': SHARD_COUNT, 'generation': 0, 'rebalancing': 0}
+        _write_config(central, **config)
+    if config.get('rebalancing'):
+        raise ShardLayoutError("A shard rebalance was interrupted; run: python -m persistence.shards rebalance")
+    if config['shard_count'] != SHARD_COUNT:
+        raise ShardLayoutError(
+            f"CHAT_SHARD_COUNT is {SHARD_COUNT} but the database has {config['shard_count']} shards; "
+            f"run: python -m persistence.shards rebalance --shards {SHARD_COUNT}"
+        )
+    _layout.update(count=config['shard_count'], generation=config['generation'])
+    for index in range(shard_count()):
+        open_shard(index, _layout['generation'])
+    moved = _move_all(central, lambda row, table: shard_for(row[SHARDED_TABLES[table]]))
+    if moved:
+        print(f"[Shards] Moved {moved} rows from the central database into {shard_count()} shards")
+
+
+def _move_table(source: ConnectionManager, table: str, target: Callable[[Dict[str, Any]], Optional[int]],
+                batch_rows: int) -> int:
+    """Move rows of one table to the shard target(row) returns (None = leave in place)"""
+    moved = 0
+    last_id = 0
+    while True:
+        with source.transaction() as db:
+            rows = [dict(row) for row in db.execute(
+                f'SELECT * FROM {table} WHERE id > ? ORDER BY id LIMIT ?', (last_id, batch_rows))]
+        if not rows:
+            return moved
+        last_id = rows[-1]['id']
+        by_shard = {}
+        for row in rows:
+            index = target(row)
+            if index is not None:
+                by_shard.setdefault(index, []).append(row)
+        for index, shard_rows in by_shard.items():
+            columns = list(shard_rows[0])
+            # Copy first: a crash before the delete just copies the same ids again
+            with shard_db(index) as db:
+                db.executemany(
+                    f"INSERT OR IGNORE INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})",
+                    [tuple(row[c] for c in columns) for row in shard_rows]
+                )
+            with source.transaction() as db:
+                db.executemany(f'DELETE FROM {table} WHERE id = ?', [(row['id'],) for row in shard_rows])
+            moved += len(shard_rows)
+
+
+def _move_cursors(source: ConnectionManager, target: Callable[[str], Optional[int]]) -> int:
+    """Move inbox delivery cursors to the shard that holds their inbox"""
+    with source.transaction() as db:
+        rows = [dict(row) for row in db.execute('SELECT * FROM inbox_delivery')]
+    by_shard = {}
+    for row in rows:
+        index = target(row['inbox_uid'])
+        if index is not None:
+            by_shard.setdefault(index, []).append(row)
+    for index, shard_rows in by_shard.items():
+        params = [(row['user_id'], row['inbox_uid'], row['last_delivered_id']) for row in shard_rows]
+        with shard_db(index) as db:
+            db.executemany(
+                '''INSERT INTO inbox_delivery (user_id, inbox_uid, last_delivered_id) VALUES (?, ?, ?)
+                   ON CONFLICT(user_id, inbox_uid)
+                   DO UPDATE SET last_delivered_id = MAX(last_delivered_id, excluded.last_delivered_id)''',
+                params
+            )
+        with source.transaction() as db:
+            db.executemany('DELETE FROM inbox_delivery WHERE user_id = ? AND inbox_uid = ?',
+                           [param[:2] for param in params])
+    return sum(len(shard_rows) for shard_rows in by_shard.values())
+
+
+def _move_all(source: ConnectionManager, target: Callable[[Dict[str, Any], str], Optional[int]],
+              batch_rows: int = MOVE_BATCH_ROWS) -> int:
+    moved = 0
+    for table in SHARDED_TABLES:
+        moved += _move_table(source, table, lambda row: target(row, table), batch_rows)
+    moved += _move_cursors(source, lambda inbox_uid: target({'inbox_uid': inbox_uid}, 'messages'))
+    return moved
+
+
+def _existing_shards() -> List[int]:
+    return sorted(int(os.path.basename(path)[len('shard-'):-len('.sqlite3')])
+                  for path in glob.glob(os.path.join(SHARD_DIR, 'shard-*.sqlite3')))
+
+
+def rebalance(central: ConnectionManager, new_count: int, batch_rows: int = MOVE_BATCH_ROWS) -> int:
+    """Re-route every row to its shard under new_count shards; resumable, run with the server stopped"""
+    if not 1 <= new_count <= MAX_SHARDS:
+        raise ValueError(f"Shard count must be between 1 and {MAX_SHARDS}")
+    config = _read_config(central)
+    generation = config.get('generation', 0)
+    if config.get('shard_count') != new_count:
+        generation += 1  # new ids start above every existing range
+    _write_config(central, shard_count=new_count, generation=generation, rebalancing=1)
+    _layout.update(count=new_count, generation=generation)
+
+    for index in range(new_count):
+        open_shard(index, generation)
+    moved = _move_all(central, lambda row, table: shard_for(row[SHARDED_TABLES[table]]), batch_rows)
+    for index in _existing_shards():
+        def misplaced(row, table, index=index):
+            target = shard_for(row[SHARDED_TABLES[table]])
+            return target if target != index else None
+        moved += _move_all(shard_manager(index), misplaced, batch_rows)
+        print(f"[Shards] Rebalanced shard {index} ({moved} rows moved so far)")
+
+    # Shards past the new count are empty now
+    for index in _existing_shards():
+        if index >= new_count:
+            shard_manager(index).close_all()
+            for suffix in ('', '-wal', '-shm'):
+                if os.path.exists(shard_path(index) + suffix):
+                    os.unlink(shard_path(index) + suffix)
+    _write_config(central, rebalancing=0)
+    return moved
+
+
+def reserve_ids_above(central: ConnectionManager, max_id: int) -> int:
+    """Move every shard's id range above max_id, e.g. after loading rows exported from another layout"""
+    generation = _read_config(central).get('generation', 0)
+    if max_id >= _id_base(generation, 0):
+        generation = (max_id >> ID_RANGE_BITS) // MAX_SHARDS + 1
+        _write_config(central, generation=generation)
+        _layout.update(generation=generation)
+    for index in range(shard_count()):
+        open_shard(index, generation)
+    return generation
+
+
+def shard_status() -> List[Dict[str, Any]]:
+    """Row counts and file size per shard"""
+    status = []
+    for index in _existing_shards():
+        with shard_db(index) as db:
+            counts = {table: db.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0] for table in SHARDED_TABLES}
+        status.append({'shard': index, 'path': shard_path(index),
+                       'bytes': os.path.getsize(shard_path(index)), **counts})
+    return status
+
+
+def main():
+    from .chatdb import CHAT_DB_PATH, init_db
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('command', choices=['status', 'rebalance'])
+    parser.add_argument('--shards', type=int, default=SHARD_COUNT, help='target shard count (default CHAT_SHARD_COUNT)')
+    parser.add_argument('--batch', type=int, default=MOVE_BATCH_ROWS, help='rows to move per batch')
+    args = parser.parse_args()
+
+    central = get_manager(CHAT_DB_PATH)
+    init_db(open_shards=False)
+    if args.command == 'rebalance':
+        moved = rebalance(central, args.shards, args.batch)
+        print(f"Done: {moved} rows moved, {args.shards} shards in {SHARD_DIR}")
+    else:
+        print(_read_config(central))
+        for shard in shard_status():
+            print(shard)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,159 @@
+"""
+Incremental presence: a versioned set of online usernames.
+
+Instead of polling get_users for the whole list, clients keep their own copy.
+They load it with get_presence, which returns a snapshot paginated by username
+(PRESENCE_PAGE_SIZE per page). After that they apply the presence_delta events
+pushed to every connection. Changes are batched for PRESENCE_FLUSH_SECONDS, so
+a burst of connects costs one broadcast per interval, not one per connection.
+
+A delta is {from, version, joined, left}. A client whose version isn't `from`
+asks for get_presence {since: <its version>}. It gets the combined changes, or
+a snapshot when the last PRESENCE_LOG_SIZE deltas don't reach back that far.
+
+In worker mode, versions are the broker's presence sequence numbers, and every
+worker follows the same broker stream, so a version means the same user set on
+any worker.
+"""
+import asyncio
+import bisect
+import os
+from collections import deque
+from typing import Any, Dict, List, Optional
+
+FLUSH_SECONDS = float(os.getenv('PRESENCE_FLUSH_SECONDS', '0.25'))
+LOG_SIZE = int(os.getenv('PRESENCE_LOG_SIZE', '1000'))
+PAGE_SIZE = int(os.getenv('PRESENCE_PAGE_SIZE', '500'))
+MAX_PAGE_SIZE = 5000
+
+
+class PresenceService:
+    """Online usernames published as versioned, batched join/leave deltas"""
+
+    def __init__(self, delivery, external: bool = False):
+        self.delivery = delivery
+        # In worker mode changes come only from broker frames (apply), never from connect/disconnect
+        self.external = external
+        self._sids = {}  # sid -> username, live
+        self._counts = {}  # username -> live connections
+        self._dirty = set()  # usernames touched since the last flush
+        self._live_version = 0
+        self.version = 0  # version of the published set
+        self._users = []  # published usernames, sorted for paging
+        self._online = set()
+        self._log = deque(maxlen=LOG_SIZE)  # (from, version, joined, left)
+        self._flush_handle = None
+        self._restarted = False
+        self.stats = {'deltas': 0, 'snapshots': 0, 'catchups': 0, 'resyncs': 0}
+
+    def connect(self, sid: str, username: str):
+        if not self.external:
+            self._connect(sid, username, self._live_version + 1)
+
+    def disconnect(self, sid: str):
+        if not self.external:
+            self._disconnect(sid, self._live_version + 1)
+
+    def apply(self, frame: tuple):
+        """Apply a versioned presence frame from the cluster broker"""
+        kind, version = frame[0], frame[-1]
+        if kind == 'presence_set':
+            self._connect(frame[1], frame[2], version)
+        elif kind == 'presence_del':
+            self._disconnect(frame[1], version)
+        elif kind == 'presence_snapshot':
+            # Sent on every (re)connect; a restarted broker numbers versions from scratch
+            self._restarted = True
+            for sid in list(self._sids):
+                self._disconnect(sid, version)
+            for sid, username in frame[1].items():
+                self._connect(sid, username, version)
+            self._changed(None, version)
+
+    def _connect(self, sid: str, username: str, version: int):
+        if sid in self._sids:
+            self._disconnect(sid, version)
+        self._sids[sid] = username
+        self._counts[username] = self._counts.get(username, 0) + 1
+        self._changed(username, version)
+
+    def _disconnect(self, sid: str, version: int):
+        username = self._sids.pop(sid, None)
+        if username is not None:
+            if self._counts[username] > 1:
+                self._counts[username] -= 1
+            else:
+                del self._counts[username]
+        self._changed(username, version)
+
+    def _changed(self, username: Optional[str], version: int):
+        if username is not None:
+            self._dirty.add(username)
+        self._live_version = version
+        if self._flush_handle is None:
+            self._flush_handle = asyncio.get_running_loop().call_later(FLUSH_SECONDS, self.flush)
+
+    def flush(self):
+        """Publish the net changes since the last flush as one presence_delta"""
+        self._flush_handle = None
+        joined = sorted(u for u in self._dirty if u in self._counts and u not in self._online)
+        left = sorted(u for u in self._dirty if u not in self._counts and u in self._online)
+        self._dirty.clear()
+        if self._restarted:
+            # Versions before the snapshot may come from another broker sequence
+            self._restarted = False
+            self._log.clear()
+        elif not joined and not left:
+            return
+        previous, self.version = self.version, self._live_version
+        for username in joined:
+            bisect.insort(self._users, username)
+            self._online.add(username)
+        for username in left:
+            del self._users[bisect.bisect_left(self._users, username)]
+            self._online.discard(username)
+        delta = (previous, self.version, joined, left)
+        self._log.append(delta)
+        self.stats['deltas'] += 1
+        self.delivery.emit_local('presence_delta', self._delta_payload(*delta))
+
+    @staticmethod
+    def _delta_payload(previous: int, version: int, joined: List[str], left: List[str]) -> Dict[str, Any]:
+        return {'from': previous, 'version': version, 'joined': joined, 'left': left}
+
+    def changes_since(self, version: int) -> Optional[Dict[str, Any]]:
+        """One delta from version to the current one; None if the log doesn't go back that far"""
+        if version == self.version:
+            return self._delta_payload(version, version, [], [])
+        deltas = list(self._log)
+        start = next((i for i, delta in enumerate(deltas) if delta[0] == version), None)
+        if start is None:
+            self.stats['resyncs'] += 1
+            return None
+        status = {}
+        for _, _, joined, left in deltas[start:]:
+            status.update(dict.fromkeys(joined, True))
+            status.update(dict.fromkeys(left, False))
+        self.stats['catchups'] += 1
+        return self._delta_payload(version, self.version,
+                                   sorted(u for u, online in status.items() if online),
+                                   sorted(u for u, online in status.items() if not online))
+
+    def snapshot(self, after: Optional[str] = None, limit: int = PAGE_SIZE) -> Dict[str, Any]:
+        """A page of online usernames sorted by name, starting after `after`"""
+        start = bisect.bisect_right(self._users, after) if after else 0
+        page = self._users[start:start + limit]
+        self.stats['snapshots'] += 1
+        return {
+            'version': self.version,
+            'users': page,
+            'next_after': page[-1] if start + limit < len(self._users) else None,
+            'total': len(self._users),
+        }
+
+    def users(self) -> List[str]:
+        return list(self._users)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return dict(self.stats, version=self.version, online=len(self._users), connections=len(self._sids),
+                    log=len(self._log))
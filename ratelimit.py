@@ -0,0 +1,140 @@
+"""
+In-memory token-bucket rate limiting for the auth routes and chat events.
+
+Each limit is "<count>/<seconds>": a bucket holds up to <count> tokens and
+refills at count/seconds per second. Buckets are keyed per limit by client
+IP, username or Socket.IO sid; a request is allowed only if every key it is
+checked against has a token left. Override a limit with RATE_LIMIT_<NAME>,
+e.g. RATE_LIMIT_LOGIN=5/60, or turn limiting off with RATE_LIMITS_ENABLED=0.
+
+Buckets that have refilled completely carry no state, so they are swept
+every RATE_LIMIT_SWEEP_SECONDS.
+"""
+import functools
+import os
+import time
+from typing import Any, Callable, Dict, Iterable, Optional, Tuple
+from aiohttp import web
+
+RATE_LIMITS_ENABLED = os.getenv('RATE_LIMITS_ENABLED', '1') == '1'
+SWEEP_INTERVAL = float(os.getenv('RATE_LIMIT_SWEEP_SECONDS', '60'))
+
+DEFAULT_LIMITS = {
+    'login': '10/60',
+    'register': '5/600',
+    'anonymous_login': '20/60',
+    'chat_message': '20/10',
+    'room_message': '20/10',
+    'private_message': '20/10',
+}
+
+# POST routes the middleware limits, and the form/JSON field holding the username
+ROUTE_LIMITS = {
+    '/login': ('login', 'form'),
+    '/register': ('register', 'form'),
+    '/anonymous-login': ('anonymous_login', 'json'),
+}
+
+
+def parse_limit(spec: str) -> Tuple[float, float]:
+    """'<count>/<seconds>' -> (burst, tokens per second)"""
+    count, seconds = spec.split('/')
+    return float(count), float(count) / float(seconds)
+
+
+class RateLimiter:
+    """Token buckets per (limit name, key) with allowed/rejected counters per limit"""
+
+    def __init__(self, limits: Dict[str, str]):
+        self.limits = {name: parse_limit(os.getenv(f'RATE_LIMIT_{name.upper()}', spec))
+                       for name, spec in limits.items()}
+        self._buckets = {}  # (limit name, key) -> [tokens, last refill time]
+        self._last_sweep = time.monotonic()
+        self.stats = {name: {'allowed': 0, 'rejected': 0} for name in self.limits}
+
+    def _tokens(self, name: str, key: Any, now: float) -> list:
+        burst, rate = self.limits[name]
+        bucket = self._buckets.get((name, key))
+        if bucket is None:
+            bucket = self._buckets[(name, key)] = [burst, now]
+        else:
+            bucket[0] = min(burst, bucket[0] + (now - bucket[1]) * rate)
+            bucket[1] = now
+        return bucket
+
+    def check(self, name: str, keys: Iterable[Any]) -> float:
+        """Take one token from each key's bucket; returns 0 if allowed, else seconds until a retry can pass"""
+        if not RATE_LIMITS_ENABLED or name not in self.limits:
+            return 0.0
+        now = time.monotonic()
+        if now - self._last_sweep >= SWEEP_INTERVAL:
+            self.sweep(now)
+        buckets = [self._tokens(name, key, now) for key in keys if key is not None]
+        short = [bucket for bucket in buckets if bucket[0] < 1]
+        if short:
+            self.stats[name]['rejected'] += 1
+            rate = self.limits[name][1]
+            return max((1 - bucket[0]) / rate for bucket in short)
+        for bucket in buckets:
+            bucket[0] -= 1
+        self.stats[name]['allowed'] += 1
+        return 0.0
+
+    def sweep(self, now: Optional[float] = None):
+        """Forget buckets that have refilled to their burst size"""
+        now = now or time.monotonic()
+        for (name, key), (tokens, updated) in list(self._buckets.items()):
+            burst, rate = self.limits[name]
+            if tokens + (now - updated) * rate >= burst:
+                del self._buckets[(name, key)]
+        self._last_sweep = now
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {'buckets': len(self._buckets), 'limits': self.stats}
+
+
+rate_limiter = RateLimiter(DEFAULT_LIMITS)
+
+
+async def _route_username(request, source: str) -> Optional[str]:
+    """Username from the login/registration body; aiohttp caches the body for the handler"""
+    try:
+        data = await request.post() if source == 'form' else await request.json()
+        return str(data.get('username', '')).strip().lower() or None
+    except Exception:
+        return None
+
+
+@web.middleware
+async def rate_limit_middleware(request, handler):
+    """Limit the auth POST routes per client IP and per username"""
+    route = ROUTE_LIMITS.get(request.path)
+    if route and request.method == 'POST':
+        name, source = route
+        username = await _route_username(request, source)
+        keys = [f'ip:{request.remote}'] + ([f'user:{username}'] if username else [])
+        retry_after = rate_limiter.check(name, keys)
+        if retry_after:
+            return web.json_response({'error': 'Too many attempts, please try again later'}, status=429,
+                                     headers={'Retry-After': str(int(retry_after) + 1)})
+    return await handler(request)
+
+
+def rate_limited(name: str, keys: Callable[[str], Iterable[Any]],
+                 on_limited: Optional[Callable[[str, float], Any]] = None):
+    """
+    Decorator for Socket.IO handlers: keys(sid) gives the bucket keys to
+    charge (None entries are skipped), and on_limited(sid, retry_after) is
+    awaited instead of the handler when any of them is empty.
+    """
+    def decorator(handler):
+        @functools.wraps(handler)
+        async def wrapper(sid, *args):
+            retry_after = rate_limiter.check(name, keys(sid))
+            if retry_after:
+                if on_limited:
+                    await on_limited(sid, retry_after)
+                return None
+            return await handler(sid, *args)
+        return wrapper
+    return decorator
@@ -1,4 +1,7 @@
 import asyncio
+import base64
+import signal
+from urllib.parse import quote
 import time
 import threading
 import concurrent.futures
@@ -15,35 +18,72 @@ from adventure.ai_dm import AIDungeonMaster
 from adventure.dice import roll_dice
 
 from topic_analyzer import TopicAnalyzer
-from persistence.chatdb import (
-    init_db, get_or_create_user, get_room_by_name, create_new_room, save_global_message,
+from persistence.chatdb import init_db, close_message_journals, ROOM_DIRECTORY_ORDERS, MAX_ROOM_DIRECTORY_PAGE
+from persistence.async_chatdb import (
+    get_or_create_user, get_room_by_name, create_new_room, save_global_message,
     save_room_message, save_private_message, get_or_create_inbox,
     get_global_messages_with_users, get_room_messages_with_users,
     get_private_messages_with_users, get_adventure_messages_with_users, get_user_inboxes, save_file_attachment,
-    add_user_to_room, remove_user_from_room, get_user_rooms, is_user_in_room,
-    get_undelivered_private_messages, update_user_last_seen
+    add_user_to_room, remove_user_from_room, get_user_rooms, get_room_directory as get_room_directory_db, is_user_in_room,
+    get_undelivered_private_messages, update_user_last_seen, get_file_attachment,
+    mark_private_messages_delivered, UNDELIVERED_PAGE_SIZE,
+    get_legacy_attachment_blob, can_access_attachment, search_messages as search_messages_db, mark_inbox_read, get_cache_stats
 )
-from persistence.authdb import init_auth_db
+from persistence.blobstore import blob_store
+from persistence.authdb import init_auth_db, get_session_cache_stats
+from persistence.connection import close_all_connections
+from persistence.journal import close_all_journals
+from persistence.aio import shutdown_db_executor
+from persistence.retention import retention_loop
+from persistence.maintenance import maintenance_loop, shutdown_maintenance, get_maintenance_stats
+from persistence.instrumentation import query_stats
+from persistence.passwords import password_hasher, start_password_pool, shutdown_password_pool
 from auth import (
     setup_auth, get_current_user, login_handler, register_handler, 
-    anonymous_login_handler, logout_handler, status_handler
+    anonymous_login_handler, logout_handler, status_handler, require_auth, require_admin
 )
+from ratelimit import rate_limiter, rate_limit_middleware, rate_limited
+from cluster import WORKERS, IS_WORKER, IS_PRIMARY, BrokerClient, client_manager, run_supervisor
+from outbound import OutboundDelivery
+from presence import PresenceService, PAGE_SIZE as PRESENCE_PAGE_SIZE, MAX_PAGE_SIZE as MAX_PRESENCE_PAGE_SIZE
+
+# In worker mode (CHAT_WORKERS > 1) emits and presence go through the cluster broker
+broker_client = BrokerClient() if IS_WORKER else None
 
 #Create Socket.IO server and attach to aiohttp with CORS settings
 sio = socketio.AsyncServer(
     async_mode="aiohttp",
-    cors_allowed_origins="*"  # Allow all origins
+    cors_allowed_origins="*",  # Allow all origins
+    client_manager=client_manager(broker_client) if IS_WORKER else None,
+    # Long-polling needs sticky sessions, which workers sharing a port can't give
+    transports=['websocket'] if IS_WORKER else None
 )
-app = web.Application()
+# Every emit goes through a bounded per-connection queue (see outbound.py)
+delivery = OutboundDelivery(sio, broker_client)
+# Versioned online-user set; workers follow the broker's presence stream (see presence.py)
+presence = PresenceService(delivery, external=IS_WORKER)
+if broker_client:
+    broker_client.on_presence = presence.apply
+app = web.Application(middlewares=[rate_limit_middleware])
 sio.attach(app)
 
 # Setup authentication
 setup_auth(app)
 
 # Store connected clients and their associated user sessions
-connected_clients = bidict({})
+connected_clients = broker_client.presence if IS_WORKER else bidict({})
 client_sessions = {}  # sid -> session data
 
+def event_rate_keys(sid):
+    """Rate-limit buckets charged for a socket event: the connection and its user"""
+    username = connected_clients.get(sid)
+    return [f'sid:{sid}', f'user:{username}' if username else None]
+
+async def notify_rate_limited(sid, retry_after):
+    await delivery.emit("server_message",
+                   {"text from server": f"You're sending messages too fast; try again in {retry_after:.0f}s"},
+                   to=sid)
+
 # Background task tracking to prevent spam
 background_tasks = {}  # user_id -> last_task_time
 BACKGROUND_TASK_COOLDOWN = 0.5  # seconds between background tasks per user
@@ -56,12 +96,8 @@ TOPIC_NOTIFICATION_COOLDOWN = 60.0  # seconds between topic notifications per us
 llm_thread_pool = concurrent.futures.ThreadPoolExecutor(max_workers=2, thread_name_prefix="LLM")
 topic_analysis_queue = asyncio.Queue(maxsize=100)  # Limit queue size to prevent memory issues
 
-# Initialize databases
-init_db()         # Chat database
-init_auth_db()    # Authentication database
-
 # Initialize adventure handler
-adventure_handler = AdventureHandler(sio, connected_clients)
+adventure_handler = AdventureHandler(sio, connected_clients, delivery)
 
 # Initialize topic analyzer with reduced context
 topic_analyzer = TopicAnalyzer(max_history_per_user=5, consecutive_threshold=4)
@@ -78,6 +114,51 @@ async def audio(request):
         return web.HTTPFound('/login')
     return web.FileResponse(STATIC_DIR / "audio.html")
 
+@require_auth
+async def attachment(request):
+    """Stream an attachment from the blob store without loading it into memory.
+
+    Only users who can see a message the file is attached to get it; everyone
+    else gets 404, so ids can't be probed.
+    """
+    try:
+        file_id = int(request.match_info['file_id'])
+    except ValueError:
+        raise web.HTTPBadRequest()
+    user = await get_current_user(request)
+    user_id = await get_or_create_user(user['username'], is_anonymous=user.get('is_anonymous', True))
+    meta = await get_file_attachment(file_id)
+    if not meta or not await can_access_attachment(user_id, file_id):
+        raise web.HTTPNotFound()
+    headers = {
+        'Content-Disposition': "attachment; filename*=UTF-8''" + quote(meta['filename'], safe=''),
+        'Content-Type': meta['mime_type'] or 'application/octet-stream'
+    }
+    if meta['sha256']:
+        return web.FileResponse(blob_store.path_for(meta['sha256']), headers=headers)
+    # Row not migrated yet - content is still inline base64
+    return web.Response(body=base64.b64decode(await get_legacy_attachment_blob(file_id) or ''), headers=headers)
+
+@require_admin
+async def db_stats(request):
+    """SQL statement aggregates, slow queries and the server's cache, queue and limiter counters"""
+    order_by = request.query.get('order', 'total_ms')
+    if order_by not in ('total_ms', 'count', 'p99_ms', 'max_ms', 'rows'):
+        raise web.HTTPBadRequest(text='order must be one of total_ms, count, p99_ms, max_ms, rows')
+    limit = int(request.query['limit']) if request.query.get('limit', '').isdigit() else None
+    if request.query.get('reset') == '1':
+        query_stats.reset()
+    return web.json_response({
+        'statements': query_stats.snapshot(order_by, limit),
+        'slow_queries': query_stats.slow_queries(),
+        'caches': get_cache_stats() + [get_session_cache_stats()],
+        'maintenance': get_maintenance_stats(),
+        'password_hashing': password_hasher.get_stats(),
+        'rate_limits': rate_limiter.get_stats(),
+        'outbound': delivery.get_stats(),
+        'presence': presence.get_stats(),
+    })
+
 # Add authentication routes
 app.router.add_route('*', '/login', login_handler)
 app.router.add_route('*', '/register', register_handler)
@@ -87,12 +168,14 @@ app.router.add_get('/auth/status', status_handler)
 
 app.router.add_get('/', index)
 app.router.add_get("/audio", audio)
+app.router.add_get("/attachments/{file_id}", attachment)
+app.router.add_get("/admin/db-stats", db_stats)
 app.router.add_static("/static/", path=STATIC_DIR, name="static")
 
 @sio.event()
 async def signal(sid, data):
     print(f"Signal from {sid}: {data.get('type')}")
-    await sio.emit('signal', data, skip_sid=sid)
+    await delivery.emit('signal', data, skip_sid=sid)
 
 def wrap_message(sender: str, receiver: str, msg_type: str, content: str, timestamp: str):
     """Helper to build the unified envelope."""
@@ -106,39 +189,19 @@ def wrap_message(sender: str, receiver: str, msg_type: str, content: str, timest
 
 @sio.event
 async def connect(sid, environ):
-    """Handle client connection - request authentication"""
+    """Authenticate the socket from the aiohttp session cookie sent with the handshake"""
+    request = environ.get('aiohttp.request')
+    user = await get_current_user(request) if request is not None else {'is_authenticated': False}
+    if not user['is_authenticated'] or not user.get('username'):
+        # Clients log in over HTTP (/login, /register, /anonymous-login) before connecting
+        raise socketio.exceptions.ConnectionRefusedError('authentication required')
     print("Client connected:", sid)
-    # Send authentication request to client
-    await sio.emit("auth_required", {}, to=sid)
+    user_id = await register_connection(sid, user['username'], user['is_anonymous'])
+    # Bootstrap after the connect handshake completes rather than inside it
+    sio.start_background_task(send_session_bootstrap, sid, user_id, user['username'], user['is_anonymous'])
 
-@sio.event 
-async def authenticate(sid, data):
-    """Handle authentication from client with session token or credentials"""
-    print(f"Authentication attempt from {sid}")
-    
-    auth_type = data.get('type', 'session')
-    
-    if auth_type == 'session':
-        # Try to authenticate using session ID from client
-        session_id = data.get('session_id')
-        if session_id:
-            # This would require implementing session token validation
-            # For now, we'll use a simpler approach
-            pass
-    
-    # For now, request username as fallback (backward compatibility)
-    await sio.emit("request_username", {}, to=sid)
-
-@sio.event
-async def set_username(sid, data):
-    """Handle username setting (for anonymous users or after login)"""
-    username = data.get("username")
-    is_anonymous = data.get("is_anonymous", True)
-    
-    if not username:
-        await sio.emit("auth_error", {"error": "Username required"}, to=sid)
-        return
-    
+async def register_connection(sid, username, is_anonymous):
+    """Bind a socket to a user, replacing any older connection with the same name; returns the user id"""
     # Check if username is already connected and disconnect the old session
     try:
         if username in connected_clients.inverse:
@@ -154,6 +217,7 @@ async def set_username(sid, data):
     
     # Now safely add the new connection
     connected_clients[sid] = username
+    presence.connect(sid, username)
     client_sessions[sid] = {
         'username': username,
         'is_anonymous': is_anonymous,
@@ -161,96 +225,99 @@ async def set_username(sid, data):
     }
     
     # Create or get user in database
-    user_id = get_or_create_user(username, is_anonymous=is_anonymous)
+    user_id = await get_or_create_user(username, is_anonymous=is_anonymous)
     client_sessions[sid]['user_id'] = user_id
     
     print(f"Client {sid} identified as {username} (anonymous: {is_anonymous})")
+    return user_id
+
+BOOTSTRAP_HISTORY_LIMIT = 20
+
+async def send_session_bootstrap(sid, user_id, username, is_anonymous):
+    """Restore rooms and send auth status, recent global chat and the first offline-message page in one packet.
+
+    Older global history is fetched with get_chat_history (history.cursors),
+    further offline messages with fetch_undelivered while undelivered.has_more
+    is set.
+    """
+    rooms, history, undelivered = await asyncio.gather(
+        get_user_rooms(user_id),
+        get_global_messages_with_users(limit=BOOTSTRAP_HISTORY_LIMIT),
+        next_undelivered_page(user_id, username),
+        return_exceptions=True
+    )
+    for part, result in (('rooms', rooms), ('chat history', history), ('offline messages', undelivered)):
+        if isinstance(result, Exception):
+            print(f"Error loading {part} for {username}: {result}")
+    rooms = [] if isinstance(rooms, Exception) else rooms
+    history = [] if isinstance(history, Exception) else history
+    envelopes, has_more, last_ids = ([], False, {}) if isinstance(undelivered, Exception) else undelivered
+    rooms.sort(key=lambda room: room['last_activity_at'] or '', reverse=True)
     
-    # Restore user's rooms
-    try:
-        user_rooms = get_user_rooms(user_id)
-        for room_data in user_rooms:
-            room_name = room_data['name']
-            await sio.enter_room(sid, room_name)
-            print(f"Restored {username} to room: {room_name}")
-        
-        # Send list of restored rooms to client
-        if user_rooms:
-            room_names = [room['name'] for room in user_rooms]
-            await sio.emit("rooms_restored", {"rooms": room_names}, to=sid)
-    except Exception as e:
-        print(f"Error restoring rooms for {username}: {e}")
+    # Restore the user's rooms in one go
+    await asyncio.gather(*(sio.enter_room(sid, room['name']) for room in rooms))
+    
+    await delivery.emit("session_bootstrap", {
+        "auth": {"authenticated": True, "username": username, "is_anonymous": is_anonymous},
+        "welcome": f"Welcome, {username}!",
+        "rooms": [room_summary(room) for room in rooms],
+        "history": {"messages": history, "cursors": history_cursors(history, BOOTSTRAP_HISTORY_LIMIT)},
+        "undelivered": {"messages": envelopes, "has_more": has_more},
+    }, to=sid)
     
-    # Send chat history to new user
     try:
-        global_messages = get_global_messages_with_users(limit=20)
-        if global_messages:
-            await sio.emit("chat_history", {"messages": global_messages}, to=sid)
+        if last_ids:
+            await mark_private_messages_delivered(user_id, last_ids)
+        await update_user_last_seen(user_id)
     except Exception as e:
-        print(f"Error sending chat history: {e}")
-    
-    # Check for and deliver offline private messages
+        print(f"Error updating delivery state for {username}: {e}")
+
+def private_envelope(msg, username):
+    """Envelope for a stored private message addressed to username"""
+    if msg.get('message_type', 'text') == 'file':
+        # Content stays in the blob store; the client downloads it from /attachments/<file_id>
+        data = {
+            'file_id': msg.get('file_id'),
+            'filename': msg.get('filename') or 'unknown_file',
+        }
+        return wrap_message(msg.get('sender_username', 'Unknown'), username, 'file', data, msg.get('created_at', ''))
+    return wrap_message(msg.get('sender_username', 'Unknown'), username, 'text', msg.get('message', ''),
+                        msg.get('created_at', ''))
+
+async def next_undelivered_page(user_id, username):
+    """(envelopes, has_more, last_ids) for the next page of offline private messages.
+
+    Pass last_ids to mark_private_messages_delivered once the page is sent.
+    """
+    undelivered_messages = await get_undelivered_private_messages(user_id)
+    last_ids = {}
+    for msg in undelivered_messages:
+        last_ids[msg['inbox_uid']] = max(msg['id'], last_ids.get(msg['inbox_uid'], 0))
+    envelopes = [private_envelope(msg, username) for msg in undelivered_messages]
+    return envelopes, len(undelivered_messages) >= UNDELIVERED_PAGE_SIZE, last_ids
+
+@sio.event
+async def fetch_undelivered(sid, data=None):
+    """Deliver the next page of offline private messages"""
+    user_session = client_sessions.get(sid, {})
+    user_id = user_session.get('user_id')
+    if not user_id:
+        await delivery.emit("server_message", {"text from server": "Not authenticated"}, to=sid)
+        return
     try:
-        # Get user's last seen timestamp and undelivered messages
-        undelivered_messages = get_undelivered_private_messages(user_id)
-        if undelivered_messages:
-            await sio.emit("server_message", 
-                           {"text from server": f"You have {len(undelivered_messages)} undelivered private messages!"},
-                           to=sid)
-            
-            # Send each undelivered message
-            for msg in undelivered_messages:
-                sender_name = msg.get('sender_username', 'Unknown')
-                message_type = msg.get('message_type', 'text')
-                
-                if message_type == 'file':
-                    # Handle file messages
-                    file_data = {
-                        'filename': msg.get('filename', 'unknown_file'),
-                        'blob': msg.get('blob', '')
-                    }
-                    envelope = {
-                        'sender_name': sender_name,
-                        'receiver_name': username,
-                        'type': 'file',
-                        'data': file_data,
-                        'timestamp': msg.get('created_at', '')
-                    }
-                else:
-                    # Handle text messages
-                    envelope = {
-                        'sender_name': sender_name,
-                        'receiver_name': username,
-                        'type': 'text',
-                        'data': msg.get('message', ''),
-                        'timestamp': msg.get('created_at', '')
-                    }
-                
-                await sio.emit("private_message", envelope, to=sid)
-        
-        # Update user's last seen timestamp
-        update_user_last_seen(user_id)
-        
+        envelopes, has_more, last_ids = await next_undelivered_page(user_id, user_session.get('username'))
+        # Client keeps pulling pages while has_more is set
+        await delivery.emit("undelivered_messages", {"messages": envelopes, "has_more": has_more}, to=sid)
+        if last_ids:
+            await mark_private_messages_delivered(user_id, last_ids)
     except Exception as e:
         print(f"Error delivering offline messages: {e}")
-    
-    # Send welcome message
-    await sio.emit("server_message", 
-                   {"text from server": f"Welcome, {username}!"},
-                   to=sid)
-    
-    # Send authentication status
-    await sio.emit("auth_status", {
-        "authenticated": True,
-        "username": username,
-        "is_anonymous": is_anonymous
-    }, to=sid)
 
-# Remove the old username event handler since auth is handled in connect
 
 
 # Global chat – now with background topic analysis and message copying
 @sio.event
+@rate_limited('chat_message', event_rate_keys, notify_rate_limited)
 async def chat_message(sid, data):
     sender = connected_clients.get(sid, "Unknown")
     msg_type = data.get("type", "")
@@ -262,7 +329,7 @@ async def chat_message(sid, data):
     user_session = client_sessions.get(sid, {})
     user_id = user_session.get('user_id')
     if not user_id:
-        user_id = get_or_create_user(sender, is_anonymous=user_session.get('is_anonymous', True))
+        user_id = await get_or_create_user(sender, is_anonymous=user_session.get('is_anonymous', True))
         client_sessions[sid]['user_id'] = user_id
 
     # ALWAYS send message immediately to global chat first (no delays)
@@ -270,10 +337,10 @@ async def chat_message(sid, data):
     
     if msg_type == "text":
         # Save to global chat immediately
-        save_global_message(user_id, content, "text")
+        await save_global_message(user_id, content, "text")
         
         # Send to global chat immediately
-        await sio.emit("chat_message", envelope)
+        await delivery.emit("chat_message", envelope)
         
         # Always do topic analysis in background (non-blocking) for every message
         sio.start_background_task(analyze_and_copy_to_topic_room, sid, user_id, sender, content, ts)
@@ -285,13 +352,12 @@ async def chat_message(sid, data):
                 file_data = content
                 filename = file_data.get("filename", "unknown")
                 blob = file_data.get("blob", "")
-                file_size = len(blob) if blob else 0
-                file_id = save_file_attachment(filename, blob, file_size)
-                save_global_message(user_id, f"[FILE: {filename}]", "file", file_id)
+                file_id = await save_file_attachment(filename, blob)
+                await save_global_message(user_id, f"[FILE: {filename}]", "file", file_id)
         except Exception as e:
             print(f"Error saving global message: {e}")
         
-        await sio.emit("chat_message", envelope)
+        await delivery.emit("chat_message", envelope)
 
 async def analyze_and_copy_to_topic_room(sid, user_id, sender, content, ts):
     """Background task to analyze message and copy to topic room if needed"""
@@ -390,26 +456,26 @@ async def handle_analysis_result(future, task_data):
             topic_room = f"topic:{topic}"
             
             # Check if topic room exists, else create
-            room_id = get_room_by_name(topic_room)
+            room_id = await get_room_by_name(topic_room)
             if not room_id:
                 # Create topic room with a detailed description
                 description = f"Auto-created room for discussing {topic}. Messages are copied here when users have {topic_analyzer.consecutive_threshold} consecutive messages about {topic}."
-                room_id = create_new_room(topic_room, description, is_adventure=False)
+                room_id = await create_new_room(topic_room, description, is_adventure=False)
 
             # Auto-join user to topic room if not already in it
-            if not is_user_in_room(user_id, room_id):
-                add_user_to_room(user_id, room_id)
+            if not await is_user_in_room(user_id, room_id):
+                await add_user_to_room(user_id, room_id)
                 await sio.enter_room(sid, topic_room)
                 print(f"Auto-joined {sender} to {topic_room}")
 
             # Copy message to topic room (don't move user, just copy the message)
-            save_room_message(room_id, user_id, content, "text")
+            await save_room_message(room_id, user_id, content, "text")
 
             # Build envelope for topic room with correct sender name
             envelope = wrap_message(sender, topic_room, "text", content, ts)
             
             # Send to everyone in the topic room EXCEPT the original sender (skip_sid)
-            await sio.emit("room_message", envelope, room=topic_room, skip_sid=sid)
+            await delivery.emit("room_message", envelope, room=topic_room, skip_sid=sid)
 
             # Only notify user once when they first start talking about a topic or after cooldown
             # Check if this is the first message that triggered the topic copy
@@ -420,7 +486,7 @@ async def handle_analysis_result(future, task_data):
             if (consecutive_count == topic_analyzer.consecutive_threshold and 
                 current_time - last_notification >= TOPIC_NOTIFICATION_COOLDOWN):
                 topic_notifications[notification_key] = current_time
-                await sio.emit("server_message", {
+                await delivery.emit("server_message", {
                     "text from server": f"🔗 Your messages about {topic} are being copied to {topic_room}"
                 }, to=sid)
             
@@ -429,6 +495,7 @@ async def handle_analysis_result(future, task_data):
 
 # Private message to one user
 @sio.event
+@rate_limited('private_message', event_rate_keys, notify_rate_limited)
 async def private_message(sid, data):
     sender = connected_clients.get(sid, "Unknown")
     target = data.get("receiver_name")
@@ -445,30 +512,63 @@ async def private_message(sid, data):
     envelope = wrap_message(sender, target, msg_type, content, ts)
     
     # Save to database
+    receipt = None
     try:
-        sender_id = get_or_create_user(sender)
-        target_id = get_or_create_user(target)
-        inbox_uid = get_or_create_inbox(sender_id, target_id)
+        sender_id = await get_or_create_user(sender)
+        target_id = await get_or_create_user(target)
+        inbox_uid = await get_or_create_inbox(sender_id, target_id)
+        saved = None
         if msg_type == "text":
-            save_private_message(inbox_uid, sender_id, content, "text")
+            saved = await save_private_message(inbox_uid, sender_id, content, "text")
         elif msg_type == "file":
             file_data = content
             filename = file_data.get("filename", "unknown")
             blob = file_data.get("blob", "")
-            file_size = len(blob) if blob else 0
-            
-            file_id = save_file_attachment(filename, blob, file_size)
-            save_private_message(inbox_uid, sender_id, f"[FILE: {filename}]", "file", file_id)
+            file_id = await save_file_attachment(filename, blob)
+            saved = await save_private_message(inbox_uid, sender_id, f"[FILE: {filename}]", "file", file_id)
+        if saved is not None:
+            # Move the target's cursor past this message only once the writer has sent it;
+            # if the queue is discarded it stays undelivered and comes back as offline mail.
+            # The id is the journal future's result, so the emit doesn't wait for the commit.
+            receipt = ("private_delivered", (target_id, inbox_uid, saved))
     except Exception as e:
         print(f"Error saving private message: {e}")
     
-    await sio.emit("private_message", envelope, to=target_sid)
+    await delivery.emit("private_message", envelope, to=target_sid, receipt=receipt)
+
+async def private_delivered(user_id, inbox_uid, message_id):
+    await mark_private_messages_delivered(user_id, {inbox_uid: message_id})
 
-# List users (unchanged)
+delivery.register_receipt("private_delivered", private_delivered)
+
+# Full user list, for clients that don't track presence_delta
 @sio.event
 async def get_users(sid):
-    user_list = list(connected_clients.values())
-    await sio.emit("users_list", {"users": user_list}, to=sid)
+    await delivery.emit("users_list", {"users": presence.users()}, to=sid)
+
+@sio.event
+async def get_presence(sid, data=None):
+    """Changes since data['since'], or a snapshot page of online users after data['after'].
+
+    A since version the change log no longer covers gets the first snapshot page.
+    """
+    data = data or {}
+    since = data.get('since')
+    if since is not None:
+        try:
+            changes = presence.changes_since(int(since))
+        except (TypeError, ValueError):
+            changes = None
+        if changes is not None:
+            await delivery.emit("presence_delta", changes, to=sid)
+            return
+    try:
+        limit = max(1, min(int(data.get('limit', PRESENCE_PAGE_SIZE)), MAX_PRESENCE_PAGE_SIZE))
+    except (TypeError, ValueError):
+        limit = PRESENCE_PAGE_SIZE
+    after = data.get('after') if since is None else None
+    after = str(after) if after else None
+    await delivery.emit("presence_snapshot", presence.snapshot(after, limit), to=sid)
 
 # Create a new room
 @sio.event
@@ -477,40 +577,40 @@ async def create_room(sid, data):
     description = data.get("description", "")
     
     if not room_name:
-        await sio.emit("server_message", {"text from server": "Room name required"}, to=sid)
+        await delivery.emit("server_message", {"text from server": "Room name required"}, to=sid)
         return
     
     username = connected_clients.get(sid)
     if not username:
-        await sio.emit("server_message", {"text from server": "Not authenticated"}, to=sid)
+        await delivery.emit("server_message", {"text from server": "Not authenticated"}, to=sid)
         return
     
     try:
         # Check if room already exists
-        if get_room_by_name(room_name):
-            await sio.emit("server_message", {"text from server": f"Room '{room_name}' already exists"}, to=sid)
+        if await get_room_by_name(room_name):
+            await delivery.emit("server_message", {"text from server": f"Room '{room_name}' already exists"}, to=sid)
             return
         
         # Create the room
-        room_id = create_new_room(room_name, description, is_adventure=False)
+        room_id = await create_new_room(room_name, description, is_adventure=False)
         
         # Get user ID
         user_session = client_sessions.get(sid, {})
         user_id = user_session.get('user_id')
         if not user_id:
-            user_id = get_or_create_user(username, is_anonymous=user_session.get('is_anonymous', True))
+            user_id = await get_or_create_user(username, is_anonymous=user_session.get('is_anonymous', True))
             client_sessions[sid]['user_id'] = user_id
         
         # Add creator to the room
-        add_user_to_room(user_id, room_id)
+        await add_user_to_room(user_id, room_id)
         await sio.enter_room(sid, room_name)
         
         print(f"User {username} created and joined room '{room_name}'")
-        await sio.emit("server_message", {"text from server": f"Created and joined room '{room_name}'"}, to=sid)
+        await delivery.emit("server_message", {"text from server": f"Created and joined room '{room_name}'"}, to=sid)
         
     except Exception as e:
         print(f"Error creating room {room_name}: {e}")
-        await sio.emit("server_message", {"text from server": f"Error creating room '{room_name}'"}, to=sid)
+        await delivery.emit("server_message", {"text from server": f"Error creating room '{room_name}'"}, to=sid)
 
 # Join/leave rooms with persistence
 @sio.event
@@ -519,13 +619,13 @@ async def join_room(sid, data):
     if room:
         username = connected_clients.get(sid)
         if not username:
-            await sio.emit("server_message", {"text from server": "Not authenticated"}, to=sid)
+            await delivery.emit("server_message", {"text from server": "Not authenticated"}, to=sid)
             return
         
         # Check if room exists first
-        room_id = get_room_by_name(room)
+        room_id = await get_room_by_name(room)
         if not room_id:
-            await sio.emit("server_message", {"text from server": f"Room '{room}' does not exist. Use /newroom {room} <description> to create it."}, to=sid)
+            await delivery.emit("server_message", {"text from server": f"Room '{room}' does not exist. Use /newroom {room} <description> to create it."}, to=sid)
             return
         
         # Get user and room IDs
@@ -533,11 +633,11 @@ async def join_room(sid, data):
             user_session = client_sessions.get(sid, {})
             user_id = user_session.get('user_id')
             if not user_id:
-                user_id = get_or_create_user(username, is_anonymous=user_session.get('is_anonymous', True))
+                user_id = await get_or_create_user(username, is_anonymous=user_session.get('is_anonymous', True))
                 client_sessions[sid]['user_id'] = user_id
             
             # Add user to room in database
-            add_user_to_room(user_id, room_id)
+            await add_user_to_room(user_id, room_id)
             
             # Add user to Socket.IO room
             await sio.enter_room(sid, room)
@@ -545,15 +645,15 @@ async def join_room(sid, data):
             print(f"User {username} joined room {room}")
             
             # Send room history to newly joined user
-            room_messages = get_room_messages_with_users(room_id, limit=20)
+            room_messages = await get_room_messages_with_users(room_id, limit=20)
             if room_messages:
-                await sio.emit("room_history", {"room": room, "messages": room_messages}, to=sid)
+                await delivery.emit("room_history", {"room": room, "messages": room_messages}, to=sid)
                 
-            await sio.emit("server_message", {"text from server": f"Joined room '{room}'"}, to=sid)
+            await delivery.emit("server_message", {"text from server": f"Joined room '{room}'"}, to=sid)
             
         except Exception as e:
             print(f"Error joining room {room}: {e}")
-            await sio.emit("server_message", {"text from server": f"Error joining room '{room}'"}, to=sid)
+            await delivery.emit("server_message", {"text from server": f"Error joining room '{room}'"}, to=sid)
 
 @sio.event
 async def leave_room(sid, data):
@@ -561,33 +661,41 @@ async def leave_room(sid, data):
     if room:
         username = connected_clients.get(sid)
         if not username:
-            await sio.emit("server_message", {"text from server": "Not authenticated"}, to=sid)
+            await delivery.emit("server_message", {"text from server": "Not authenticated"}, to=sid)
             return
         
         try:
             user_session = client_sessions.get(sid, {})
             user_id = user_session.get('user_id')
             if not user_id:
-                user_id = get_or_create_user(username, is_anonymous=user_session.get('is_anonymous', True))
+                user_id = await get_or_create_user(username, is_anonymous=user_session.get('is_anonymous', True))
                 client_sessions[sid]['user_id'] = user_id
             
-            room_id = get_room_by_name(room)
+            room_id = await get_room_by_name(room)
             if not room_id:
-                await sio.emit("server_message", {"text from server": f"Room '{room}' does not exist"}, to=sid)
+                await delivery.emit("server_message", {"text from server": f"Room '{room}' does not exist"}, to=sid)
                 return
             
             # Remove user from room in database
-            remove_user_from_room(user_id, room_id)
+            await remove_user_from_room(user_id, room_id)
             
             # Remove user from Socket.IO room
             await sio.leave_room(sid, room)
             
             print(f"User {username} left room {room}")
-            await sio.emit("server_message", {"text from server": f"Left room '{room}'"}, to=sid)
+            await delivery.emit("server_message", {"text from server": f"Left room '{room}'"}, to=sid)
             
         except Exception as e:
             print(f"Error leaving room {room}: {e}")
-            await sio.emit("server_message", {"text from server": f"Error leaving room '{room}'"}, to=sid)
+            await delivery.emit("server_message", {"text from server": f"Error leaving room '{room}'"}, to=sid)
+
+def room_summary(room):
+    return {
+        "name": room['name'],
+        "description": room['description'] or "No description",
+        "member_count": room['member_count'] or 0,
+        "last_activity_at": room['last_activity_at']
+    }
 
 # Return rooms joined from database
 @sio.event
@@ -595,28 +703,61 @@ async def check_rooms(sid):
     try:
         username = connected_clients.get(sid)
         if not username:
-            await sio.emit("room_list", {"rooms": []}, to=sid)
+            await delivery.emit("room_list", {"rooms": []}, to=sid)
             return
         
         user_session = client_sessions.get(sid, {})
         user_id = user_session.get('user_id')
         if not user_id:
-            user_id = get_or_create_user(username, is_anonymous=user_session.get('is_anonymous', True))
+            user_id = await get_or_create_user(username, is_anonymous=user_session.get('is_anonymous', True))
             client_sessions[sid]['user_id'] = user_id
         
-        user_rooms = get_user_rooms(user_id)
+        user_rooms = await get_user_rooms(user_id)
+        # Most recently active first; rooms that never had a message go last
+        user_rooms.sort(key=lambda room: room['last_activity_at'] or '', reverse=True)
         # Send full room information including descriptions
-        rooms_with_descriptions = [
-            {
-                "name": room['name'],
-                "description": room['description'] or "No description"
-            }
-            for room in user_rooms
-        ]
-        await sio.emit("room_list", {"rooms": rooms_with_descriptions}, to=sid)
+        rooms_with_descriptions = [room_summary(room) for room in user_rooms]
+        await delivery.emit("room_list", {"rooms": rooms_with_descriptions}, to=sid)
     except Exception as e:
         print(f"Error getting rooms for user: {e}")
-        await sio.emit("room_list", {"rooms": []}, to=sid)
+        await delivery.emit("room_list", {"rooms": []}, to=sid)
+
+ROOM_DIRECTORY_PAGE = 100
+
+# Browse every room, busiest or most recently active first
+@sio.event
+async def get_room_directory(sid, data=None):
+    """List rooms with member counts and recent activity from the maintained room_stats"""
+    user_id = client_sessions.get(sid, {}).get('user_id')
+    if not user_id:
+        await delivery.emit("room_directory", {"rooms": []}, to=sid)
+        return
+    data = data or {}
+    order = data.get("order", "activity")
+    if order not in ROOM_DIRECTORY_ORDERS:
+        await delivery.emit("server_message", {"text from server": f"Order must be one of: {', '.join(ROOM_DIRECTORY_ORDERS)}"}, to=sid)
+        return
+    # Keyset cursor: [sort_key, id] of the previous page's last room (next_after)
+    after = data.get("after")
+    if after is not None:
+        key_type = int if order == "members" else str
+        if (not isinstance(after, (list, tuple)) or len(after) != 2
+                or not (after[0] is None or (isinstance(after[0], key_type) and not isinstance(after[0], bool)))
+                or not isinstance(after[1], int) or isinstance(after[1], bool)):
+            await delivery.emit("server_message", {"text from server": "after must be [sort_key, room id] from next_after"}, to=sid)
+            return
+        after = tuple(after)
+    try:
+        limit = max(1, min(int(data.get("limit", ROOM_DIRECTORY_PAGE)), MAX_ROOM_DIRECTORY_PAGE))
+        rooms = await get_room_directory_db(user_id, order, limit, after)
+        await delivery.emit("room_directory", {
+            "rooms": rooms,
+            "order": order,
+            "next_after": [rooms[-1]["sort_key"], rooms[-1]["id"]] if len(rooms) >= limit else None
+        }, to=sid)
+    except Exception as e:
+        print(f"Error listing room directory: {e}")
+        await delivery.emit("room_directory", {"rooms": []}, to=sid)
 
 # Get list of private message conversations
 @sio.event
@@ -625,20 +766,43 @@ async def get_pm_list(sid):
     try:
         username = connected_clients.get(sid)
         if not username:
-            await sio.emit("pm_list", {"conversations": []}, to=sid)
+            await delivery.emit("pm_list", {"conversations": []}, to=sid)
             return
         
         user_session = client_sessions.get(sid, {})
         user_id = user_session.get('user_id')
         if not user_id:
-            user_id = get_or_create_user(username, is_anonymous=user_session.get('is_anonymous', True))
+            user_id = await get_or_create_user(username, is_anonymous=user_session.get('is_anonymous', True))
             client_sessions[sid]['user_id'] = user_id
         
-        conversations = get_user_inboxes(user_id)
-        await sio.emit("pm_list", {"conversations": conversations}, to=sid)
+        conversations = await get_user_inboxes(user_id)
+        await delivery.emit("pm_list", {"conversations": conversations}, to=sid)
     except Exception as e:
         print(f"Error getting PM list for user: {e}")
-        await sio.emit("pm_list", {"conversations": []}, to=sid)
+        await delivery.emit("pm_list", {"conversations": []}, to=sid)
+
+@sio.event
+async def mark_pm_read(sid, data):
+    """Clear the unread count for a conversation the user is looking at"""
+    user_session = client_sessions.get(sid, {})
+    user_id = user_session.get('user_id')
+    target = (data or {}).get("username")
+    if not user_id or not target:
+        return
+    try:
+        other_user_id = await get_or_create_user(target, is_anonymous=True)
+        await mark_inbox_read(user_id, await get_or_create_inbox(user_id, other_user_id))
+    except Exception as e:
+        print(f"Error marking conversation with {target} read: {e}")
+
+MAX_HISTORY_PAGE = 200
+
+def history_cursors(messages, limit):
+    """Keyset cursors for a newest-first history page"""
+    return {
+        "before_id": messages[-1]['id'] if len(messages) >= limit else None,
+        "after_id": messages[0]['id'] if messages else None
+    }
 
 # Get chat history
 @sio.event
@@ -647,19 +811,35 @@ async def get_chat_history(sid, data=None):
     try:
         # If no data provided, get global history (backward compatibility)
         if not data:
-            global_messages = get_global_messages_with_users(limit=50)
-            await sio.emit("chat_history", {"messages": global_messages, "type": "global"}, to=sid)
+            global_messages = await get_global_messages_with_users(limit=50)
+            await delivery.emit("chat_history", {"messages": global_messages, "type": "global"}, to=sid)
             return
         
         history_type = data.get("type", "global")
         target = data.get("target", "")
-        limit = data.get("limit", 50)
+        limit = max(1, min(int(data.get("limit", 50)), MAX_HISTORY_PAGE))
+        # Optional keyset cursors for scrolling back (before_id) or catching up (after_id)
+        page = {}
+        for key in ("before_id", "after_id"):
+            value = data.get(key)
+            if value is not None:
+                try:
+                    # bool is an int subclass, and SQLite sorts text above every integer
+                    if isinstance(value, bool):
+                        raise ValueError
+                    value = int(value)
+                except (TypeError, ValueError):
+                    value = -1
+                if value < 0:
+                    await delivery.emit("server_message", {"text from server": f"{key} must be a non-negative integer"}, to=sid)
+                    return
+            page[key] = value
         
         if history_type == "room":
             # Get room history
-            room_id = get_room_by_name(target)
+            room_id = await get_room_by_name(target)
             if not room_id:
-                await sio.emit("server_message", {"text from server": f"Room '{target}' not found"}, to=sid)
+                await delivery.emit("server_message", {"text from server": f"Room '{target}' not found"}, to=sid)
                 return
                 
             # Check if user is in the room
@@ -667,61 +847,98 @@ async def get_chat_history(sid, data=None):
             if username:
                 user_session = client_sessions.get(sid, {})
                 user_id = user_session.get('user_id')
-                if user_id and not is_user_in_room(user_id, room_id):
-                    await sio.emit("server_message", {"text from server": f"You are not in room '{target}'"}, to=sid)
+                if user_id and not await is_user_in_room(user_id, room_id):
+                    await delivery.emit("server_message", {"text from server": f"You are not in room '{target}'"}, to=sid)
                     return
             
-            room_messages = get_room_messages_with_users(room_id, limit=limit)
-            await sio.emit("room_history", {"room": target, "messages": room_messages}, to=sid)
+            room_messages = await get_room_messages_with_users(room_id, limit=limit, **page)
+            await delivery.emit("room_history", {"room": target, "messages": room_messages,
+                                            "cursors": history_cursors(room_messages, limit)}, to=sid)
             
         elif history_type == "private" or history_type == "pm":
             # Get private message history
             username = connected_clients.get(sid)
             if not username:
-                await sio.emit("server_message", {"text from server": "Not authenticated"}, to=sid)
+                await delivery.emit("server_message", {"text from server": "Not authenticated"}, to=sid)
                 return
             
             user_session = client_sessions.get(sid, {})
             user_id = user_session.get('user_id')
             if not user_id:
-                user_id = get_or_create_user(username, is_anonymous=user_session.get('is_anonymous', True))
+                user_id = await get_or_create_user(username, is_anonymous=user_session.get('is_anonymous', True))
                 client_sessions[sid]['user_id'] = user_id
             
             # Get the other user ID
-            other_user_id = get_or_create_user(target, is_anonymous=True)
+            other_user_id = await get_or_create_user(target, is_anonymous=True)
             
             # Get or create inbox between users
-            inbox_uid = get_or_create_inbox(user_id, other_user_id)
+            inbox_uid = await get_or_create_inbox(user_id, other_user_id)
             
             # Get private messages
-            private_messages = get_private_messages_with_users(inbox_uid, limit=limit)
-            await sio.emit("private_history", {"username": target, "messages": private_messages}, to=sid)
+            private_messages = await get_private_messages_with_users(inbox_uid, limit=limit, **page)
+            if page["before_id"] is None:
+                # Opening (or catching up on) the conversation clears its unread count
+                await mark_inbox_read(user_id, inbox_uid)
+            await delivery.emit("private_history", {"username": target, "messages": private_messages,
+                                               "cursors": history_cursors(private_messages, limit)}, to=sid)
             
         elif history_type == "adventure":
             # Get adventure history
             try:
                 adventure_id = int(target)
-                adventure_messages = get_adventure_messages_with_users(adventure_id, limit=limit)
-                await sio.emit("adventure_history", {"adventure_id": adventure_id, "messages": adventure_messages}, to=sid)
+                adventure_messages = await get_adventure_messages_with_users(adventure_id, limit=limit, **page)
+                await delivery.emit("adventure_history", {"adventure_id": adventure_id, "messages": adventure_messages,
+                                                     "cursors": history_cursors(adventure_messages, limit)}, to=sid)
             except (ValueError, TypeError):
-                await sio.emit("server_message", {"text from server": f"Invalid adventure ID: '{target}'"}, to=sid)
+                await delivery.emit("server_message", {"text from server": f"Invalid adventure ID: '{target}'"}, to=sid)
                 
         else:
             # Default to global history
-            global_messages = get_global_messages_with_users(limit=limit)
-            await sio.emit("chat_history", {"messages": global_messages, "type": "global"}, to=sid)
+            global_messages = await get_global_messages_with_users(limit=limit, **page)
+            await delivery.emit("chat_history", {"messages": global_messages, "type": "global",
+                                            "cursors": history_cursors(global_messages, limit)}, to=sid)
             
     except Exception as e:
         print(f"Error sending chat history: {e}")
-        await sio.emit("server_message", {"text from server": "Error retrieving chat history"}, to=sid)
+        await delivery.emit("server_message", {"text from server": "Error retrieving chat history"}, to=sid)
+
+# Full-text search over conversations the user can see
+@sio.event
+async def search_messages(sid, data):
+    """Search message history; results are scoped to the caller's rooms, inboxes and adventures"""
+    user_session = client_sessions.get(sid, {})
+    user_id = user_session.get('user_id')
+    if not user_id:
+        await delivery.emit("server_message", {"text from server": "Not authenticated"}, to=sid)
+        return
+    
+    query = (data or {}).get("query", "").strip()
+    if not query:
+        await delivery.emit("server_message", {"text from server": "Search query required"}, to=sid)
+        return
+    
+    try:
+        limit = max(1, min(int(data.get("limit", 20)), 50))
+        offset = max(0, int(data.get("offset", 0)))
+        results = await search_messages_db(user_id, query, limit=limit, offset=offset)
+        await delivery.emit("search_results", {
+            "query": query,
+            "results": results,
+            "offset": offset,
+            "next_offset": offset + limit if len(results) >= limit else None
+        }, to=sid)
+    except Exception as e:
+        print(f"Error searching messages: {e}")
+        await delivery.emit("server_message", {"text from server": "Error searching messages"}, to=sid)
 
 # Room broadcast with membership verification
 @sio.event
+@rate_limited('room_message', event_rate_keys, notify_rate_limited)
 async def room_message(sid, data):
     sender = connected_clients.get(sid, "Unknown")
     room = data.get("receiver_name")
     if not room:
-        await sio.emit("server_message",
+        await delivery.emit("server_message",
                        {"text from server": "Room not specified!"},
                        to=sid)
         return
@@ -731,25 +948,25 @@ async def room_message(sid, data):
         user_session = client_sessions.get(sid, {})
         user_id = user_session.get('user_id')
         if not user_id:
-            user_id = get_or_create_user(sender, is_anonymous=user_session.get('is_anonymous', True))
+            user_id = await get_or_create_user(sender, is_anonymous=user_session.get('is_anonymous', True))
             client_sessions[sid]['user_id'] = user_id
         
-        room_id = get_room_by_name(room)
+        room_id = await get_room_by_name(room)
         if not room_id:
-            await sio.emit("server_message",
+            await delivery.emit("server_message",
                            {"text from server": f"Room '{room}' does not exist. Use /newroom {room} <description> to create it."},
                            to=sid)
             return
         
-        if not is_user_in_room(user_id, room_id):
-            await sio.emit("server_message",
+        if not await is_user_in_room(user_id, room_id):
+            await delivery.emit("server_message",
                            {"text from server": f"You are not in room '{room}'. Use /join {room} first."},
                            to=sid)
             return
             
     except Exception as e:
         print(f"Error checking room membership: {e}")
-        await sio.emit("server_message",
+        await delivery.emit("server_message",
                        {"text from server": f"Error accessing room '{room}'"},
                        to=sid)
         return
@@ -762,20 +979,18 @@ async def room_message(sid, data):
     # Save to database
     try:
         if msg_type == "text":
-            save_room_message(room_id, user_id, content, "text")
+            await save_room_message(room_id, user_id, content, "text")
         elif msg_type == "file":
             file_data = content
             filename = file_data.get("filename", "unknown")
             blob = file_data.get("blob", "")
-            file_size = len(blob) if blob else 0
-            
-            file_id = save_file_attachment(filename, blob, file_size)
-            save_room_message(room_id, user_id, f"[FILE: {filename}]", "file", file_id)
+            file_id = await save_file_attachment(filename, blob)
+            await save_room_message(room_id, user_id, f"[FILE: {filename}]", "file", file_id)
     except Exception as e:
         print(f"Error saving room message: {e}")
     
     # Send to everyone in the room including the sender
-    await sio.emit("room_message", envelope, room=room)
+    await delivery.emit("room_message", envelope, room=room)
 
 # D&D Adventure Events
 @sio.event
@@ -810,6 +1025,8 @@ async def disconnect(sid):
     try:
         username = connected_clients.pop(sid, "Unknown")
         client_sessions.pop(sid, None)
+        presence.disconnect(sid)
+        delivery.close(sid)
         print(f"Client {sid} ({username}) disconnected")
         
         # Adventure handler cleanup
@@ -827,19 +1044,49 @@ async def send_messages():
             # Disconnect all clients
             for sid in list(connected_clients.keys()):
                 await sio.disconnect(sid)
+            # Stop the app like Ctrl-C would; on_cleanup drains and closes storage
+            signal.raise_signal(signal.SIGINT)
             break
-        await sio.emit("server_message", {"text from server": msg})
+        await delivery.emit("server_message", {"text from server": msg})
+
+async def close_storage():
+    # Drain queued message writes before closing the connections they use
+    await asyncio.to_thread(close_message_journals)
+    await asyncio.to_thread(close_all_journals)
+    shutdown_db_executor()
+    shutdown_maintenance()
+    shutdown_password_pool()
+    close_all_connections()
 
 
 async def on_startup(app):
+    if broker_client:
+        # Presence and emits need the broker before the first client connects
+        await broker_client.start()
+    delivery.start()
     # Initialize topic analyzer
     await topic_analyzer.initialize()
     # Start the topic analysis queue processor
     sio.start_background_task(process_topic_analysis_queue)
-    # This schedules send_messages() in the background
-    sio.start_background_task(send_messages)
+    # This schedules send_messages() in the background; workers have no console
+    if not IS_WORKER:
+        sio.start_background_task(send_messages)
+    if IS_PRIMARY:
+        # Archive expired messages and compact the database during off-peak hours
+        sio.start_background_task(retention_loop)
+        # Checkpoint the WALs and refresh planner statistics off the request path
+        sio.start_background_task(maintenance_loop)
+    # Start the bcrypt workers before the first login needs one
+    start_password_pool()
+
+async def on_cleanup(app):
+    # Runs on Ctrl-C, the console "exit" and the supervisor's SIGTERM alike
+    await close_storage()
+    if broker_client:
+        await broker_client.close()
 
 app.on_startup.append(on_startup)
+app.on_cleanup.append(on_cleanup)
 
 # Topic-related events
 @sio.event
@@ -849,61 +1096,61 @@ async def get_topic_stats(sid):
         user_session = client_sessions.get(sid, {})
         user_id = user_session.get('user_id')
         if not user_id:
-            await sio.emit("server_message", {"text from server": "Not authenticated"}, to=sid)
+            await delivery.emit("server_message", {"text from server": "Not authenticated"}, to=sid)
             return
         
         stats = topic_analyzer.get_user_topic_stats(str(user_id))
         if stats:
-            await sio.emit("topic_stats", stats, to=sid)
+            await delivery.emit("topic_stats", stats, to=sid)
         else:
-            await sio.emit("server_message", {"text from server": "No topic statistics available yet"}, to=sid)
+            await delivery.emit("server_message", {"text from server": "No topic statistics available yet"}, to=sid)
     except Exception as e:
         print(f"Error getting topic stats: {e}")
-        await sio.emit("server_message", {"text from server": "Error retrieving topic statistics"}, to=sid)
+        await delivery.emit("server_message", {"text from server": "Error retrieving topic statistics"}, to=sid)
 
 @sio.event
 async def join_topic_room(sid, data):
     """Manually join a topic room"""
     topic = data.get("topic")
     if not topic:
-        await sio.emit("server_message", {"text from server": "Topic name required"}, to=sid)
+        await delivery.emit("server_message", {"text from server": "Topic name required"}, to=sid)
         return
     
     username = connected_clients.get(sid)
     if not username:
-        await sio.emit("server_message", {"text from server": "Not authenticated"}, to=sid)
+        await delivery.emit("server_message", {"text from server": "Not authenticated"}, to=sid)
         return
     
     try:
         topic_room = f"topic:{topic}"
         
         # Check if topic room exists, else create
-        room_id = get_room_by_name(topic_room)
+        room_id = await get_room_by_name(topic_room)
         if not room_id:
             description = f"Topic room for discussing {topic}. Created manually by {username}."
-            room_id = create_new_room(topic_room, description, is_adventure=False)
+            room_id = await create_new_room(topic_room, description, is_adventure=False)
         
         # Get user ID
         user_session = client_sessions.get(sid, {})
         user_id = user_session.get('user_id')
         if not user_id:
-            user_id = get_or_create_user(username, is_anonymous=user_session.get('is_anonymous', True))
+            user_id = await get_or_create_user(username, is_anonymous=user_session.get('is_anonymous', True))
             client_sessions[sid]['user_id'] = user_id
         
         # Add user to topic room
-        add_user_to_room(user_id, room_id)
+        await add_user_to_room(user_id, room_id)
         await sio.enter_room(sid, topic_room)
         
-        await sio.emit("server_message", {"text from server": f"Manually joined {topic_room}"}, to=sid)
+        await delivery.emit("server_message", {"text from server": f"Manually joined {topic_room}"}, to=sid)
         
         # Send room history
-        room_messages = get_room_messages_with_users(room_id, limit=20)
+        room_messages = await get_room_messages_with_users(room_id, limit=20)
         if room_messages:
-            await sio.emit("room_history", {"room": topic_room, "messages": room_messages}, to=sid)
+            await delivery.emit("room_history", {"room": topic_room, "messages": room_messages}, to=sid)
             
     except Exception as e:
         print(f"Error joining topic room {topic}: {e}")
-        await sio.emit("server_message", {"text from server": f"Error joining topic room '{topic}'"}, to=sid)
+        await delivery.emit("server_message", {"text from server": f"Error joining topic room '{topic}'"}, to=sid)
 
 @sio.event
 async def clear_topic_history(sid):
@@ -912,16 +1159,23 @@ async def clear_topic_history(sid):
         user_session = client_sessions.get(sid, {})
         user_id = user_session.get('user_id')
         if not user_id:
-            await sio.emit("server_message", {"text from server": "Not authenticated"}, to=sid)
+            await delivery.emit("server_message", {"text from server": "Not authenticated"}, to=sid)
             return
         
         topic_analyzer.clear_user_history(str(user_id))
-        await sio.emit("server_message", {"text from server": "Topic history cleared"}, to=sid)
+        await delivery.emit("server_message", {"text from server": "Topic history cleared"}, to=sid)
     except Exception as e:
         print(f"Error clearing topic history: {e}")
-        await sio.emit("server_message", {"text from server": "Error clearing topic history"}, to=sid)
+        await delivery.emit("server_message", {"text from server": "Error clearing topic history"}, to=sid)
 
 #Run the web server
 if __name__ == "__main__":
-    web.run_app(app, host='127.0.0.1', port=8080)
+    # Initialize databases here, not at import: bcrypt pool processes re-import this
+    # module as __mp_main__. The supervisor runs this before starting any worker.
+    init_db()         # Chat database
+    init_auth_db()    # Authentication database
+    if WORKERS > 1 and not IS_WORKER:
+        run_supervisor(WORKERS)
+    else:
+        web.run_app(app, host='127.0.0.1', port=8080, reuse_port=IS_WORKER or None)
 
@@ -70,6 +70,24 @@ function scrollToBottom() {
    setTimeout(scrollToBottomImmediate, 50);
 }
 
+function escapeHtml(text) {
+   const div = document.createElement('div');
+   div.textContent = text == null ? '' : String(text);
+   return div.innerHTML.replace(/"/g, '&quot;');
+}
+
+// Download link for a file message: stored files are served from /attachments/<file_id>,
+// live ones that still carry their base64 blob are turned into an object URL
+function fileLink(file, color) {
+   const filename = file.filename || 'unknown_file';
+   let url = `/attachments/${encodeURIComponent(file.file_id)}`;
+   if (!file.file_id) {
+       const arr = atob(file.blob || '').split('').map(c => c.charCodeAt(0));
+       url = URL.createObjectURL(new Blob([new Uint8Array(arr)]));
+   }
+   return `<a href="${url}" download="${escapeHtml(filename)}" style="color: ${color}; text-decoration: underline;">${escapeHtml(filename)}</a>`;
+}
+
 function addMsg(html, cls='') {
    const messagesDiv = document.getElementById('messages');
    if (!messagesDiv) return;
@@ -85,23 +103,71 @@ function addMsg(html, cls='') {
    scrollToBottom();
 }
 
-function startUsersAutoRefresh() {
-   if (window.usersRefreshInterval) {
-       clearInterval(window.usersRefreshInterval);
+// Online users: a snapshot from get_presence (paged for large user lists),
+// then presence_delta events. A delta that doesn't start at our version means
+// we missed one, so we ask for the changes since our version; the server
+// answers with a fresh snapshot if its change log doesn't reach that far.
+const onlineUsers = {version: null, users: new Set(), after: null, paging: false, catchingUp: false};
+
+function onlineUserList() {
+   return Array.from(onlineUsers.users).sort();
+}
+
+function renderOnlineUsers() {
+   updateUsersOnlineDisplay(onlineUserList());
+}
+
+function requestPresence(since) {
+   if (!socket) return;
+   onlineUsers.after = null;
+   if (since === undefined || since === null) {
+       onlineUsers.paging = true;
+       socket.emit('get_presence', {});
+   } else {
+       onlineUsers.catchingUp = true;
+       socket.emit('get_presence', {since: since});
    }
+}
 
-   window.usersRefreshInterval = setInterval(() => {
-       if (socket && isConnected) {
-           socket.emit('get_users');
-       }
-   }, 30000); 
+function receivePresenceSnapshot(data) {
+   if (onlineUsers.after === null) {
+       onlineUsers.users = new Set();
+       onlineUsers.version = data.version;
+   }
+   onlineUsers.catchingUp = false;
+   (data.users || []).forEach(user => onlineUsers.users.add(user));
+   if (data.next_after) {
+       onlineUsers.paging = true;
+       onlineUsers.after = data.next_after;
+       socket.emit('get_presence', {after: data.next_after});
+       return;
+   }
+   onlineUsers.paging = false;
+   renderOnlineUsers();
+   if (data.version !== onlineUsers.version) {
+       // Later pages were read at a newer version; fetch what changed in between
+       requestPresence(onlineUsers.version);
+   }
 }
 
-function stopUsersAutoRefresh() {
-   if (window.usersRefreshInterval) {
-       clearInterval(window.usersRefreshInterval);
-       window.usersRefreshInterval = null;
+function receivePresenceDelta(data) {
+   if (onlineUsers.paging || onlineUsers.version === null) return;
+   if (data.from !== onlineUsers.version) {
+       if (!onlineUsers.catchingUp) {
+           requestPresence(onlineUsers.version);
+       }
+       return;
    }
+   onlineUsers.catchingUp = false;
+   (data.joined || []).forEach(user => onlineUsers.users.add(user));
+   (data.left || []).forEach(user => onlineUsers.users.delete(user));
+   onlineUsers.version = data.version;
+   renderOnlineUsers();
+}
+
+function showActiveUsers(users) {
+   logMessage(users.length ? `ACTIVE USERS: ${users.join(', ')}` : 'ACTIVE USERS: None', 'system-msg');
+   updateUsersOnlineDisplay(users);
 }
 
 function updateUsersOnlineDisplay(users) {
@@ -185,7 +251,7 @@ function showBBSMainMenu() {
     updateBBSTime();
 
     if (socket) {
-        socket.emit('get_users');
+        renderOnlineUsers();
         socket.emit('check_rooms');
 
         setTimeout(() => socket.emit('check_rooms'), 500);
@@ -194,7 +260,6 @@ function showBBSMainMenu() {
     updateAIStatus();
     initializeAIRoomsDisplay();
 
-    startUsersAutoRefresh();
 
     if (window.bbsTimeInterval) {
         clearInterval(window.bbsTimeInterval);
@@ -214,7 +279,6 @@ function hideBBSMainMenu() {
 
    mainInterface.offsetHeight; 
 
-   stopUsersAutoRefresh();
 
    initializeTerminal();
 
@@ -416,6 +480,9 @@ function executeCommand() {
    scrollToBottom();
 }
 
+// Keyset cursor of the last room directory page, for /directory more
+const roomDirectory = {order: 'activity', after: null};
+
 function processCommand(command) {
    if (!socket) return;
 
@@ -423,9 +490,15 @@ function processCommand(command) {
    const cmd = parts[0].toLowerCase();
 
    if (cmd === '/users') {
-       socket.emit('get_users');
+       showActiveUsers(onlineUserList());
    } else if (cmd === '/rooms') {
        socket.emit('check_rooms');
+   } else if (cmd === '/directory') {
+       if (parts[1] === 'more' && roomDirectory.after) {
+           socket.emit('get_room_directory', {order: roomDirectory.order, after: roomDirectory.after});
+       } else {
+           socket.emit('get_room_directory', {order: parts[1] || 'activity'});
+       }
    } else if (cmd === '/pm_list') {
        socket.emit('get_pm_list');
    } else if (cmd === '/history') {
@@ -457,6 +530,12 @@ function processCommand(command) {
        } else {
            logMessage('Usage: /history_pm <username>', 'system-msg');
        }
+   } else if (cmd === '/search') {
+       if (parts.length >= 2) {
+           socket.emit('search_messages', {query: parts.slice(1).join(' ')});
+       } else {
+           logMessage('Usage: /search <words>', 'system-msg');
+       }
    } else if (cmd === '/pm') {
        if (parts.length >= 3) {
            const user = parts[1];
@@ -640,10 +719,12 @@ function showHelp() {
 /adventureinfo <room_id> - GET ADVENTURE INFO
 /users - LIST ACTIVE USERS
 /rooms - LIST JOINED ROOMS
+/directory [activity|members|name|more] - BROWSE ALL ROOMS
 /pm_list - LIST PRIVATE MESSAGE CONVERSATIONS
 /history - GET GLOBAL CHAT HISTORY
 /history_room <room> - GET ROOM HISTORY
 /history_pm <user> - GET PRIVATE MESSAGE HISTORY
+/search <words> - SEARCH MESSAGE HISTORY
 /theme - CHANGE VISUAL THEME
 file - SEND FILE TO GLOBAL CHAT
 
@@ -1336,24 +1417,17 @@ function handleLoginSuccess(usernameFromServer, isAnonymous) {
 function connectToServer() {
    logMessage('ESTABLISHING CONNECTION...', 'system-msg');
 
-   socket = io('http://localhost:8080');
+   // Websocket only: worker processes sharing the port can't serve sticky long-polling
+   socket = io('http://localhost:8080', {transports: ['websocket']});
 
    socket.on('connect', () => {
        isConnected = true;
        updateConnectionStatus(true, username);
        logMessage('CONNECTION ESTABLISHED TO BBS NETWORK', 'server-msg');
 
-       socket.emit('set_username', {
-           username: username,
-           is_anonymous: currentUser.is_anonymous
-       });
-
-       socket.emit('get_users');
-       socket.emit('check_rooms');
-
-       if (document.getElementById('bbsMainMenu').style.display === 'block') {
-           startUsersAutoRefresh();
-       }
+       // The server authenticates the socket from the session cookie and sends
+       // rooms, history and offline messages in one session_bootstrap packet
+       requestPresence();
    });
 
    socket.on('server_message', (data) => {
@@ -1366,18 +1440,41 @@ function connectToServer() {
        }
    });
 
-   socket.on('rooms_restored', (data) => {
-       if (data.rooms && data.rooms.length > 0) {
-           logMessage(`[SYSTEM]: RESTORED TO ROOMS: ${data.rooms.join(', ')}`, 'server-msg');
+   // Hand a bootstrap section to the listeners registered for the standalone event
+   const dispatchLocal = (event, data) => socket.listeners(event).forEach(listener => listener(data));
+
+   // Offline private messages arrive in pages; pull the next one until drained
+   const receiveUndelivered = (page) => {
+       (page.messages || []).forEach(envelope => dispatchLocal('private_message', envelope));
+       if (page.has_more) {
+           socket.emit('fetch_undelivered');
+       }
+   };
+
+   socket.on('session_bootstrap', (data) => {
+       dispatchLocal('auth_status', data.auth);
+       logMessage(`[SYSTEM]: ${data.welcome}`, 'server-msg');
+       const rooms = data.rooms || [];
+       if (rooms.length > 0) {
+           logMessage(`[SYSTEM]: RESTORED TO ROOMS: ${rooms.map(r => r.name).join(', ')}`, 'server-msg');
+       }
+       dispatchLocal('room_list', {rooms: rooms});
+       if (data.history.messages.length > 0) {
+           dispatchLocal('chat_history', data.history);
        }
+       const undelivered = data.undelivered.messages.length;
+       if (undelivered > 0) {
+           const count = data.undelivered.has_more ? `${undelivered}+` : `${undelivered}`;
+           logMessage(`[SYSTEM]: You have ${count} undelivered private messages!`, 'server-msg');
+       }
+       receiveUndelivered(data.undelivered);
    });
 
+   socket.on('undelivered_messages', receiveUndelivered);
+
  socket.on('chat_message', (data) => {
     if (data.type === 'file') {
-        const { filename, blob } = data.data;
-        const arr = atob(blob).split('').map(c => c.charCodeAt(0));
-        const url = URL.createObjectURL(new Blob([new Uint8Array(arr)]));
-        addMsg(`<b>${data.sender_name}:</b> [FILE] <a href="${url}" download="${filename}" style="color: var(--text-secondary); text-decoration: underline;">${filename}</a>`, 'chat');
+        addMsg(`<b>${data.sender_name}:</b> [FILE] ${fileLink(data.data, 'var(--text-secondary)')}`, 'chat');
     } else {
 
         const parsedData = parseJsonContent(data.data);
@@ -1414,20 +1511,15 @@ function connectToServer() {
     if (isDMInterfaceOpen && isCurrentDMUser) {
 
         if (data.type === 'file') {
-            const { filename, blob } = data.data;
-            const arr = atob(blob).split('').map(c => c.charCodeAt(0));
-            const url = URL.createObjectURL(new Blob([new Uint8Array(arr)]));
-            addPMMessage(data.sender_name, `[FILE] <a href="${url}" download="${filename}" style="color: #ff6666; text-decoration: underline;">${filename}</a>`, data.timestamp, false);
+            addPMMessage(data.sender_name, `[FILE] ${fileLink(data.data, '#ff6666')}`, data.timestamp, false);
         } else {
             addPMMessage(data.sender_name, data.data, data.timestamp, false);
         }
+        socket.emit('mark_pm_read', {username: data.sender_name});
     } else {
 
         if (data.type === 'file') {
-            const { filename, blob } = data.data;
-            const arr = atob(blob).split('').map(c => c.charCodeAt(0));
-            const url = URL.createObjectURL(new Blob([new Uint8Array(arr)]));
-            addMsg(`<b>Private from ${data.sender_name}:</b> [FILE] <a href="${url}" download="${filename}" style="color: #ff6666; text-decoration: underline;">${filename}</a>`, 'private');
+            addMsg(`<b>Private from ${data.sender_name}:</b> [FILE] ${fileLink(data.data, '#ff6666')}`, 'private');
         } else {
             addMsg(`<b>Private from ${data.sender_name}:</b> ${data.data}`, 'private');
         }
@@ -1438,10 +1530,7 @@ function connectToServer() {
 
    socket.on('room_message', (data) => {
        if (data.type === 'file') {
-           const { filename, blob } = data.data;
-           const arr = atob(blob).split('').map(c => c.charCodeAt(0));
-           const url = URL.createObjectURL(new Blob([new Uint8Array(arr)]));
-           addMsg(`<b>[${data.receiver_name}] ${data.sender_name}:</b> [FILE] <a href="${url}" download="${filename}" style="color: #6666ff; text-decoration: underline;">${filename}</a>`, 'room');
+           addMsg(`<b>[${data.receiver_name}] ${data.sender_name}:</b> [FILE] ${fileLink(data.data, '#6666ff')}`, 'room');
        } else {
            addMsg(`<b>[${data.receiver_name}] ${data.sender_name}:</b> ${data.data}`, 'room');
        }
@@ -1450,15 +1539,12 @@ function connectToServer() {
    });
 
    socket.on('users_list', (data) => {
-       if (data && data.users) {
-           logMessage(`ACTIVE USERS: ${data.users.join(', ')}`, 'system-msg');
-           updateUsersOnlineDisplay(data.users);
-       } else {
-           logMessage('ACTIVE USERS: None', 'system-msg');
-           updateUsersOnlineDisplay([]);
-       }
+       showActiveUsers((data && data.users) || []);
    });
 
+   socket.on('presence_snapshot', receivePresenceSnapshot);
+   socket.on('presence_delta', receivePresenceDelta);
+
    socket.on('room_list', (data) => {
        if (data && data.rooms) {
 
@@ -1496,10 +1582,8 @@ function connectToServer() {
        const messages = data.messages || [];
        messages.reverse().forEach(msg => {
            const username = msg.useruid || 'Unknown';
-           if (msg.message_type === 'file' && msg.filename && msg.blob) {
-               const arr = atob(msg.blob).split('').map(c => c.charCodeAt(0));
-               const url = URL.createObjectURL(new Blob([new Uint8Array(arr)]));
-               addMsg(`<b>${username}:</b> [FILE] <a href="${url}" download="${msg.filename}" style="color: var(--text-secondary); text-decoration: underline;">${msg.filename}</a>`, 'chat');
+           if (msg.message_type === 'file' && msg.file_id) {
+               addMsg(`<b>${username}:</b> [FILE] ${fileLink(msg, 'var(--text-secondary)')}`, 'chat');
            } else {
                addMsg(`<b>${username}:</b> ${msg.message || ''}`, 'chat');
            }
@@ -1507,16 +1591,50 @@ function connectToServer() {
        addMsg('<b>=== END HISTORY ===</b>', 'system');
    });
 
+   socket.on('search_results', (data) => {
+       const results = data.results || [];
+       addMsg(`<b>=== SEARCH: ${escapeHtml(data.query)} ===</b>`, 'system');
+       if (results.length === 0) {
+           addMsg('No matching messages', 'system');
+       }
+       results.forEach(hit => {
+           const where = hit.kind === 'global' ? 'global' : `${hit.kind} ${hit.target}`;
+           // Snippets are message text (matches bracketed by the server), so never markup
+           addMsg(`<b>[${escapeHtml(where)}] ${escapeHtml(hit.useruid)}:</b> ${escapeHtml(hit.snippet)} <i>(${escapeHtml(hit.created_at)})</i>`, 'system');
+       });
+       if (data.next_offset !== null && data.next_offset !== undefined) {
+           addMsg('More results available', 'system');
+       }
+       addMsg('<b>=== END SEARCH ===</b>', 'system');
+   });
+
+   socket.on('room_directory', (data) => {
+       const rooms = data.rooms || [];
+       roomDirectory.order = data.order || 'activity';
+       roomDirectory.after = data.next_after || null;
+       addMsg(`<b>=== ROOM DIRECTORY (${escapeHtml(roomDirectory.order)}) ===</b>`, 'system');
+       if (rooms.length === 0) {
+           addMsg('No rooms yet', 'system');
+       }
+       rooms.forEach(room => {
+           const joined = room.is_member ? ' [joined]' : '';
+           const active = room.last_activity_at ? `last active ${room.last_activity_at}` : 'no messages yet';
+           addMsg(`<b>${escapeHtml(room.name)}</b>${joined} - ${room.member_count} members, ${room.message_count} messages, ${escapeHtml(active)}<br><small>${escapeHtml(room.description || 'No description')}</small>`, 'system');
+       });
+       if (roomDirectory.after) {
+           addMsg('More rooms available: /directory more', 'system');
+       }
+       addMsg('<b>=== END DIRECTORY ===</b>', 'system');
+   });
+
    socket.on('room_history', (data) => {
        const room = data.room || '';
        addMsg(`<b>=== ROOM ${room} HISTORY ===</b>`, 'system');
        const messages = data.messages || [];
        messages.reverse().forEach(msg => {
            const username = msg.useruid || 'Unknown';
-           if (msg.message_type === 'file' && msg.filename && msg.blob) {
-               const arr = atob(msg.blob).split('').map(c => c.charCodeAt(0));
-               const url = URL.createObjectURL(new Blob([new Uint8Array(arr)]));
-               addMsg(`<b>[${room}] ${username}:</b> [FILE] <a href="${url}" download="${msg.filename}" style="color: #6666ff; text-decoration: underline;">${msg.filename}</a>`, 'room');
+           if (msg.message_type === 'file' && msg.file_id) {
+               addMsg(`<b>[${room}] ${username}:</b> [FILE] ${fileLink(msg, '#6666ff')}`, 'room');
            } else {
                addMsg(`<b>[${room}] ${username}:</b> ${msg.message || ''}`, 'room');
            }
@@ -1538,10 +1656,11 @@ function connectToServer() {
         } else {
             addMsg('<b>=== PRIVATE MESSAGE CONVERSATIONS ===</b>', 'system');
             conversations.forEach(conv => {
-                const username = conv.useruid || 'Unknown';
+                const username = conv.username || conv.useruid || 'Unknown';
                 const messageCount = conv.message_count || 0;
                 const lastMessage = conv.last_message_time || 'Never';
-                addMsg(`${username} - ${messageCount} messages (last: ${lastMessage})`, 'system');
+                const unread = conv.unread_count ? `, ${conv.unread_count} unread` : '';
+                addMsg(`${username} - ${messageCount} messages${unread} (last: ${lastMessage})`, 'system');
             });
             addMsg('<b>=== END PM LIST ===</b>', 'system');
         }
@@ -1558,8 +1677,8 @@ function connectToServer() {
         addMsg(`<b>=== PRIVATE MESSAGES WITH ${username} ===</b>`, 'system');
         data.messages.reverse().forEach(msg => {
             const sender = msg.useruid || 'Unknown';
-            if (msg.message_type === 'file' && msg.filename) {
-                addMsg(`<b>[PM ${sender}]:</b> [FILE: ${msg.filename}]`, 'private');
+            if (msg.message_type === 'file' && msg.file_id) {
+                addMsg(`<b>[PM ${sender}]:</b> [FILE] ${fileLink(msg, '#ff6666')}`, 'private');
             } else {
                 addMsg(`<b>[PM ${sender}]:</b> ${msg.message}`, 'private');
             }
@@ -1637,10 +1756,7 @@ function connectToServer() {
             }
         }
     } else if (data.type === 'file') {
-        const { filename, blob } = data.data;
-        const arr = atob(blob).split('').map(c => c.charCodeAt(0));
-        const url = URL.createObjectURL(new Blob([new Uint8Array(arr)]));
-        logMessage(`[ADVENTURE ${room_id} – ${sender_name} (${sender_role})] [FILE] <a href="${url}" download="${filename}" style="color: #66ff66; text-decoration: underline;">${filename}</a>`, 'adventure-msg');
+        logMessage(`[ADVENTURE ${room_id} – ${sender_name} (${sender_role})] [FILE] ${fileLink(data.data, '#66ff66')}`, 'adventure-msg');
     } else {
 
         const parsedMessage = parseJsonContent(message);
@@ -1722,13 +1838,6 @@ socket.on('turn_notification', (data) => {
    socket.on('reconnect', () => {
        logMessage('[SYSTEM] Connection restored', 'server-msg');
        updateConnectionStatus(true, username);
-
-       if (socket) {
-           socket.emit('set_username', {
-               username: username,
-               is_anonymous: currentUser.is_anonymous
-           });
-       }
    });
 
    socket.on('reconnect_attempt', (attemptNumber) => {
@@ -1752,7 +1861,6 @@ function showPMConversations() {
 
     loadPMConversations();
 
-    stopUsersAutoRefresh();
 }
 
 function loadPMConversations() {
@@ -1909,7 +2017,7 @@ function displayPMConversations(conversations) {
             <div class="pm-conversation-item" onclick="openPMChat('${username}')">
                 <div class="pm-user-info">
                     <div class="pm-username">${username}</div>
-                    <div class="pm-last-message">Last: ${lastMessage}</div>
+                    <div class="pm-last-message">${conv.last_message ? `${conv.last_sender || ''}: ${conv.last_message}` : `Last: ${lastMessage}`}</div>
                 </div>
                 <div class="pm-message-count">${messageCount}</div>
             </div>
@@ -1939,10 +2047,8 @@ function displayPMHistory(messages, targetUser) {
        const timestamp = msg.created_at || new Date().toISOString();
        const isSent = sender === username;
 
-       if (msg.message_type === 'file' && msg.filename) {
-
-           const fileContent = `[FILE: ${msg.filename}]`;
-           addPMMessage(sender, fileContent, timestamp, isSent);
+       if (msg.message_type === 'file' && msg.file_id) {
+           addPMMessage(sender, `[FILE] ${fileLink(msg, '#ff6666')}`, timestamp, isSent);
        } else {
            addPMMessage(sender, content, timestamp, isSent);
        }
@@ -2837,7 +2943,7 @@ function showBBSMainMenuEnhanced() {
     updateBBSTime();
 
     if (socket) {
-        socket.emit('get_users');
+        renderOnlineUsers();
         socket.emit('check_rooms');
 
         socket.emit('get_ai_room_updates');
@@ -2845,7 +2951,6 @@ function showBBSMainMenuEnhanced() {
 
     updateRoomAIStatus();
 
-    startUsersAutoRefresh();
     if (window.bbsTimeInterval) {
         clearInterval(window.bbsTimeInterval);
     }
@@ -3095,7 +3200,7 @@ function showBBSMainMenuWithAI() {
     updateBBSTime();
 
     if (socket) {
-        socket.emit('get_users');
+        renderOnlineUsers();
         socket.emit('check_rooms');
 
         requestTopicRooms();
@@ -3103,7 +3208,6 @@ function showBBSMainMenuWithAI() {
 
     updateAIStatus();
 
-    startUsersAutoRefresh();
     if (window.bbsTimeInterval) {
         clearInterval(window.bbsTimeInterval);
     }